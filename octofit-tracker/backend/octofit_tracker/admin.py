@@ -1,9 +1,30 @@
+from bson import ObjectId
+from django.conf import settings
 from django.contrib import admin
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker import search
+from octofit_tracker.changelist import LargeChangeListMixin
+from octofit_tracker.models import User, Team, Activity, Leaderboard, PeriodLeaderboard, TeamLeaderboard, Workout, Job
+
+
+class IndexedSearchMixin:
+    """
+    Answer the changelist search box from the search index (see search.py)
+    instead of a regex scan over ``search_fields``. Matches are capped at
+    ``SEARCH_ADMIN_MAX_RESULTS``.
+    """
+    search_kind = None
+    
+    def get_search_results(self, request, queryset, search_term):
+        ids = search.object_ids(self.search_kind, search_term, settings.SEARCH_ADMIN_MAX_RESULTS)
+        if ids is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=[ObjectId(object_id) for object_id in ids]), False
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(IndexedSearchMixin, LargeChangeListMixin, admin.ModelAdmin):
+    search_kind = 'user'
+    keyset_ordering = ('-created_at', '-_id')
     list_display = ['name', 'email', 'team', 'created_at']
     list_filter = ['team', 'created_at']
     search_fields = ['name', 'email']
@@ -18,24 +39,50 @@ class TeamAdmin(admin.ModelAdmin):
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(LargeChangeListMixin, admin.ModelAdmin):
+    keyset_ordering = ('-date', '-_id')
     list_display = ['user_email', 'activity_type', 'duration', 'calories', 'date']
-    list_filter = ['activity_type', 'date']
-    search_fields = ['user_email', 'activity_type']
+    list_filter = ['user_email', 'activity_type', 'date']
     ordering = ['-date']
 
 
 @admin.register(Leaderboard)
-class LeaderboardAdmin(admin.ModelAdmin):
+class LeaderboardAdmin(LargeChangeListMixin, admin.ModelAdmin):
+    keyset_ordering = ('rank', '_id')
     list_display = ['rank', 'user_name', 'team', 'total_calories', 'total_activities']
     list_filter = ['team']
     search_fields = ['user_name', 'user_email']
     ordering = ['rank']
 
 
+@admin.register(PeriodLeaderboard)
+class PeriodLeaderboardAdmin(LargeChangeListMixin, admin.ModelAdmin):
+    keyset_ordering = ('period', 'bucket', 'rank', '_id')
+    list_display = ['period', 'bucket', 'rank', 'user_name', 'team', 'total_calories', 'total_activities']
+    list_filter = ['period', 'bucket']
+    search_fields = ['user_name', 'user_email']
+    ordering = ['period', 'bucket', 'rank']
+
+
+@admin.register(TeamLeaderboard)
+class TeamLeaderboardAdmin(admin.ModelAdmin):
+    list_display = ['rank', 'team', 'total_calories', 'average_calories', 'active_members', 'total_activities']
+    search_fields = ['team']
+    ordering = ['rank']
+
+
 @admin.register(Workout)
-class WorkoutAdmin(admin.ModelAdmin):
+class WorkoutAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = 'workout'
     list_display = ['name', 'category', 'difficulty', 'estimated_calories', 'duration']
     list_filter = ['category', 'difficulty']
     search_fields = ['name', 'description', 'category']
     ordering = ['name']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'progress_done', 'progress_total', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['state', 'result', 'error', 'worker', 'started_at', 'heartbeat_at', 'finished_at']
+    ordering = ['-created_at']
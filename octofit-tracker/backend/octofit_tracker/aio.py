@@ -0,0 +1,33 @@
+"""
+Async MongoDB access for the ASGI read path.
+
+djongo pins pymongo 3.12, and the motor releases built on it (2.x) no longer
+import on Python 3.11, so this does what motor does internally: blocking
+pymongo calls run on a dedicated thread pool while the event loop keeps
+serving other requests. Every thread reads through djongo's MongoClient,
+so the async and sync paths share one connection pool per worker process.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executor = None
+
+
+def get_executor():
+    """Return the shared thread pool, sized by ``ASYNC_MONGO_THREADS``."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.ASYNC_MONGO_THREADS, thread_name_prefix='octofit-mongo')
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Await a blocking pymongo call without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context so request instrumentation sees the call.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, func, *args, **kwargs))
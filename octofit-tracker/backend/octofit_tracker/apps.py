@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from octofit_tracker import health, instrumentation, querycache, signals, tasks  # noqa: F401
+        instrumentation.install()
+        health.install()
+        querycache.install()
@@ -0,0 +1,325 @@
+"""
+Benchmark harness for the REST API.
+
+Drives every GET route registered on the router in ``urls.py`` (list,
+detail and extra actions) through the Django test client and records, per
+endpoint, p50/p95 latency, ORM queries, MongoDB wire commands, response
+size and memory. Seeding and database setup live in the ``bench_api``
+management command; results are plain JSON so runs can be compared.
+
+``run_concurrency`` drives the async read endpoints and their sync twins
+through the ASGI handler with bursts of simultaneous requests (see the
+``bench_concurrency`` command).
+
+``run_translation`` measures the CPU each endpoint spends per request and
+per ORM query with djongo translating every query and with the compiled
+translation cache (see ``querycache.py`` and the ``bench_translation``
+command).
+"""
+import asyncio
+import resource
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from pymongo import monitoring
+
+from octofit_tracker import querycache
+from octofit_tracker.models import User, Leaderboard, Workout
+from octofit_tracker.mongo import get_collection
+
+# Extra action url_name -> query params built from the seeded samples.
+ACTION_PARAMS = {
+    'by-team': lambda samples: {'team': samples['team']},
+    'by-user': lambda samples: {'email': samples['email']},
+    'by-difficulty': lambda samples: {'difficulty': samples['difficulty']},
+    'by-category': lambda samples: {'category': samples['category']},
+    'export': lambda samples: {'user_email': samples['email']},
+    'autocomplete': lambda samples: {'q': samples['name'][:3]},
+}
+
+# Router basename -> query params for list routes that require them.
+LIST_PARAMS = {
+    'search': lambda samples: {'q': samples['team']},
+}
+
+# URL kwargs for actions routed with a path parameter.
+ACTION_KWARGS = {
+    'around': lambda samples: {'email': samples['ranked_email']},
+}
+
+# (name, sync route, async route, params) for the concurrency comparison.
+CONCURRENCY_TARGETS = [
+    ('leaderboard', 'leaderboard-list', 'async-leaderboard', lambda samples: {}),
+    ('activities-by-user', 'activity-by-user', 'async-activities-by-user', lambda samples: {'email': samples['email']}),
+    ('workouts', 'workout-list', 'async-workouts', lambda samples: {}),
+]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count the wire commands sent by every pymongo client."""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def install_command_counter():
+    """Register a CommandCounter; only clients created afterwards report to it."""
+    counter = CommandCounter()
+    monitoring.register(counter)
+    return counter
+
+
+def use_mongomock():
+    """Point djongo at an in-process mongomock server (requires mongomock)."""
+    import mongomock
+    from djongo import database
+
+    clients = {}
+
+    def connect(db, **kwargs):
+        return clients.setdefault(db, mongomock.MongoClient())
+
+    database.connect = connect
+    connection.close()
+
+
+def samples():
+    """Pick existing values to feed the filtered actions."""
+    user = get_collection(User).find_one({}, {'name': 1, 'email': 1, 'team': 1}) or {}
+    workout = get_collection(Workout).find_one({}, {'difficulty': 1, 'category': 1}) or {}
+    ranked = get_collection(Leaderboard).find_one({}, {'user_email': 1}) or {}
+    return {
+        'name': user.get('name', ''),
+        'email': user.get('email', ''),
+        'ranked_email': ranked.get('user_email', ''),
+        'team': user.get('team', ''),
+        'difficulty': workout.get('difficulty', ''),
+        'category': workout.get('category', ''),
+    }
+
+
+def endpoint_targets(router):
+    """Yield ``(name, url, params)`` for every GET route on the router."""
+    values = samples()
+    for prefix, viewset, basename in router.registry:
+        model = viewset.queryset.model
+        document = get_collection(model).find_one({}, {'_id': 1})
+        pk = str(document['_id']) if document else None
+
+        yield f'{basename}-list', reverse(f'{basename}-list'), LIST_PARAMS.get(basename, lambda samples: {})(values)
+        if pk and hasattr(viewset, 'retrieve'):
+            yield f'{basename}-detail', reverse(f'{basename}-detail', args=[pk]), {}
+        for extra in viewset.get_extra_actions():
+            if 'get' not in extra.mapping or (extra.detail and not pk):
+                continue
+            name = f'{basename}-{extra.url_name}'
+            kwargs = ACTION_KWARGS.get(extra.url_name, lambda samples: {})(values)
+            if kwargs:
+                if not all(kwargs.values()):
+                    continue
+                url = reverse(name, kwargs=kwargs)
+            else:
+                url = reverse(name, args=[pk] if extra.detail else [])
+            params = ACTION_PARAMS.get(extra.url_name, lambda samples: {})(values)
+            yield name, url, params
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _get(client, url, params):
+    response = client.get(url, params)
+    body = b''.join(response.streaming_content) if response.streaming else response.content
+    return response, body
+
+
+def measure(client, url, params, requests, counter=None, warm_cache=False):
+    """Time ``requests`` GETs, then profile one more for queries and memory."""
+    latencies = []
+    for _ in range(max(1, requests)):
+        if not warm_cache:
+            caches['api'].clear()
+        start = time.perf_counter()
+        _get(client, url, params)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    if not warm_cache:
+        caches['api'].clear()
+    commands_before = counter.count if counter else 0
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        response, body = _get(client, url, params)
+    peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'orm_queries': len(queries),
+        'mongo_commands': counter.count - commands_before if counter else None,
+        'response_bytes': len(body),
+        'peak_alloc_kb': peak_alloc // 1024,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run(router, requests=20, counter=None, warm_cache=False):
+    """Benchmark every GET route; returns a list of result dicts."""
+    client = Client(SERVER_NAME='localhost')
+    results = []
+    for name, url, params in endpoint_targets(router):
+        result = measure(client, url, params, requests, counter, warm_cache)
+        results.append(dict(endpoint=name, url=url, params=params, **result))
+    return results
+
+
+def compare(previous, current):
+    """Yield ``(endpoint, metric, before, after, change)`` for shared endpoints."""
+    before = {result['endpoint']: result for result in previous['endpoints']}
+    for result in current['endpoints']:
+        old = before.get(result['endpoint'])
+        if old is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'orm_queries', 'mongo_commands'):
+            if old.get(metric) is None or result.get(metric) is None:
+                continue
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            yield result['endpoint'], metric, old[metric], result[metric], change
+
+
+class QueryCPU:
+    """Execute wrapper adding up the CPU time spent inside ``cursor.execute``."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # djongo translates in execute(); its Mongo cursors only run when fetched.
+        start = time.process_time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.process_time() - start
+            self.queries += 1
+
+
+def measure_cpu(client, url, params, requests):
+    """Mean CPU ms per request and per query over ``requests`` uncached GETs."""
+    timer = QueryCPU()
+    cpu = 0.0
+    with connection.execute_wrapper(timer):
+        for _ in range(max(1, requests)):
+            caches['api'].clear()
+            start = time.process_time()
+            _get(client, url, params)
+            cpu += time.process_time() - start
+    return {
+        'queries': timer.queries / max(1, requests),
+        'cpu_ms': cpu * 1000 / max(1, requests),
+        'query_cpu_ms': timer.seconds * 1000 / timer.queries if timer.queries else None,
+    }
+
+
+def run_translation(router, requests=20):
+    """Compare every GET route with djongo translation and with the translation cache."""
+    client = Client(SERVER_NAME='localhost')
+    results = []
+    for name, url, params in endpoint_targets(router):
+        caches['api'].clear()
+        # Also compiles the endpoint's query shapes.
+        response, _ = _get(client, url, params)
+        with querycache.disabled():
+            djongo = measure_cpu(client, url, params, requests)
+        before = querycache.cache.stats()
+        cached = measure_cpu(client, url, params, requests)
+        after = querycache.cache.stats()
+
+        result = {
+            'endpoint': name,
+            'url': url,
+            'params': params,
+            'status': response.status_code,
+            'orm_queries': djongo['queries'],
+            'cache_hits': after['hits'] - before['hits'],
+            'cache_bypassed': after['bypassed'] - before['bypassed'],
+        }
+        for metric in ('cpu_ms', 'query_cpu_ms'):
+            for mode, measured in (('djongo', djongo), ('cached', cached)):
+                value = measured[metric]
+                result[f'{metric}_{mode}'] = round(value, 3) if value is not None else None
+        results.append(result)
+    return results
+
+
+async def _timed_get(client, url, params):
+    start = time.perf_counter()
+    response = await client.get(url, params)
+    return response.status_code, (time.perf_counter() - start) * 1000
+
+
+async def measure_concurrency(client, url, params, concurrency, rounds=1):
+    """Fire ``rounds`` bursts of ``concurrency`` simultaneous GETs."""
+    statuses, latencies = [], []
+    start = time.perf_counter()
+    for _ in range(max(1, rounds)):
+        burst = [_timed_get(client, url, params) for _ in range(max(1, concurrency))]
+        for status, latency in await asyncio.gather(*burst):
+            statuses.append(status)
+            latencies.append(latency)
+    elapsed = time.perf_counter() - start
+    return {
+        'status': max(statuses),
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+    }
+
+
+def run_concurrency(levels=(1, 10, 50, 200), rounds=3, warm_cache=False):
+    """Compare each async endpoint with its sync twin at every concurrency level."""
+    values = samples()
+    targets = [
+        (name, reverse(sync_route), reverse(async_route), params(values))
+        for name, sync_route, async_route, params in CONCURRENCY_TARGETS
+    ]
+
+    async def main():
+        client = AsyncClient()
+        results = []
+        for name, sync_url, async_url, params in targets:
+            for level in levels:
+                for path, url in (('sync', sync_url), ('async', async_url)):
+                    result = await measure_concurrency(client, url, params, level, rounds)
+                    results.append(dict(endpoint=name, path=path, concurrency=level, url=url, **result))
+        return results
+
+    overrides = {'ALLOWED_HOSTS': settings.ALLOWED_HOSTS + ['testserver']}
+    if not warm_cache:
+        # Compare database paths, not the sync endpoints' response cache.
+        overrides['CACHES'] = {**settings.CACHES, 'api': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    with override_settings(**overrides):
+        return asyncio.run(main())
@@ -0,0 +1,147 @@
+"""
+Response caching for read-heavy endpoints.
+
+Cached responses live in the ``api`` cache alias (Redis when
+``API_CACHE_URL`` is set), which provides TTL expiry and LRU culling.
+Each namespace has a version token that is replaced on every write to the
+models it depends on; the token is part of every key, so invalidation is a
+single cache write and stale entries simply age out. The token doubles as
+the namespace's last-modified time for conditional GETs.
+
+Because the tokens live in the cache, every process must share it: without
+``API_CACHE_URL`` the alias is a dummy cache (nothing is cached) unless
+``API_CACHE_LOCAL`` opts a single process into local memory.
+"""
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.core.cache import caches
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from octofit_tracker.models import User, Team, Activity, Leaderboard, PeriodLeaderboard, TeamLeaderboard, Workout
+
+CACHE_ALIAS = 'api'
+
+# Response headers stored and replayed with the cached data.
+CACHED_HEADERS = ('X-Sync-Watermark',)
+
+# Namespace -> models whose writes change the cached responses.
+INVALIDATED_BY = {
+    'leaderboard': (Leaderboard, PeriodLeaderboard, TeamLeaderboard, Activity, User),
+    'teams': (Team, User),
+    'workouts': (Workout,),
+}
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(namespace):
+    return f'octofit:version:{namespace}'
+
+
+def namespace_version(namespace):
+    """Return the namespace's version token, creating one if it was evicted."""
+    cache = _cache()
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        # A fresh token never matches keys written under an evicted one.
+        cache.add(_version_key(namespace), str(time.time_ns()), None)
+        version = cache.get(_version_key(namespace)) or str(time.time_ns())
+    return version
+
+
+def invalidate(namespace):
+    """Drop every cached response of ``namespace``."""
+    _cache().set(_version_key(namespace), str(time.time_ns()), None)
+
+
+def invalidate_for(model):
+    """Drop the cached responses of every namespace that depends on ``model``."""
+    for namespace, models in INVALIDATED_BY.items():
+        if model in models:
+            invalidate(namespace)
+
+
+def response_key(namespace, version, request):
+    # Paginated bodies carry absolute next/previous links, so the origin is part of the key.
+    params = sorted(request.query_params.lists())
+    raw = json.dumps([request.scheme, request.get_host(), request.path, params])
+    return f'octofit:response:{namespace}:{version}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def data_etag(data):
+    """A strong ETag over the JSON rendering of ``data``."""
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True)
+    return quote_etag(hashlib.md5(body.encode()).hexdigest())
+
+
+def version_etag(request, version, ignore=()):
+    """
+    A strong ETag for ``request``'s origin, path and query parameters (less
+    ``ignore``) over a data ``version`` such as ``sync.version``'s.
+    """
+    params = sorted((name, values) for name, values in request.query_params.lists() if name not in ignore)
+    raw = json.dumps([request.scheme, request.get_host(), request.path, params, version])
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+
+def not_modified(request, etag, last_modified):
+    """Evaluate If-None-Match / If-Modified-Since against the cached entry."""
+    if request.headers.get('If-None-Match') is not None:
+        return etag_matches(request, etag)
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def cached_response(namespace):
+    """
+    Cache a GET action's ``response.data`` under ``namespace``.
+
+    Only 200 responses are stored. Responses carry ``ETag`` and
+    ``Last-Modified`` so clients can revalidate and receive a 304.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            version = namespace_version(namespace)
+            key = response_key(namespace, version, request)
+            entry = _cache().get(key)
+
+            if entry is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                entry = {
+                    'data': response.data,
+                    'etag': data_etag(response.data),
+                    'last_modified': int(version) / 1e9,
+                    'headers': {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+                }
+                _cache().set(key, entry)
+            else:
+                response = None
+
+            if not_modified(request, entry['etag'], entry['last_modified']):
+                response = HttpResponseNotModified()
+            elif response is None:
+                response = Response(entry['data'])
+            for name, value in entry.get('headers', {}).items():
+                response[name] = value
+            response['ETag'] = entry['etag']
+            response['Last-Modified'] = http_date(entry['last_modified'])
+            return response
+        return wrapper
+    return decorator
+
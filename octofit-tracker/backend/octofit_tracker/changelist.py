@@ -0,0 +1,166 @@
+"""
+Admin changelists for large collections.
+
+The stock changelist counts the filtered and the unfiltered queryset on
+every page load, runs a ``DISTINCT`` scan for each value filter and pages
+with ``OFFSET``, which MongoDB answers by walking every skipped document.
+``LargeChangeListMixin`` replaces the three when ``ADMIN_LARGE_CHANGELISTS``
+is on:
+
+* counts come from ``estimated_document_count`` (collection metadata) for
+  an unfiltered list, and are capped at ``ADMIN_COUNT_LIMIT`` otherwise;
+* value filters on text fields list the values of a ``distinct`` cached
+  per process, refreshed every ``ADMIN_FACET_CACHE_SECONDS``;
+* pages follow an opaque ``cursor`` on the admin's ``keyset_ordering``
+  (see ``pagination.KeysetPagination``), with previous/next links. Sorting
+  by a column header falls back to numbered pages.
+"""
+from django.conf import settings
+from django.contrib.admin.filters import AllValuesFieldListFilter
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import models
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+
+from octofit_tracker.mongo import get_collection
+from octofit_tracker.pagination import KeysetPagination
+
+CURSOR_VAR = 'cursor'
+
+
+def facet_values(model, field_name):
+    """The distinct values of ``field_name``, cached for ``ADMIN_FACET_CACHE_SECONDS``."""
+    column = model._meta.get_field(field_name).column
+    key = f'octofit:facets:{model._meta.db_table}:{column}'
+
+    def load():
+        values = get_collection(model).distinct(column)
+        return sorted(values, key=lambda value: (value is None, str(value)))
+
+    return cache.get_or_set(key, load, settings.ADMIN_FACET_CACHE_SECONDS)
+
+
+class CachedValuesFieldListFilter(AllValuesFieldListFilter):
+    """``AllValuesFieldListFilter`` listing the cached values of ``facet_values``."""
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        # The parent's DISTINCT queryset is lazy and never evaluated.
+        self.lookup_choices = facet_values(model, field_path)
+
+
+class EstimatedCountPaginator(Paginator):
+    """A ``Paginator`` whose count never scans the collection."""
+
+    @cached_property
+    def estimated(self):
+        return not self.object_list.query.where
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if self.estimated:
+            return get_collection(queryset.model).estimated_document_count()
+        return len(queryset.values_list('pk', flat=True)[:settings.ADMIN_COUNT_LIMIT])
+
+    @property
+    def count_display(self):
+        """The count as shown: '~N' when estimated, 'N+' when capped."""
+        if self.estimated:
+            return f'~{self.count}'
+        if self.count >= settings.ADMIN_COUNT_LIMIT:
+            return f'{self.count}+'
+        return str(self.count)
+
+
+class KeysetChangeList(ChangeList):
+    """A ``ChangeList`` paged by cursor on the admin's ``keyset_ordering``."""
+    keyset = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Changing a filter, the search or the sort starts again from the first page.
+        return super().get_query_string(new_params, [CURSOR_VAR, *(remove or [])])
+
+    def get_results(self, request):
+        ordering = self.model_admin.keyset_ordering
+        if not ordering or ORDER_VAR in self.params or self.list_editable:
+            return super().get_results(request)
+
+        keyset = KeysetPagination()
+        keyset.ordering = ordering
+        keyset.model = self.model
+        keyset.page_size = self.list_per_page
+        try:
+            keyset.position, keyset.reverse = keyset.parse_cursor(request.GET.get(CURSOR_VAR))
+        except NotFound:
+            raise IncorrectLookupParameters
+        rows = keyset.page_rows(list(keyset.seek(self.queryset)[:self.list_per_page + 1]))
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = keyset.has_next or keyset.has_previous
+        self.keyset = keyset
+
+    def cursor_url(self, position, reverse):
+        return self.get_query_string({CURSOR_VAR: self.keyset.cursor_token(position, reverse)})
+
+    @property
+    def next_url(self):
+        if self.keyset and self.keyset.has_next and self.keyset.last_position is not None:
+            return self.cursor_url(self.keyset.last_position, reverse=False)
+
+    @property
+    def previous_url(self):
+        if self.keyset and self.keyset.has_previous and self.keyset.first_position is not None:
+            return self.cursor_url(self.keyset.first_position, reverse=True)
+
+
+class LargeChangeListMixin:
+    """
+    Estimated counts, cached value filters and cursor paging for a
+    ``ModelAdmin`` (see the module docstring). ``keyset_ordering`` must end
+    with ``_id`` and should match an index.
+    """
+    keyset_ordering = None
+    change_list_template = 'admin/octofit_tracker/large_change_list.html'
+
+    @property
+    def show_full_result_count(self):
+        return not settings.ADMIN_LARGE_CHANGELISTS
+
+    def get_changelist(self, request, **kwargs):
+        if settings.ADMIN_LARGE_CHANGELISTS:
+            return KeysetChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if settings.ADMIN_LARGE_CHANGELISTS:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if not settings.ADMIN_LARGE_CHANGELISTS:
+            return list_filter
+        return [self._cached_filter(item) for item in list_filter]
+
+    def _cached_filter(self, item):
+        if not isinstance(item, str) or '__' in item:
+            return item
+        field = self.model._meta.get_field(item)
+        if isinstance(field, models.CharField) and not field.choices:
+            return (item, CachedValuesFieldListFilter)
+        return item
@@ -0,0 +1,223 @@
+"""
+Propagation of denormalized user and team fields.
+
+Activities and the leaderboards copy ``User.email``, ``User.name`` and
+``User.team``, and users copy ``Team.name``. When a user or a team is saved
+with a changed value, ``propagate_user`` and ``propagate_team`` rewrite the
+copies with one indexed ``update_many`` per dependent collection, recompute
+the entries and series of the affected emails and teams (merging into any
+the new email or name already has), and reindex the rewritten objects for
+search, instead of rebuilding everything.
+Rewritten users and activities get a new ``updated_at`` for delta sync,
+and activities that moved to a new email are tombstoned for the old one.
+
+The signals in ``signals.py`` hand changes to ``dispatch``, which runs them
+inline (``DENORMALIZATION_MODE=sync``) or enqueues them as jobs
+(``queue``, see ``jobs.py``). The jobs share the ``LANE`` lane, so workers
+apply them one at a time in the order the changes were saved. Writes that
+bypass ``save()``, such as ``QuerySet.update``, are not propagated;
+``check`` finds and repairs what drifted, a batch of users at a time.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from octofit_tracker import caching, jobs, leaderboard, rollups, search, sync
+from octofit_tracker.models import User, Team, Activity, Leaderboard, PeriodLeaderboard, TeamLeaderboard
+from octofit_tracker.mongo import get_collection
+
+MODES = ('sync', 'queue')
+
+# Job lane of the propagate_* jobs: one change propagates at a time.
+LANE = 'denormalize'
+
+# Field -> (model, column) copies of a user's value, keyed by the user's email.
+# The leaderboard entries of a changed email are recomputed instead (see
+# leaderboard.refresh_users), as the new email may already have some.
+USER_COPIES = {
+    'email': [(Activity, 'user_email')],
+    'name': [(Leaderboard, 'user_name'), (PeriodLeaderboard, 'user_name')],
+    'team': [(Leaderboard, 'team'), (PeriodLeaderboard, 'team')],
+}
+
+# (model, column) copies of a team's name. TeamLeaderboard is handled by
+# leaderboard.rename_team, which merges into an entry that already exists.
+# Team totals and series are recomputed rather than moved by deltas, so a
+# propagation job retried after a crash leaves them as they should be.
+TEAM_COPIES = [(User, 'team'), (Leaderboard, 'team'), (PeriodLeaderboard, 'team')]
+
+
+def dispatch(kind, *args):
+    """Run the ``propagate_<kind>`` change now or queue it, per ``DENORMALIZATION_MODE``."""
+    mode = settings.DENORMALIZATION_MODE
+    if mode not in MODES:
+        raise ImproperlyConfigured(f'DENORMALIZATION_MODE must be one of: {", ".join(MODES)}')
+    if mode == 'queue':
+        return jobs.enqueue(f'propagate_{kind}', {'args': list(args)}, lane=LANE)
+    PROPAGATE[kind](*args)
+
+
+def _set(model, column, value):
+    """The update rewriting a copy; delta-synced models also get a new ``updated_at``."""
+    changes = {column: value}
+    if model in sync.KINDS:
+        changes['updated_at'] = timezone.now()
+    return {'$set': changes}
+
+
+def propagate_user(previous, current):
+    """
+    Rewrite the copies of a user's changed fields.
+
+    ``previous`` and ``current`` map ``email``, ``name`` and ``team`` to the
+    user's values before and after the save.
+    """
+    email_changed = previous['email'] != current['email']
+    if email_changed:
+        moved = [activity['_id'] for activity in get_collection(Activity).find(
+            {'user_email': previous['email']}, {'_id': 1}
+        )]
+        for model, column in USER_COPIES['email']:
+            get_collection(model).update_many({column: previous['email']}, _set(model, column, current['email']))
+        sync.record_moves('activity', moved, previous['email'])
+        leaderboard.refresh_users([previous['email'], current['email']])
+        for email in (previous['email'], current['email']):
+            rollups.refresh_user(email)
+
+    for field in ('name', 'team'):
+        # Entries merged from the new email's own may carry another name or team.
+        if previous[field] != current[field] or email_changed:
+            for model, column in USER_COPIES[field]:
+                get_collection(model).update_many({'user_email': current['email']},
+                                                  _set(model, column, current[field]))
+
+    if previous['team'] != current['team'] or email_changed:
+        leaderboard.refresh_teams([previous['team'], current['team']])
+        user_buckets = rollups.buckets('user', current['email'])
+        for team in (previous['team'], current['team']):
+            rollups.refresh_team(team, user_buckets)
+    caching.invalidate_for(Leaderboard)
+
+
+def propagate_team(previous_name, name):
+    """Rewrite every copy of a renamed team's name."""
+    for model, column in TEAM_COPIES:
+        get_collection(model).update_many({column: previous_name}, _set(model, column, name))
+    for _ in search.reindex('user', {'team': name}):
+        pass
+    leaderboard.rename_team(previous_name, name)
+    rollups.rename_team(previous_name, name)
+    caching.invalidate_for(Leaderboard)
+    caching.invalidate_for(Team)
+
+
+PROPAGATE = {'user': propagate_user, 'team': propagate_team}
+
+
+def user_batches(batch_size, after=None):
+    """Yield users ordered by ``_id`` in batches, starting past ``after``."""
+    users = get_collection(User)
+    last = after
+    while True:
+        match = {'_id': {'$gt': last}} if last is not None else {}
+        batch = list(users.find(match, {'email': 1, 'name': 1, 'team': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]['_id']
+
+
+def _stale_entries(model, users):
+    """Return ``{email: count}`` of ``model`` entries whose name or team drifted."""
+    stale = {}
+    entries = get_collection(model).find(
+        {'user_email': {'$in': list(users)}}, {'user_email': 1, 'user_name': 1, 'team': 1}
+    )
+    for entry in entries:
+        user = users[entry['user_email']]
+        if entry.get('user_name') != user.get('name', entry['user_email']) or entry.get('team') != user.get('team', ''):
+            stale[entry['user_email']] = stale.get(entry['user_email'], 0) + 1
+    return stale
+
+
+def _team_totals_drift():
+    """Return the teams whose leaderboard totals disagree with their members'."""
+    expected = {
+        team: tuple(group[field] for field in leaderboard.TEAM_TOTALS)
+        for team, group in leaderboard.member_totals().items()
+    }
+    actual = {
+        entry['team']: tuple(leaderboard.totals(entry, leaderboard.TEAM_TOTALS).values())
+        for entry in get_collection(TeamLeaderboard).find()
+    }
+    return sorted(team for team in expected.keys() | actual.keys() if expected.get(team) != actual.get(team))
+
+
+def _orphan_emails(batch_size):
+    """Yield activity emails that belong to no user, checking a batch at a time."""
+    emails = (group['_id'] for group in get_collection(Activity).aggregate(
+        [{'$group': {'_id': '$user_email'}}], allowDiskUse=True
+    ))
+    users = get_collection(User)
+    batch = []
+    for email in emails:
+        batch.append(email)
+        if len(batch) == batch_size:
+            yield from _missing_users(users, batch)
+            batch = []
+    yield from _missing_users(users, batch)
+
+
+def _missing_users(users, emails):
+    known = {user['email'] for user in users.find({'email': {'$in': emails}}, {'email': 1})}
+    return [email for email in emails if email not in known]
+
+
+def new_report():
+    return {'users_checked': 0, 'stale_entries': 0, 'repaired_entries': 0}
+
+
+def check_users(batch, report, repair=False):
+    """Check (and with ``repair`` rewrite) the leaderboard entries of a batch of users."""
+    report['users_checked'] += len(batch)
+    users = {user['email']: user for user in batch}
+    for model in (Leaderboard, PeriodLeaderboard):
+        stale = _stale_entries(model, users)
+        report['stale_entries'] += sum(stale.values())
+        if repair:
+            for email in stale:
+                result = get_collection(model).update_many({'user_email': email}, {'$set': {
+                    'user_name': users[email].get('name', email),
+                    'team': users[email].get('team', ''),
+                }})
+                report['repaired_entries'] += result.modified_count
+
+
+def check_teams(report, batch_size=500, repair=False):
+    """Check team totals, orphaned activities and unknown teams once every user is checked."""
+    report['drifted_teams'] = _team_totals_drift()
+    if repair and report['drifted_teams']:
+        leaderboard.rebuild_teams()
+    report['orphan_activity_emails'] = list(_orphan_emails(batch_size))
+    teams = set(get_collection(Team).distinct('name'))
+    report['unknown_teams'] = sorted(
+        team for team in get_collection(User).distinct('team') if team and team not in teams
+    )
+    if repair and (report['repaired_entries'] or report['drifted_teams']):
+        caching.invalidate_for(Leaderboard)
+
+
+def check(batch_size=500, repair=False):
+    """
+    Find denormalized copies that no longer match their source.
+
+    Leaderboard entries with a stale name or team are rewritten when
+    ``repair`` is set, and the team leaderboard is rebuilt from the user
+    entries if its totals drifted. Activities of unknown users and users of
+    unknown teams are only reported. Returns a report dict.
+    """
+    report = new_report()
+    for batch in user_batches(batch_size):
+        check_users(batch, report, repair)
+    check_teams(report, batch_size, repair)
+    return report
@@ -0,0 +1,79 @@
+"""
+Streaming export of activities as NDJSON or CSV.
+
+Documents come straight from a pymongo cursor with a bounded ``batch_size``
+and are encoded a batch at a time, so memory use is independent of how
+many activities are exported.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from rest_framework.fields import DateTimeField
+
+from octofit_tracker.models import Activity
+from octofit_tracker.mongo import get_read_collection
+
+EXPORT_FIELDS = ['_id', 'user_email', 'activity_type', 'duration', 'calories', 'date', 'updated_at']
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+_date_field = DateTimeField()
+
+
+def activity_documents(match, batch_size=1000):
+    """Open a server-side cursor over the matching activities, oldest first."""
+    projection = {field: 1 for field in EXPORT_FIELDS}
+    return get_read_collection(Activity).find(match, projection, batch_size=batch_size).sort('date', 1)
+
+
+def to_row(document):
+    """Render a raw document the same way ``ActivitySerializer`` does."""
+    return {
+        '_id': str(document['_id']),
+        'user_email': document.get('user_email'),
+        'activity_type': document.get('activity_type'),
+        'duration': document.get('duration'),
+        'calories': document.get('calories'),
+        'date': _date_field.to_representation(document['date']) if document.get('date') else None,
+        'updated_at': _date_field.to_representation(document['updated_at']) if document.get('updated_at') else None,
+    }
+
+
+def _chunks(documents, rows_per_chunk):
+    iterator = iter(documents)
+    while True:
+        chunk = [to_row(document) for document in islice(iterator, rows_per_chunk)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def ndjson_stream(documents, rows_per_chunk=500):
+    """Yield NDJSON text, one chunk of rows at a time."""
+    for chunk in _chunks(documents, rows_per_chunk):
+        yield ''.join(json.dumps(row) + '\n' for row in chunk)
+
+
+def csv_stream(documents, rows_per_chunk=500):
+    """Yield CSV text with a header row, one chunk of rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for chunk in _chunks(documents, rows_per_chunk):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+STREAMS = {
+    'ndjson': ndjson_stream,
+    'csv': csv_stream,
+}
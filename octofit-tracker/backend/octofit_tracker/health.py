@@ -0,0 +1,156 @@
+"""
+MongoDB connection pool monitoring and the health endpoint.
+
+``PoolMonitor`` is a pymongo pool listener that keeps, per server address,
+the pool size limit, open and checked-out connections, checkout failures
+and the time requests waited for a connection. ``health_view`` pings the
+database and reports those figures, so pools can be sized per worker.
+The figures are per process.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from pymongo import monitoring
+
+from octofit_tracker.mongo import get_database
+
+
+class PoolStats:
+    def __init__(self, max_pool_size=None):
+        self.max_pool_size = max_pool_size
+        self.open = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.cleared = 0
+
+    def as_dict(self):
+        utilization = self.in_use / self.max_pool_size if self.max_pool_size else None
+        return {
+            'max_pool_size': self.max_pool_size,
+            'open': self.open,
+            'in_use': self.in_use,
+            'idle': max(0, self.open - self.in_use),
+            'utilization': round(utilization, 3) if utilization is not None else None,
+            'checkouts': self.checkouts,
+            'checkout_failures': self.checkout_failures,
+            'wait_ms_avg': round(self.wait_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            'wait_ms_max': round(self.max_wait_seconds * 1000, 3),
+            'cleared': self.cleared,
+        }
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Track pool usage and checkout wait time for every pymongo client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waits = threading.local()
+        self.pools = {}
+
+    def _pool(self, address):
+        return self.pools.setdefault(address, PoolStats())
+
+    def snapshot(self):
+        with self._lock:
+            return {'%s:%s' % address: pool.as_dict() for address, pool in self.pools.items()}
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address).max_pool_size = event.options.get('maxPoolSize')
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._pool(event.address).cleared += 1
+
+    def pool_closed(self, event):
+        with self._lock:
+            self.pools.pop(event.address, None)
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address).open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool.open = max(0, pool.open - 1)
+
+    def connection_check_out_started(self, event):
+        # Start and end of a checkout are published on the waiting thread.
+        self._waits.__dict__[event.address] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited(event.address)
+        with self._lock:
+            pool = self._pool(event.address)
+            pool.checkout_failures += 1
+            pool.max_wait_seconds = max(pool.max_wait_seconds, waited)
+
+    def connection_checked_out(self, event):
+        waited = self._waited(event.address)
+        with self._lock:
+            pool = self._pool(event.address)
+            pool.in_use += 1
+            pool.checkouts += 1
+            pool.wait_seconds += waited
+            pool.max_wait_seconds = max(pool.max_wait_seconds, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool.in_use = max(0, pool.in_use - 1)
+
+    def _waited(self, address):
+        started = self._waits.__dict__.pop(address, None)
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def prometheus(self):
+        lines = []
+        pools = self.snapshot()
+        for name in ('max_pool_size', 'open', 'in_use', 'checkouts', 'checkout_failures', 'wait_ms_max'):
+            metric = f'octofit_mongo_pool_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            for address, pool in sorted(pools.items()):
+                lines.append(f'{metric}{{address="{address}"}} {pool[name] or 0}')
+        return '\n'.join(lines) + '\n'
+
+
+monitor = PoolMonitor()
+
+
+def install():
+    """Register the pool monitor; call before any MongoClient exists."""
+    monitoring.register(monitor)
+
+
+def health_view(request, using='default'):
+    """Ping MongoDB and report connection pool usage; 503 when unreachable."""
+    client_settings = connections[using].settings_dict.get('CLIENT', {})
+    body = {
+        'status': 'ok',
+        'database': {'name': connections[using].settings_dict['NAME']},
+        'pool_settings': {
+            key: client_settings.get(key)
+            for key in ('maxPoolSize', 'minPoolSize', 'waitQueueTimeoutMS', 'serverSelectionTimeoutMS')
+        },
+        'read_preference': settings.MONGO_READ_PREFERENCE,
+    }
+    start = time.perf_counter()
+    try:
+        get_database(using).command('ping')
+    except Exception as exc:
+        body['status'] = 'error'
+        body['database']['error'] = str(exc)
+    else:
+        body['database']['ping_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    body['pools'] = monitor.snapshot()
+    return JsonResponse(body, status=200 if body['status'] == 'ok' else 503)
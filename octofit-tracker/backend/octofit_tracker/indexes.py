@@ -0,0 +1,179 @@
+"""
+MongoDB index management for the models declared in ``models.py``.
+
+djongo only builds ``Meta.indexes`` when tables are created through
+migrations, and it mangles descending keys into a field literally named
+``'date" DESC'``. The indexes are therefore read from the model declarations
+and applied with pymongo. Matching is done on the key specification, so an
+index that already exists under a different name is left alone, while a
+declared name that points at the wrong keys is rebuilt. ``UniqueConstraint``
+declarations become unique indexes, and indexes listed in
+``EXPIRE_AFTER_SECONDS`` are created as TTL indexes.
+
+``replace_collection`` swaps in a rebuilt collection carrying the same
+indexes, for rebuilds that must not expose a half-written collection.
+"""
+from bson import ObjectId
+from django.apps import apps
+from django.conf import settings
+from django.db.models import UniqueConstraint
+from pymongo import ASCENDING, DESCENDING
+
+from octofit_tracker.mongo import get_collection
+
+# Index name -> the queries it exists to serve.
+COVERED_QUERIES = {
+    'users_email_uniq': ['UserViewSet create/update (unique email)', 'leaderboard user lookup'],
+    'user_team': ['UserViewSet.by_team', 'TeamSerializer.member_count'],
+    'user_created': ['UserAdmin changelist (cursor paging)'],
+    'teams_name_uniq': ['TeamViewSet create/update (unique name)'],
+    'activity_user_date': ['ActivityViewSet.by_user'],
+    'activity_date': ['ActivityViewSet.list', 'ActivityAdmin changelist (cursor paging)'],
+    'leaderboard_user_email_uniq': ['leaderboard.apply_activity_delta'],
+    'leaderboard_rank': ['LeaderboardViewSet.list', 'leaderboard re-ranking', 'LeaderboardAdmin changelist'],
+    'leaderboard_team_rank': ['LeaderboardViewSet.by_team'],
+    'workout_difficulty': ['WorkoutViewSet.by_difficulty'],
+    'workout_category': ['WorkoutViewSet.by_category'],
+    'period_leaderboard_user': ['leaderboard.apply_activity_delta (per period)'],
+    'period_leaderboard_rank': ['LeaderboardViewSet.list ?period=', 'period re-ranking', 'PeriodLeaderboardAdmin changelist'],
+    'period_leaderboard_expiry': ['expiry of old period buckets (TTL)'],
+    'leaderboard_teams_team_uniq': ['leaderboard team totals update'],
+    'team_leaderboard_rank': ['TeamLeaderboardViewSet.list', 'team re-ranking'],
+    'job_status_created': ['jobs.claim'],
+    'job_lane': ['jobs.claim (oldest unfinished job of a lane)'],
+    'rollup_bucket': ['rollups.apply (per bucket upserts)'],
+    'rollup_range': ['ActivityViewSet.rollups', 'TeamViewSet.rollups'],
+    'rollup_start': ['rollups.rebuild_week (buckets of a week)'],
+    'search_entry_object': ['search.index_many upserts', 'search.remove'],
+    'search_terms': ['SearchViewSet.list', 'admin changelist search'],
+    'search_title_terms': ['SearchViewSet.autocomplete (word prefix)'],
+    'search_kind_prefix': ['SearchViewSet.autocomplete (title prefix)'],
+    'user_updated': ['UserViewSet.list ?updated_since=', 'sync.version'],
+    'activity_user_updated': ['ActivityViewSet.by_user ?updated_since=', 'sync.version (one user)'],
+    'activity_updated': ['sync.version (all activities)', 'leaderboard rebuild replay'],
+    'workout_updated': ['WorkoutViewSet.list ?updated_since='],
+    'tombstone_kind_owner': ['sync.deleted_since', 'sync.version (one owner)'],
+    'tombstone_kind': ['sync.version (any owner)', 'leaderboard rebuild replay'],
+    'tombstone_expiry': ['expiry of old tombstones (TTL)'],
+}
+
+# TTL index name -> seconds after the indexed date that MongoDB deletes a document.
+EXPIRE_AFTER_SECONDS = {
+    'period_leaderboard_expiry': 0,
+    'tombstone_expiry': settings.SYNC_TOMBSTONE_RETENTION_DAYS * 24 * 60 * 60,
+}
+
+
+def declared_indexes(model):
+    """Return ``(name, keys, unique)`` for every index the model declares."""
+    opts = model._meta
+    declared = []
+    for field in opts.local_fields:
+        if field.unique and not field.primary_key:
+            name = f'{opts.db_table}_{field.column}_uniq'
+            declared.append((name, [(field.column, ASCENDING)], True))
+    for constraint in opts.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields:
+            keys = [(opts.get_field(field_name).column, ASCENDING) for field_name in constraint.fields]
+            declared.append((constraint.name, keys, True))
+    for index in opts.indexes:
+        keys = [
+            (opts.get_field(field_name).column, DESCENDING if order == 'DESC' else ASCENDING)
+            for field_name, order in index.fields_orders
+        ]
+        declared.append((index.name, keys, False))
+    return declared
+
+
+def _key_spec(keys):
+    return tuple((field, int(direction)) for field, direction in keys)
+
+
+def _options(name, unique):
+    options = {'unique': unique}
+    if name in EXPIRE_AFTER_SECONDS:
+        options['expireAfterSeconds'] = EXPIRE_AFTER_SECONDS[name]
+    return options
+
+
+def _has_options(info, options):
+    return (
+        bool(info.get('unique')) == options['unique']
+        and info.get('expireAfterSeconds') == options.get('expireAfterSeconds')
+    )
+
+
+def sync_indexes(model, drop=False, dry_run=False, using='default'):
+    """
+    Create missing indexes for ``model`` and optionally drop undeclared ones.
+
+    Returns a list of ``(action, declared name, keys)`` tuples where action is
+    one of ``'exists'``, ``'created'``, ``'rebuilt'`` or ``'dropped'``.
+    """
+    collection = get_collection(model, using)
+    information = collection.index_information()
+    existing = {_key_spec(info['key']): name for name, info in information.items()}
+    existing_names = {name: spec for spec, name in existing.items()}
+
+    report = []
+    declared_specs = set()
+    for name, keys, unique in declared_indexes(model):
+        spec = _key_spec(keys)
+        declared_specs.add(spec)
+        options = _options(name, unique)
+
+        action = 'created'
+        if spec in existing:
+            if _has_options(information[existing[spec]], options):
+                report.append(('exists', name, keys))
+                continue
+            # Same keys without the declared unique/TTL options.
+            action = 'rebuilt'
+            stale = existing.pop(spec)
+            existing_names.pop(stale, None)
+            if not dry_run:
+                collection.drop_index(stale)
+        if name in existing_names:
+            action = 'rebuilt'
+            del existing[existing_names.pop(name)]
+            if not dry_run:
+                collection.drop_index(name)
+        if not dry_run:
+            collection.create_index(keys, name=name, background=True, **options)
+        report.append((action, name, keys))
+
+    if drop:
+        for spec, name in existing.items():
+            if name == '_id_' or spec in declared_specs:
+                continue
+            if not dry_run:
+                collection.drop_index(name)
+            report.append(('dropped', name, list(spec)))
+    return report
+
+
+def replace_collection(model, documents, using='default'):
+    """
+    Replace the contents of ``model``'s collection with ``documents`` at once.
+
+    The documents are written to a scratch collection with the declared
+    indexes, which is then renamed over the live one: readers see the old
+    contents until the new ones are complete, and writes to the live
+    collection cannot collide with the insert.
+    """
+    collection = get_collection(model, using)
+    scratch = collection.database[f'{collection.name}__rebuild_{ObjectId()}']
+    try:
+        for name, keys, unique in declared_indexes(model):
+            scratch.create_index(keys, name=name, **_options(name, unique))
+        if documents:
+            scratch.insert_many(documents)
+        scratch.rename(collection.name, dropTarget=True)
+    except Exception:
+        scratch.drop()
+        raise
+
+
+def managed_models():
+    """Models of this app whose collections carry managed indexes."""
+    return list(apps.get_app_config('octofit_tracker').get_models())
@@ -0,0 +1,231 @@
+"""
+Per-request query and timing instrumentation.
+
+``RequestTimingMiddleware`` measures each request and splits its time into:
+
+* ``translate`` - time inside djongo ``cursor.execute`` that was not spent
+  waiting on MongoDB, i.e. SQL parsing and SQL-to-Mongo translation;
+* ``mongo`` - wire time of every MongoDB command, reported by a pymongo
+  command listener (this includes direct pymongo access that bypasses the
+  ORM);
+* ``render`` - DRF response rendering;
+* ``total`` - the whole request.
+
+The figures are sent back as a ``Server-Timing`` header, and can optionally
+be logged as one JSON line per request (``REQUEST_TIMING_LOG``) or
+aggregated per view for a Prometheus text endpoint
+(``REQUEST_METRICS_ENDPOINT``). The aggregates are per process.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from pymongo import monitoring
+
+from octofit_tracker.health import monitor
+from octofit_tracker.querycache import cache as translation_cache
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('octofit_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.db_calls = 0
+        self.db_seconds = 0.0
+        self.translate_seconds = 0.0
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.render_started = None
+        self.render_seconds = 0.0
+        self.total_seconds = 0.0
+        self.response_bytes = None
+        self.status = None
+
+    def as_dict(self):
+        return {
+            'view': self.view,
+            'status': self.status,
+            'db_calls': self.db_calls,
+            'mongo_commands': self.mongo_commands,
+            'translate_ms': round(self.translate_seconds * 1000, 3),
+            'mongo_ms': round(self.mongo_seconds * 1000, 3),
+            'render_ms': round(self.render_seconds * 1000, 3),
+            'total_ms': round(self.total_seconds * 1000, 3),
+            'response_bytes': self.response_bytes,
+        }
+
+    def server_timing(self):
+        return ', '.join([
+            f'translate;dur={self.translate_seconds * 1000:.3f};desc="djongo translation ({self.db_calls} queries)"',
+            f'mongo;dur={self.mongo_seconds * 1000:.3f};desc="MongoDB ({self.mongo_commands} commands)"',
+            f'render;dur={self.render_seconds * 1000:.3f};desc="DRF rendering"',
+            f'total;dur={self.total_seconds * 1000:.3f}',
+        ])
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Attribute MongoDB command time to the request running on this thread."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    @staticmethod
+    def _record(event):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.mongo_commands += 1
+            metrics.mongo_seconds += event.duration_micros / 1e6
+
+
+def install():
+    """Register the Mongo command timer; call before any MongoClient exists."""
+    monitoring.register(MongoCommandTimer())
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Time ``cursor.execute`` and subtract the Mongo time spent inside it."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    mongo_before = metrics.mongo_seconds
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.db_calls += 1
+        metrics.db_seconds += elapsed
+        metrics.translate_seconds += max(0.0, elapsed - (metrics.mongo_seconds - mongo_before))
+
+
+class ViewAggregates:
+    """Per-view running totals for the Prometheus text endpoint."""
+    counters = ('requests', 'db_calls', 'mongo_commands', 'response_bytes')
+    timers = ('translate_seconds', 'mongo_seconds', 'render_seconds', 'total_seconds')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, metrics):
+        with self._lock:
+            totals = self._views.setdefault(metrics.view, dict.fromkeys(self.counters + self.timers, 0))
+            totals['requests'] += 1
+            totals['db_calls'] += metrics.db_calls
+            totals['mongo_commands'] += metrics.mongo_commands
+            totals['response_bytes'] += metrics.response_bytes or 0
+            for timer in self.timers:
+                totals[timer] += getattr(metrics, timer)
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            views = {view: dict(totals) for view, totals in self._views.items()}
+        for name in self.counters + self.timers:
+            metric = f'octofit_{name}_total' if name in self.counters else f'octofit_{name}_sum'
+            lines.append(f'# TYPE {metric} counter')
+            for view, totals in sorted(views.items()):
+                lines.append(f'{metric}{{view="{view}"}} {totals[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+aggregates = ViewAggregates()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    cls = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None) or {}
+    if cls is not None and request.method.lower() in actions:
+        return f'{cls.__name__}.{actions[request.method.lower()]}'
+    return match.view_name
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack)
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    @staticmethod
+    def wrap_connections(stack):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(execute_wrapper))
+
+    def finish(self, request, response, metrics):
+        metrics.total_seconds = time.perf_counter() - metrics.started
+        metrics.view = view_name(request)
+        metrics.status = response.status_code
+        if not response.streaming:
+            metrics.response_bytes = len(response.content)
+
+        response['Server-Timing'] = metrics.server_timing()
+        if getattr(settings, 'REQUEST_TIMING_LOG', False):
+            logger.info(json.dumps(metrics.as_dict()))
+        if getattr(settings, 'REQUEST_METRICS_ENDPOINT', False):
+            aggregates.add(metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        """Time DRF rendering, which happens after this hook returns."""
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+
+            def rendered(response):
+                metrics.render_seconds += time.perf_counter() - metrics.render_started
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text exposition of the per-view aggregates, Mongo pools and translation cache."""
+    body = aggregates.prometheus() + monitor.prometheus() + translation_cache.prometheus()
+    return HttpResponse(body, content_type='text/plain; version=0.0.4')
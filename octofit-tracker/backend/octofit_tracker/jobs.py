@@ -0,0 +1,222 @@
+"""
+A MongoDB-backed queue for long-running maintenance work.
+
+Jobs are documents in the ``jobs`` collection. ``enqueue`` inserts one and
+workers claim the oldest queued job with an atomic ``find_one_and_update``,
+so worker threads in the web processes (``JOBS_WORKER=thread``) and
+``manage.py run_jobs`` processes can share the queue without any other
+service. Jobs queued with the same ``lane`` run one at a time in the order
+they were queued: a job in a lane is only claimed once every older job in
+it has finished.
+
+Handlers are registered with ``@handler(kind)`` (see ``tasks.py``) and are
+called with the job's params and its last checkpoint. A handler that works
+in chunks is a generator yielding ``(state, done, total)`` after each
+chunk; the runner stores the state and progress. While a handler runs, a
+side thread refreshes the job's heartbeat every quarter of
+``JOBS_STALE_SECONDS``, so a long chunk is not mistaken for a dead
+worker. A running job whose heartbeat is older than
+``JOBS_STALE_SECONDS`` lost its worker and is claimed again, resuming from
+its checkpoint, for at most ``JOBS_MAX_ATTEMPTS`` attempts.
+"""
+import inspect
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from octofit_tracker.models import Job
+from octofit_tracker.mongo import get_collection
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+# Returned by _run_steps when the job's lease went to another worker.
+_LOST = object()
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def handler(kind):
+    """Register the decorated function as the handler of ``kind`` jobs."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, params=None, lane='', start_worker=True):
+    """
+    Queue a ``kind`` job with the ``params`` dict and return its document.
+
+    With ``JOBS_WORKER=thread`` this also starts the process's worker
+    thread, unless ``start_worker`` is false: a short-lived process such
+    as a management command would exit in the middle of the job.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = {
+        'kind': kind,
+        'params': dict(params or {}),
+        'lane': lane,
+        'status': 'queued',
+        'state': {},
+        'progress_done': 0,
+        'progress_total': None,
+        'result': {},
+        'error': '',
+        'attempts': 0,
+        'worker': '',
+        'created_at': timezone.now(),
+        'started_at': None,
+        'heartbeat_at': None,
+        'finished_at': None,
+    }
+    job['_id'] = get_collection(Job).insert_one(job).inserted_id
+    if start_worker and settings.JOBS_WORKER == 'thread':
+        start_worker_thread()
+    return job
+
+
+def _lane_heads(jobs):
+    """Ids of the oldest unfinished job of every lane, in one aggregation."""
+    return [group['head'] for group in jobs.aggregate([
+        {'$match': {'lane': {'$nin': ['', None]}, 'status': {'$in': ['queued', 'running']}}},
+        {'$sort': {'created_at': 1, '_id': 1}},
+        {'$group': {'_id': '$lane', 'head': {'$first': '$_id'}}},
+    ])]
+
+
+def claim(worker):
+    """
+    Atomically take the oldest queued (or abandoned) job for ``worker``.
+    Only jobs without a lane and the head of each lane are candidates, so
+    a queued backlog costs two queries per poll, not one per job.
+    """
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.JOBS_STALE_SECONDS)
+    claimable = {'$or': [{'status': 'queued'}, {'status': 'running', 'heartbeat_at': {'$lt': abandoned}}]}
+    jobs = get_collection(Job)
+    candidates = jobs.find(
+        {'$and': [claimable, {'$or': [{'lane': {'$in': ['', None]}}, {'_id': {'$in': _lane_heads(jobs)}}]}]},
+        {'_id': 1},
+    ).sort([('created_at', 1), ('_id', 1)])
+    # Only a lost race with another worker moves on to the next candidate.
+    for candidate in candidates:
+        job = jobs.find_one_and_update(
+            {'_id': candidate['_id'], **claimable},
+            {'$set': {'status': 'running', 'worker': worker, 'started_at': now, 'heartbeat_at': now},
+             '$inc': {'attempts': 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            return job
+    return None
+
+
+def run(job, worker):
+    """
+    Run a claimed job, checkpointing after every chunk.
+
+    Returns the final status, or None when another worker took the job over.
+    """
+    owned = {'_id': job['_id'], 'worker': worker, 'status': 'running'}
+    if job['attempts'] > settings.JOBS_MAX_ATTEMPTS:
+        return _finish(owned, 'failed', error=f'Gave up after {job["attempts"] - 1} attempts')
+    try:
+        with _heartbeat(owned):
+            output = HANDLERS[job['kind']](job['params'], job['state'])
+            if inspect.isgenerator(output):
+                output = _run_steps(output, owned)
+        if output is _LOST:
+            logger.warning('Job %s (%s) was taken over by another worker', job['_id'], job['kind'])
+            return None
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed', job['_id'], job['kind'])
+        return _finish(owned, 'failed', error=f'{type(exc).__name__}: {exc}')
+    return _finish(owned, 'done', result=output or {})
+
+
+@contextmanager
+def _heartbeat(owned):
+    """Refresh the job's ``heartbeat_at`` from a side thread until the block exits."""
+    jobs = get_collection(Job)
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(settings.JOBS_STALE_SECONDS / 4):
+            if not jobs.update_one(owned, {'$set': {'heartbeat_at': timezone.now()}}).matched_count:
+                return
+
+    thread = threading.Thread(target=beat, name='octofit-jobs-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _run_steps(steps, owned):
+    jobs = get_collection(Job)
+    while True:
+        try:
+            state, done, total = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        checkpoint = jobs.update_one(owned, {'$set': {
+            'state': state,
+            'progress_done': done,
+            'progress_total': total,
+            'heartbeat_at': timezone.now(),
+        }})
+        if not checkpoint.matched_count:
+            steps.close()
+            return _LOST
+
+
+def _finish(owned, status, **fields):
+    get_collection(Job).update_one(owned, {'$set': {'status': status, 'finished_at': timezone.now(), **fields}})
+    return status
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+
+
+def work(worker=None, burst=False, poll=None, stop=None):
+    """
+    Claim and run jobs until ``stop`` is set, or with ``burst`` until the
+    queue is empty. Returns how many jobs ran.
+    """
+    worker = worker or worker_name()
+    poll = settings.JOBS_POLL_SECONDS if poll is None else poll
+    stop = stop or threading.Event()
+    ran = 0
+    while not stop.is_set():
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll)
+            continue
+        run(job, worker)
+        ran += 1
+    return ran
+
+
+def start_worker_thread():
+    """Start this process's background worker thread unless it is running."""
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=work, name='octofit-jobs', daemon=True)
+            _thread.start()
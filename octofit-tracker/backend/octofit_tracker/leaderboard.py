@@ -0,0 +1,615 @@
+"""
+Incremental maintenance of the leaderboard collections.
+
+Ranks are ordered by ``total_calories`` descending, ties by the entry's
+key (the user's email, or the team name) ascending, in the incremental
+path and in rebuilds alike. When a user's total changes only the
+contiguous slice of ranks between the old and the new position is
+shifted, so a single activity write costs a handful of indexed updates
+instead of a full rebuild.
+
+Besides the all-time ``Leaderboard``, every activity counts towards the
+day, ISO week and month it falls in. Those rankings live in
+``PeriodLeaderboard``, one bucket per period and key, and are maintained by
+the same code scoped to the bucket. Each bucket document carries
+``expires_at`` (the bucket's end plus ``RETENTION``), and a TTL index lets
+MongoDB delete buckets once they expire.
+
+``TeamLeaderboard`` ranks teams by their members' all-time totals. It is
+kept up to date from the same writes: each user delta is added to the
+user's team, whose member count changes when a user's first activity
+arrives or last one is removed.
+
+Re-ranking reads an entry and then shifts its neighbours in separate
+writes, so only one writer per collection re-ranks at a time, without
+making the others wait. A writer adds its deltas to the entry's
+``pending_*`` fields and queues the entry on the collection's document in
+``LOCK_COLLECTION``; if no other writer holds that lock it takes it and
+re-ranks the queue until it is empty, otherwise the holder re-ranks the
+entry too. An entry created while the lock is held reads as ``UNRANKED``
+until the holder places it. A holder renews its lease as it goes; one
+that crashed is replaced by the next writer after ``LOCK_TIMEOUT``.
+
+Rebuilds swap in whole collections while holding the same lock, then
+recompute the users whose activities changed while they ran.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from octofit_tracker.models import User, Activity, Leaderboard, PeriodLeaderboard, TeamLeaderboard, Tombstone
+from octofit_tracker.mongo import get_collection, get_database
+from octofit_tracker import caching, indexes
+
+PERIODS = ('day', 'week', 'month')
+
+BUCKET_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+    'month': '%Y-%m',
+}
+
+# How long a bucket stays readable after it ends.
+RETENTION = {
+    'day': timedelta(days=7),
+    'week': timedelta(weeks=5),
+    'month': timedelta(days=366),
+}
+
+LOCK_COLLECTION = 'leaderboard_locks'
+LOCK_TIMEOUT = timedelta(seconds=30)
+LOCK_RETRY_SECONDS = 0.01
+
+# Rank of an entry created while another writer holds the re-ranking lock.
+UNRANKED = 2 ** 31 - 1
+
+# Model -> (the key breaking ties, the fields scoping one ranking).
+RANKINGS = {
+    Leaderboard: ('user_email', ()),
+    PeriodLeaderboard: ('user_email', ('period', 'bucket')),
+    TeamLeaderboard: ('team', ()),
+}
+
+USER_TOTALS = ('total_calories', 'total_activities')
+TEAM_TOTALS = USER_TOTALS + ('active_members',)
+
+
+def to_utc(value):
+    """Return ``value`` as a naive UTC datetime, the way dates are stored."""
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_key(period, date):
+    return to_utc(date).strftime(BUCKET_FORMATS[period])
+
+
+def bucket_start(period, date):
+    start = to_utc(date).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        return start - timedelta(days=start.weekday())
+    if period == 'month':
+        return start.replace(day=1)
+    return start
+
+
+def bucket_end(period, start):
+    if period == 'day':
+        return start + timedelta(days=1)
+    if period == 'week':
+        return start + timedelta(weeks=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def parse_bucket(period, key):
+    """Return the start of the bucket named ``key``; raises ValueError."""
+    if period == 'week':
+        return datetime.strptime(key + '-1', '%G-W%V-%u')
+    return datetime.strptime(key, BUCKET_FORMATS[period])
+
+
+def period_buckets(date, now=None):
+    """Yield ``(scope, expires_at)`` for every unexpired bucket holding ``date``."""
+    now = to_utc(now or timezone.now())
+    for period in PERIODS:
+        expires_at = bucket_end(period, bucket_start(period, date)) + RETENTION[period]
+        if expires_at > now:
+            yield {'period': period, 'bucket': bucket_key(period, date)}, expires_at
+
+
+def apply_activity_delta(user_email, calories, activities, date=None):
+    """
+    Add ``calories`` and ``activities`` to a user's totals and re-rank.
+
+    The user's team is re-ranked as well, and with ``date`` so are the day,
+    week and month buckets holding it.
+    """
+    team, members = _apply_user(user_email, calories, activities)
+    if team:
+        _apply_team(team, calories, activities, members)
+    if date is not None:
+        for scope, expires_at in period_buckets(date):
+            _apply_user(user_email, calories, activities, PeriodLeaderboard, scope, {'expires_at': expires_at})
+
+
+def apply_activities(activities):
+    """Fold a batch of new activities into the leaderboards, one update per user, team and bucket."""
+    now = timezone.now()
+    totals = {}
+    buckets = {}
+    for activity in activities:
+        calories, count = totals.get(activity['user_email'], (0, 0))
+        totals[activity['user_email']] = (calories + activity['calories'], count + 1)
+        for scope, expires_at in period_buckets(activity['date'], now):
+            key = (activity['user_email'], scope['period'], scope['bucket'])
+            calories, count, _ = buckets.get(key, (0, 0, expires_at))
+            buckets[key] = (calories + activity['calories'], count + 1, expires_at)
+
+    teams = {}
+    for user_email, (calories, count) in totals.items():
+        team, members = _apply_user(user_email, calories, count)
+        if team:
+            team_calories, team_count, team_members = teams.get(team, (0, 0, 0))
+            teams[team] = (team_calories + calories, team_count + count, team_members + members)
+    for team, (calories, count, members) in teams.items():
+        _apply_team(team, calories, count, members)
+
+    for (user_email, period, bucket), (calories, count, expires_at) in buckets.items():
+        scope = {'period': period, 'bucket': bucket}
+        _apply_user(user_email, calories, count, PeriodLeaderboard, scope, {'expires_at': expires_at})
+
+
+def _apply_user(user_email, calories, activities, model=Leaderboard, scope=None, extra=None):
+    """
+    Re-rank one user in ``model``'s ranking (the all-time leaderboard by default).
+
+    Returns the user's team and the change in its active members (+1 when
+    the user's first activity lands, -1 when the last one goes).
+    """
+    scope = scope or {}
+
+    def new_entry():
+        user = get_collection(User).find_one({'email': user_email}, {'name': 1, 'team': 1}) or {}
+        return _entry(user_email, user, 0, 0, UNRANKED, **scope, **(extra or {}))
+
+    entry = _apply(model, scope, {'user_email': user_email},
+                   {'total_calories': calories, 'total_activities': activities}, new_entry)
+    if entry is None:
+        return '', 0
+    after = totals(entry, ('total_activities',))['total_activities']
+    return entry.get('team', ''), int(after > 0) - int(after - activities > 0)
+
+
+def _apply_team(team, calories, activities, members):
+    """Re-rank one team with its members' changed totals."""
+    def new_entry():
+        return _team_entry(team, 0, 0, 0, UNRANKED)
+
+    _apply(TeamLeaderboard, {}, {'team': team},
+           {'total_calories': calories, 'total_activities': activities, 'active_members': members}, new_entry)
+
+
+def totals(entry, fields=USER_TOTALS):
+    """An entry's ``fields`` including the deltas still waiting to be ranked."""
+    return {field: entry.get(field, 0) + entry.get(_pending(field), 0) for field in fields}
+
+
+def _pending(field):
+    return f'pending_{field}'
+
+
+def _total_expression(field):
+    """Aggregation expression for ``totals()`` of one field."""
+    return {'$add': [f'${field}', {'$ifNull': [f'${_pending(field)}', 0]}]}
+
+
+def refresh_users(emails):
+    """
+    Recompute the all-time and period entries of ``emails`` from their
+    activities. After an email change this merges the user's entries into
+    any the new email already has, and it can safely run twice.
+    """
+    now = timezone.now()
+    periods = get_collection(PeriodLeaderboard)
+    for user_email in dict.fromkeys(emails):
+        # () for the all-time entry, (period, bucket) for a period entry.
+        targets = {}
+        for activity in get_collection(Activity).find({'user_email': user_email}, {'calories': 1, 'date': 1}):
+            keys = [((), None)] + [
+                ((scope['period'], scope['bucket']), expires_at)
+                for scope, expires_at in period_buckets(activity['date'], now)
+            ]
+            for key, expires_at in keys:
+                calories, count, _ = targets.get(key, (0, 0, expires_at))
+                targets[key] = (calories + activity['calories'], count + 1, expires_at)
+        current = {(entry['period'], entry['bucket']): totals(entry) for entry in periods.find({'user_email': user_email})}
+        entry = get_collection(Leaderboard).find_one({'user_email': user_email})
+        if entry is not None:
+            current[()] = totals(entry)
+        for key in targets.keys() | current.keys():
+            calories, count, expires_at = targets.get(key, (0, 0, None))
+            entry = current.get(key, {'total_calories': 0, 'total_activities': 0})
+            deltas = (calories - entry['total_calories'], count - entry['total_activities'])
+            if not any(deltas):
+                continue
+            if key:
+                scope = {'period': key[0], 'bucket': key[1]}
+                _apply_user(user_email, *deltas, PeriodLeaderboard, scope, {'expires_at': expires_at})
+            else:
+                _apply_user(user_email, *deltas)
+
+
+def member_totals(match=None):
+    """Return ``{team: totals}`` summed over the members' all-time entries matching ``match``."""
+    return {
+        group['_id']: group
+        for group in get_collection(Leaderboard).aggregate([
+            {'$match': {'team': {'$ne': ''}, **(match or {})}},
+            {'$group': {
+                '_id': '$team',
+                'total_calories': {'$sum': _total_expression('total_calories')},
+                'total_activities': {'$sum': _total_expression('total_activities')},
+                'active_members': {'$sum': {'$cond': [{'$gt': [_total_expression('total_activities'), 0]}, 1, 0]}},
+            }},
+        ], allowDiskUse=True)
+    }
+
+
+def refresh_teams(teams):
+    """
+    Recompute the entries of ``teams`` from their members' all-time entries.
+
+    Used for team moves and renames instead of applying deltas, so running
+    it again, e.g. when a propagation job is retried, changes nothing.
+    """
+    names = [team for team in dict.fromkeys(teams) if team]
+    if not names:
+        return
+    expected = member_totals({'team': {'$in': names}})
+    entries = {
+        entry['team']: totals(entry, TEAM_TOTALS)
+        for entry in get_collection(TeamLeaderboard).find({'team': {'$in': names}})
+    }
+    for team in names:
+        deltas = [
+            expected.get(team, {}).get(field, 0) - entries.get(team, {}).get(field, 0)
+            for field in TEAM_TOTALS
+        ]
+        if any(deltas):
+            _apply_team(team, *deltas)
+
+
+def rename_team(old_name, new_name):
+    """Carry a team's entry over to its new name, merging into an existing one."""
+    teams = get_collection(TeamLeaderboard)
+    if teams.count_documents({'team': new_name}, limit=1) == 0:
+        entry = teams.find_one_and_update({'team': old_name}, {'$set': {'team': new_name}})
+        if entry is not None:
+            # The new name may break a tie the other way.
+            _submit(TeamLeaderboard, entry['_id'])
+    refresh_teams([old_name, new_name])
+
+
+def _apply(model, scope, key, deltas, new_entry):
+    """
+    Add ``deltas`` to the pending totals of the entry matching ``key``
+    within ``scope`` and have it re-ranked (see ``_submit``).
+
+    ``deltas`` maps total fields to increments and must include
+    ``total_activities``. ``new_entry()`` builds a missing entry, which is
+    only created for a positive ``total_activities``. Returns the entry
+    after the write, pending totals included, or None.
+    """
+    collection = get_collection(model)
+    match = {**scope, **key}
+    increments = {'$inc': {_pending(field): delta for field, delta in deltas.items()}}
+    entry = collection.find_one_and_update(match, increments, return_document=ReturnDocument.AFTER)
+    if entry is None:
+        if deltas['total_activities'] <= 0:
+            return None
+        fields = {name: value for name, value in new_entry().items() if name not in match}
+        try:
+            entry = collection.find_one_and_update(match, {**increments, '$setOnInsert': fields},
+                                                   upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # Another writer created the entry first.
+            entry = collection.find_one_and_update(match, increments, return_document=ReturnDocument.AFTER)
+    _submit(model, entry['_id'])
+    return entry
+
+
+def _locks():
+    return get_database()[LOCK_COLLECTION]
+
+
+def _submit(model, entry_id):
+    """
+    Queue ``entry_id`` for re-ranking and, unless another writer holds the
+    model's lock (and will re-rank it), re-rank the queue.
+    """
+    name = model._meta.db_table
+    _locks().update_one({'_id': name}, {'$addToSet': {'pending': entry_id}}, upsert=True)
+    token = ObjectId()
+    if _acquire(name, token):
+        _drain(model, token)
+
+
+def _acquire(name, token, wait=False):
+    """Take the lock ``name`` if it is free or expired, with ``wait`` until it is; returns whether it was taken."""
+    delay = LOCK_RETRY_SECONDS
+    while True:
+        now = timezone.now()
+        try:
+            _locks().update_one(
+                {'_id': name, '$or': [{'holder': None}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'holder': token, 'expires_at': now + LOCK_TIMEOUT}, '$setOnInsert': {'pending': []}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            # The lock document exists and is held.
+            if not wait:
+                return False
+        time.sleep(delay)
+        delay = min(delay * 2, 1)
+
+
+def _drain(model, token):
+    """Re-rank queued entries until the queue is empty, then release the lock."""
+    locks = _locks()
+    name = model._meta.db_table
+    collection = get_collection(model)
+    while True:
+        # Releasing only with an empty queue leaves no queued entry without a holder.
+        if locks.update_one({'_id': name, 'holder': token, 'pending': []}, {'$set': {'holder': None}}).matched_count:
+            return
+        lock = locks.find_one_and_update(
+            {'_id': name, 'holder': token},
+            {'$set': {'pending': [], 'expires_at': timezone.now() + LOCK_TIMEOUT}},
+        )
+        if lock is None:
+            # The lease ran out and another writer took over the queue.
+            return
+        renew_at = timezone.now() + LOCK_TIMEOUT / 3
+        for entry_id in lock['pending']:
+            _rerank(model, collection, entry_id)
+            if timezone.now() > renew_at:
+                renew_at = timezone.now() + LOCK_TIMEOUT / 3
+                locks.update_one({'_id': name, 'holder': token}, {'$set': {'expires_at': timezone.now() + LOCK_TIMEOUT}})
+
+
+@contextmanager
+def _holding(model):
+    """
+    Hold ``model``'s re-ranking lock for the block, renewing it from a side
+    thread, then re-rank whatever writers queued meanwhile.
+    """
+    locks = _locks()
+    name = model._meta.db_table
+    token = ObjectId()
+    _acquire(name, token, wait=True)
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(LOCK_TIMEOUT.total_seconds() / 3):
+            locks.update_one({'_id': name, 'holder': token}, {'$set': {'expires_at': timezone.now() + LOCK_TIMEOUT}})
+
+    thread = threading.Thread(target=renew, name='octofit-leaderboard-lock', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        _drain(model, token)
+
+
+def _rerank(model, collection, entry_id):
+    """Fold an entry's pending totals into its totals and move it to its rank."""
+    key, scope_fields = RANKINGS[model]
+    while True:
+        entry = collection.find_one({'_id': entry_id})
+        if entry is None:
+            return
+        pending = {name: value for name, value in entry.items() if name.startswith('pending_')}
+        new = {name[len('pending_'):]: entry.get(name[len('pending_'):], 0) + value for name, value in pending.items()}
+        current = {**entry, **new}
+        scope = {field: entry[field] for field in scope_fields}
+        rank = entry['rank']
+        placed = rank < UNRANKED
+
+        if current['total_activities'] <= 0:
+            # Only delete it if no writer added to it since it was read.
+            if not collection.delete_one({'_id': entry_id, **pending}).deleted_count:
+                continue
+            if placed:
+                collection.update_many({**scope, 'rank': {'$gt': rank, '$lt': UNRANKED}}, {'$inc': {'rank': -1}})
+            return
+
+        calories = current['total_calories']
+        ahead = {'$or': [{'total_calories': {'$gt': calories}}, {'total_calories': calories, key: {'$lt': entry[key]}}]}
+        behind = {'$or': [{'total_calories': {'$lt': calories}}, {'total_calories': calories, key: {'$gt': entry[key]}}]}
+        if placed:
+            # Entries we overtake move down by one, entries that overtake us up by one.
+            overtaken = collection.update_many({**scope, 'rank': {'$lt': rank}, **behind}, {'$inc': {'rank': 1}})
+            overtaking = collection.update_many(
+                {**scope, 'rank': {'$gt': rank, '$lt': UNRANKED}, **ahead}, {'$inc': {'rank': -1}}
+            )
+            rank += overtaking.modified_count - overtaken.modified_count
+        else:
+            rank = collection.count_documents({**scope, 'rank': {'$lt': UNRANKED}, **ahead}) + 1
+            collection.update_many({**scope, 'rank': {'$gte': rank, '$lt': UNRANKED}}, {'$inc': {'rank': 1}})
+
+        derived = {'average_calories': _average(calories, current['active_members'])} if model is TeamLeaderboard else {}
+        fields = {**new, **derived, 'rank': rank}
+        # Drop the pending fields unless a writer added to them since they were read.
+        folded = collection.update_one({'_id': entry_id, **pending},
+                                       {'$set': fields, '$unset': dict.fromkeys(pending, '')})
+        if not folded.matched_count:
+            collection.update_one({'_id': entry_id}, {
+                '$set': fields,
+                '$inc': {name: -value for name, value in pending.items()},
+            })
+        return
+
+
+def _entry(user_email, user, calories, activities, rank, **extra):
+    return {
+        **extra,
+        'user_email': user_email,
+        'user_name': user.get('name', user_email),
+        'team': user.get('team', ''),
+        'total_calories': calories,
+        'total_activities': activities,
+        'rank': rank,
+    }
+
+
+def _average(calories, members):
+    return round(calories / members, 2) if members else 0.0
+
+
+def _team_entry(team, calories, activities, members, rank):
+    return {
+        'team': team,
+        'total_calories': calories,
+        'total_activities': activities,
+        'active_members': members,
+        'average_calories': _average(calories, members),
+        'rank': rank,
+    }
+
+
+def rebuild():
+    """
+    Recompute every leaderboard entry from the activities collection.
+
+    Each collection is rebuilt aside and swapped in whole (see
+    ``indexes.replace_collection``) under its re-ranking lock, so readers
+    never see a partial ranking; users whose activities changed while a
+    collection was rebuilt are then recomputed.
+    """
+    count = rebuild_users()
+    rebuild_teams()
+    rebuild_periods()
+    caching.invalidate_for(Leaderboard)
+    return count
+
+
+def _users():
+    return {
+        user['email']: user
+        for user in get_collection(User).find({}, {'email': 1, 'name': 1, 'team': 1})
+    }
+
+
+def _replay_from():
+    """The start of a rebuild, early enough for writes still committing (see sync.py)."""
+    return timezone.now() - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS)
+
+
+def _changed_emails(since):
+    """Emails whose activities were written or deleted since ``since``."""
+    emails = set(get_collection(Activity).distinct('user_email', {'updated_at': {'$gte': since}}))
+    emails.update(get_collection(Tombstone).distinct('owner', {'kind': 'activity', 'deleted_at': {'$gte': since}}))
+    return sorted(emails)
+
+
+def rebuild_users():
+    """Recompute the all-time user entries; returns how many there are."""
+    started = _replay_from()
+    users = _users()
+    groups = get_collection(Activity).aggregate([
+        {'$group': {
+            '_id': '$user_email',
+            'total_calories': {'$sum': '$calories'},
+            'total_activities': {'$sum': 1},
+        }},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+    ], allowDiskUse=True)
+
+    entries = [
+        _entry(total['_id'], users.get(total['_id'], {}), total['total_calories'], total['total_activities'], rank)
+        for rank, total in enumerate(groups, start=1)
+    ]
+
+    with _holding(Leaderboard):
+        indexes.replace_collection(Leaderboard, entries)
+    refresh_users(_changed_emails(started))
+    return len(entries)
+
+
+def rebuild_teams():
+    """Recompute the team leaderboard from the all-time user entries."""
+    expected = member_totals()
+    with _holding(TeamLeaderboard):
+        indexes.replace_collection(TeamLeaderboard, _team_entries(expected))
+    # Member deltas that reached the replaced collection are recomputed.
+    refresh_teams(member_totals().keys() | expected.keys())
+
+
+def _team_entries(teams):
+    """Rank the teams of ``member_totals()``."""
+    ordered = sorted(
+        (team for team in teams.values() if team['active_members']),
+        key=lambda team: (-team['total_calories'], team['_id']),
+    )
+    return [
+        _team_entry(team['_id'], team['total_calories'], team['total_activities'], team['active_members'], rank)
+        for rank, team in enumerate(ordered, start=1)
+    ]
+
+
+def rebuild_periods():
+    """Recompute every unexpired day, week and month bucket."""
+    started = _replay_from()
+    entries = _period_entries(_users(), timezone.now())
+    with _holding(PeriodLeaderboard):
+        indexes.replace_collection(PeriodLeaderboard, entries)
+    refresh_users(_changed_emails(started))
+
+
+# Rebuild steps in order; each reads only collections rebuilt by earlier steps.
+REBUILD_STAGES = (rebuild_users, rebuild_teams, rebuild_periods)
+
+
+def _period_entries(users, now):
+    """Rank every unexpired day, week and month bucket from the activities."""
+    now = to_utc(now)
+    entries = []
+    for period in PERIODS:
+        # The oldest bucket still readable is the one holding now - RETENTION.
+        earliest = bucket_start(period, now - RETENTION[period])
+        groups = get_collection(Activity).aggregate([
+            {'$match': {'date': {'$gte': earliest}}},
+            {'$group': {
+                '_id': {
+                    'bucket': {'$dateToString': {'format': BUCKET_FORMATS[period], 'date': '$date'}},
+                    'user_email': '$user_email',
+                },
+                'total_calories': {'$sum': '$calories'},
+                'total_activities': {'$sum': 1},
+            }},
+            {'$sort': {'_id.bucket': 1, 'total_calories': -1, '_id.user_email': 1}},
+        ], allowDiskUse=True)
+
+        bucket = None
+        for group in groups:
+            if group['_id']['bucket'] != bucket:
+                bucket, rank = group['_id']['bucket'], 0
+                expires_at = bucket_end(period, parse_bucket(period, bucket)) + RETENTION[period]
+            rank += 1
+            user_email = group['_id']['user_email']
+            entries.append(_entry(
+                user_email, users.get(user_email, {}), group['total_calories'], group['total_activities'], rank,
+                period=period, bucket=bucket, expires_at=expires_at,
+            ))
+    return entries
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily and weekly activity rollups from the activities'
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} activity rollups'))
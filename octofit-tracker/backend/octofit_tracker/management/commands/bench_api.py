@@ -0,0 +1,85 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from octofit_tracker import benchmarks
+from octofit_tracker.urls import router
+from io import StringIO
+import json
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and benchmark every REST API endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to seed (default: 1000)')
+        parser.add_argument('--teams', type=int, default=10, help='Teams to seed (default: 10)')
+        parser.add_argument('--activities', type=int, default=10000,
+                            help='Total activities to seed, spread evenly over users (default: 10000)')
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per endpoint (default: 20)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the dataset (default: 1)')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the response cache between requests instead of clearing it')
+        parser.add_argument('--mongomock', action='store_true',
+                            help='Run against an in-process mongomock server instead of mongod')
+        parser.add_argument('--output', default='bench-api.json', help='Where to write the JSON results')
+        parser.add_argument('--compare', help='Previous results file to compare against')
+
+    def handle(self, *args, **options):
+        if options['mongomock']:
+            try:
+                benchmarks.use_mongomock()
+            except ImportError:
+                raise CommandError('--mongomock requires the mongomock package')
+        counter = None if options['mongomock'] else benchmarks.install_command_counter()
+        users = max(1, options['users'])
+
+        # Never touch octofit_db: benchmark in a disposable test database.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {users} users, {options["teams"]} teams, {options["activities"]} activities...')
+            call_command(
+                'populate_db',
+                users=users,
+                teams=options['teams'],
+                activities_per_user=max(1, options['activities'] // users),
+                seed=options['seed'],
+                stdout=StringIO(),
+            )
+            call_command('sync_indexes', stdout=StringIO())
+            results = benchmarks.run(router, options['requests'], counter, options['warm_cache'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'backend': 'mongomock' if options['mongomock'] else 'mongod',
+                'users': users,
+                'teams': options['teams'],
+                'activities': max(1, options['activities'] // users) * users,
+                'requests': options['requests'],
+                'warm_cache': options['warm_cache'],
+            },
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+
+        self.stdout.write(f'{"endpoint":<28} {"status":>6} {"p50 ms":>9} {"p95 ms":>9} {"queries":>8} {"mongo":>6} {"bytes":>10}')
+        for result in results:
+            mongo = '-' if result['mongo_commands'] is None else result['mongo_commands']
+            self.stdout.write(
+                f'{result["endpoint"]:<28} {result["status"]:>6} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} '
+                f'{result["orm_queries"]:>8} {mongo:>6} {result["response_bytes"]:>10}'
+            )
+
+        if options['compare']:
+            with open(options['compare']) as previous:
+                changes = benchmarks.compare(json.load(previous), report)
+                for endpoint, metric, before, after, change in changes:
+                    line = f'{endpoint:<28} {metric:<15} {before:>10} -> {after:<10} {change:+.1%}'
+                    self.stdout.write(self.style.WARNING(line) if change > 0.1 else line)
+
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
@@ -0,0 +1,74 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from octofit_tracker import benchmarks
+from io import StringIO
+import json
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and compare the async and sync read endpoints under concurrent load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to seed (default: 1000)')
+        parser.add_argument('--teams', type=int, default=10, help='Teams to seed (default: 10)')
+        parser.add_argument('--activities', type=int, default=10000,
+                            help='Total activities to seed, spread evenly over users (default: 10000)')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200],
+                            help='Simultaneous requests per burst (default: 1 10 50 200)')
+        parser.add_argument('--rounds', type=int, default=3, help='Bursts per endpoint and level (default: 3)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the dataset (default: 1)')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Let the sync endpoints serve from the response cache')
+        parser.add_argument('--mongomock', action='store_true',
+                            help='Run against an in-process mongomock server instead of mongod')
+        parser.add_argument('--output', default='bench-concurrency.json', help='Where to write the JSON results')
+
+    def handle(self, *args, **options):
+        if options['mongomock']:
+            try:
+                benchmarks.use_mongomock()
+            except ImportError:
+                raise CommandError('--mongomock requires the mongomock package')
+        users = max(1, options['users'])
+
+        # Never touch octofit_db: benchmark in a disposable test database.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {users} users, {options["teams"]} teams, {options["activities"]} activities...')
+            call_command(
+                'populate_db',
+                users=users,
+                teams=options['teams'],
+                activities_per_user=max(1, options['activities'] // users),
+                seed=options['seed'],
+                stdout=StringIO(),
+            )
+            call_command('sync_indexes', stdout=StringIO())
+            results = benchmarks.run_concurrency(options['concurrency'], options['rounds'], options['warm_cache'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'backend': 'mongomock' if options['mongomock'] else 'mongod',
+                'users': users,
+                'activities': max(1, options['activities'] // users) * users,
+                'rounds': options['rounds'],
+                'warm_cache': options['warm_cache'],
+            },
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+
+        self.stdout.write(f'{"endpoint":<20} {"path":<6} {"conc":>5} {"status":>6} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9}')
+        for result in results:
+            self.stdout.write(
+                f'{result["endpoint"]:<20} {result["path"]:<6} {result["concurrency"]:>5} {result["status"]:>6} '
+                f'{result["throughput_rps"]:>9.1f} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from octofit_tracker.models import Activity, Leaderboard
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer, activity_rows, leaderboard_rows
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+import time
+
+
+def activity_row(index):
+    return {
+        '_id': ObjectId(),
+        'user_email': f'hero{index % 500}@octofit.test',
+        'activity_type': 'Running',
+        'duration': 30 + index % 90,
+        'calories': 200 + index % 600,
+        'date': datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=index),
+    }
+
+
+def leaderboard_row(index):
+    return {
+        '_id': ObjectId(),
+        'user_email': f'hero{index}@octofit.test',
+        'user_name': f'Hero {index}',
+        'team': 'Team Marvel' if index % 2 else 'Team DC',
+        'total_calories': 10 ** 6 - index,
+        'total_activities': 50,
+        'rank': index + 1,
+    }
+
+
+CASES = {
+    'activities': (Activity, ActivitySerializer, activity_rows, activity_row),
+    'leaderboard': (Leaderboard, LeaderboardSerializer, leaderboard_rows, leaderboard_row),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare ModelSerializer and .values() row rendering for list endpoints (no database needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                            help='Row counts to benchmark (default: 10000 100000)')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Take the best of this many runs (default: 3)')
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        for name, (model, serializer_class, row_mapper, make_row) in CASES.items():
+            fields = row_mapper.fields
+            for count in options['rows']:
+                # Raw column tuples, as the database cursor hands them to the ORM.
+                raw = [tuple(make_row(index)[field] for field in fields) for index in range(count)]
+
+                def model_path():
+                    instances = [model.from_db('default', fields, row) for row in raw]
+                    return renderer.render(serializer_class(instances, many=True).data)
+
+                def lean_path():
+                    return renderer.render(row_mapper([dict(zip(fields, row)) for row in raw]))
+
+                model_seconds, model_body = self.best_of(model_path, options['repeat'])
+                lean_seconds, lean_body = self.best_of(lean_path, options['repeat'])
+                if model_body != lean_body:
+                    raise CommandError(f'{name}: lean rows do not render identical JSON')
+
+                self.stdout.write(
+                    f'{name:<12} {count:>7} rows  serializer {model_seconds * 1000:9.1f} ms  '
+                    f'lean {lean_seconds * 1000:9.1f} ms  speedup {model_seconds / lean_seconds:5.1f}x'
+                )
+
+    @staticmethod
+    def best_of(func, repeat):
+        best, body = None, None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            body = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, body
@@ -0,0 +1,80 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from octofit_tracker import benchmarks, querycache
+from octofit_tracker.urls import router
+from io import StringIO
+import json
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and compare per-query CPU with and without the djongo translation cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to seed (default: 1000)')
+        parser.add_argument('--teams', type=int, default=10, help='Teams to seed (default: 10)')
+        parser.add_argument('--activities', type=int, default=10000,
+                            help='Total activities to seed, spread evenly over users (default: 10000)')
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per endpoint and mode (default: 20)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the dataset (default: 1)')
+        parser.add_argument('--mongomock', action='store_true',
+                            help='Run against an in-process mongomock server instead of mongod')
+        parser.add_argument('--output', default='bench-translation.json', help='Where to write the JSON results')
+
+    def handle(self, *args, **options):
+        if querycache.cache.maxsize <= 0:
+            raise CommandError('The translation cache is off (DJONGO_TRANSLATION_CACHE_SIZE=0)')
+        if options['mongomock']:
+            try:
+                benchmarks.use_mongomock()
+            except ImportError:
+                raise CommandError('--mongomock requires the mongomock package')
+        users = max(1, options['users'])
+
+        # Never touch octofit_db: benchmark in a disposable test database.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {users} users, {options["teams"]} teams, {options["activities"]} activities...')
+            call_command(
+                'populate_db',
+                users=users,
+                teams=options['teams'],
+                activities_per_user=max(1, options['activities'] // users),
+                seed=options['seed'],
+                stdout=StringIO(),
+            )
+            call_command('sync_indexes', stdout=StringIO())
+            querycache.cache.clear()
+            results = benchmarks.run_translation(router, options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'backend': 'mongomock' if options['mongomock'] else 'mongod',
+                'users': users,
+                'activities': max(1, options['activities'] // users) * users,
+                'requests': options['requests'],
+                'cache': querycache.cache.stats(),
+            },
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+
+        def ms(value):
+            return f'{value:>9.3f}' if value is not None else f'{"-":>9}'
+
+        self.stdout.write(
+            f'{"endpoint":<28} {"queries":>7} {"hits":>5} {"cpu ms":>9} {"cached":>9} {"q cpu ms":>9} {"cached":>9}'
+        )
+        for result in results:
+            self.stdout.write(
+                f'{result["endpoint"]:<28} {result["orm_queries"]:>7g} {result["cache_hits"]:>5} '
+                f'{ms(result["cpu_ms_djongo"])} {ms(result["cpu_ms_cached"])} '
+                f'{ms(result["query_cpu_ms_djongo"])} {ms(result["query_cpu_ms_cached"])}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker import denormalize
+
+
+class Command(BaseCommand):
+    help = 'Find (and optionally repair) denormalized user and team fields that drifted from their source'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Rewrite stale copies and rebuild drifted team totals')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users checked per batch')
+
+    def handle(self, *args, **options):
+        report = denormalize.check(batch_size=options['batch_size'], repair=options['repair'])
+        self.stdout.write(f'Checked {report["users_checked"]} users')
+
+        stale = f'{report["stale_entries"]} leaderboard entries with a stale name or team'
+        if options['repair']:
+            stale += f' ({report["repaired_entries"]} repaired)'
+        self.stdout.write(self.style.WARNING(stale) if report['stale_entries'] else stale)
+
+        if report['drifted_teams']:
+            action = 'rebuilt' if options['repair'] else 'drifted'
+            self.stdout.write(self.style.WARNING(f'Team totals {action}: {", ".join(report["drifted_teams"])}'))
+        for email in report['orphan_activity_emails']:
+            self.stdout.write(self.style.WARNING(f'Activities of unknown user: {email}'))
+        for team in report['unknown_teams']:
+            self.stdout.write(self.style.WARNING(f'Users of unknown team: {team}'))
+
+        clean = not (report['stale_entries'] or report['drifted_teams'])
+        if clean or options['repair']:
+            self.stdout.write(self.style.SUCCESS('Denormalized fields are consistent'))
@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker import jobs
+
+
+class Command(BaseCommand):
+    help = 'Queue a background job, e.g. rebuild_leaderboard, repair_denormalized or sync_indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', help=f'One of: {", ".join(sorted(jobs.HANDLERS))}')
+        parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                            help='Job parameter; VALUE is parsed as JSON when possible (repeatable)')
+
+    def handle(self, *args, **options):
+        params = {}
+        for param in options['param']:
+            name, sep, value = param.partition('=')
+            if not sep:
+                raise CommandError(f'Expected NAME=VALUE, got {param!r}')
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        try:
+            # The command exits right away; leave the job to a long-lived worker.
+            job = jobs.enqueue(options['kind'], params, start_worker=False)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Queued {job["kind"]} job {job["_id"]}'))
@@ -1,190 +1,211 @@
-from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.models import User, Team, Activity, ActivityRollup, Leaderboard, Workout, SearchEntry, Tombstone
+from octofit_tracker.mongo import get_collection
+from octofit_tracker import leaderboard, rollups, search
 from datetime import datetime, timedelta
+from itertools import islice
 import random
 
 
+TEAMS = [
+    {
+        'name': 'Team Marvel',
+        'description': 'The mightiest heroes of Earth, assembled to protect the world from threats too large for any one hero to handle.'
+    },
+    {
+        'name': 'Team DC',
+        'description': 'The legendary heroes of justice, united to defend truth, justice, and peace across the universe.'
+    }
+]
+
+HEROES = [
+    {'name': 'Iron Man', 'email': 'tony.stark@marvel.com', 'team': 'Team Marvel'},
+    {'name': 'Captain America', 'email': 'steve.rogers@marvel.com', 'team': 'Team Marvel'},
+    {'name': 'Thor', 'email': 'thor.odinson@marvel.com', 'team': 'Team Marvel'},
+    {'name': 'Black Widow', 'email': 'natasha.romanoff@marvel.com', 'team': 'Team Marvel'},
+    {'name': 'Hulk', 'email': 'bruce.banner@marvel.com', 'team': 'Team Marvel'},
+    {'name': 'Spider-Man', 'email': 'peter.parker@marvel.com', 'team': 'Team Marvel'},
+    {'name': 'Superman', 'email': 'clark.kent@dc.com', 'team': 'Team DC'},
+    {'name': 'Batman', 'email': 'bruce.wayne@dc.com', 'team': 'Team DC'},
+    {'name': 'Wonder Woman', 'email': 'diana.prince@dc.com', 'team': 'Team DC'},
+    {'name': 'The Flash', 'email': 'barry.allen@dc.com', 'team': 'Team DC'},
+    {'name': 'Aquaman', 'email': 'arthur.curry@dc.com', 'team': 'Team DC'},
+    {'name': 'Green Lantern', 'email': 'hal.jordan@dc.com', 'team': 'Team DC'},
+]
+
+WORKOUTS = [
+    {
+        'name': 'Asgardian Hammer Lift',
+        'description': 'Channel your inner Thor with heavy weightlifting exercises.',
+        'category': 'Strength',
+        'difficulty': 'Advanced',
+        'estimated_calories': 450,
+        'duration': 60
+    },
+    {
+        'name': 'Super Speed Sprint',
+        'description': 'Run like The Flash with high-intensity interval sprints.',
+        'category': 'Cardio',
+        'difficulty': 'Intermediate',
+        'estimated_calories': 600,
+        'duration': 45
+    },
+    {
+        'name': 'Web-Slinger Core',
+        'description': 'Build abs of steel like Spider-Man with core exercises.',
+        'category': 'Core',
+        'difficulty': 'Beginner',
+        'estimated_calories': 300,
+        'duration': 30
+    },
+    {
+        'name': 'Amazon Warrior Training',
+        'description': 'Fight like Wonder Woman with combat-inspired movements.',
+        'category': 'Mixed',
+        'difficulty': 'Advanced',
+        'estimated_calories': 550,
+        'duration': 75
+    },
+    {
+        'name': 'Bat-Signal Circuit',
+        'description': 'Train like the Dark Knight with a full-body circuit.',
+        'category': 'Circuit',
+        'difficulty': 'Intermediate',
+        'estimated_calories': 500,
+        'duration': 50
+    },
+    {
+        'name': 'Gamma Ray Smash',
+        'description': 'Unleash your inner Hulk with explosive power training.',
+        'category': 'Strength',
+        'difficulty': 'Advanced',
+        'estimated_calories': 650,
+        'duration': 60
+    }
+]
+
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'Martial Arts', 'HIIT']
+
+# Option -> smallest accepted value.
+MINIMUMS = {'users': 0, 'teams': 1, 'activities_per_user': 0, 'days': 1, 'batch_size': 1}
+
+
+def batched(iterable, size):
+    """Yield lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=len(HEROES),
+                            help='Number of users; heroes first, then generated users (default: the 12 heroes)')
+        parser.add_argument('--teams', type=int, default=len(TEAMS),
+                            help='Number of teams; Marvel and DC first, then generated squads (default: 2)')
+        parser.add_argument('--activities-per-user', type=int, default=None,
+                            help='Activities per user (default: random 5-10)')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Spread activities over this many days before today (default: 30)')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Documents per insert_many call (default: 10000)')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed for reproducible datasets')
+
+    def handle(self, *args, **options):
+        # Checked before anything is cleared.
+        for name, minimum in MINIMUMS.items():
+            if options[name] is not None and options[name] < minimum:
+                raise CommandError(f'--{name.replace("_", "-")} must be at least {minimum}')
+        rng = random.Random(options['seed'])
+        self.teams = self.generate_teams(options['teams'])
+        self.team_names = {team['name'] for team in self.teams}
+        batch_size = options['batch_size']
+        now = datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
         self.stdout.write('Clearing existing data...')
         
-        # Delete existing data
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        Workout.objects.all().delete()
+        # Delete existing data directly so activity signals don't re-rank row by row
+        for model in (Leaderboard, ActivityRollup, SearchEntry, Tombstone, User, Team, Activity, Workout):
+            get_collection(model).delete_many({})
         
         self.stdout.write(self.style.SUCCESS('Existing data cleared!'))
         self.stdout.write('Populating database with superhero test data...')
         
-        # Create teams
-        teams_data = [
-            {
-                'name': 'Team Marvel',
-                'description': 'The mightiest heroes of Earth, assembled to protect the world from threats too large for any one hero to handle.'
-            },
-            {
-                'name': 'Team DC',
-                'description': 'The legendary heroes of justice, united to defend truth, justice, and peace across the universe.'
-            }
-        ]
-        
-        teams = []
-        for team_data in teams_data:
-            team = Team.objects.create(**team_data)
-            teams.append(team)
-            self.stdout.write(f'Created team: {team.name}')
-        
-        # Create users (superheroes)
-        marvel_heroes = [
-            {'name': 'Iron Man', 'email': 'tony.stark@marvel.com'},
-            {'name': 'Captain America', 'email': 'steve.rogers@marvel.com'},
-            {'name': 'Thor', 'email': 'thor.odinson@marvel.com'},
-            {'name': 'Black Widow', 'email': 'natasha.romanoff@marvel.com'},
-            {'name': 'Hulk', 'email': 'bruce.banner@marvel.com'},
-            {'name': 'Spider-Man', 'email': 'peter.parker@marvel.com'},
-        ]
-        
-        dc_heroes = [
-            {'name': 'Superman', 'email': 'clark.kent@dc.com'},
-            {'name': 'Batman', 'email': 'bruce.wayne@dc.com'},
-            {'name': 'Wonder Woman', 'email': 'diana.prince@dc.com'},
-            {'name': 'The Flash', 'email': 'barry.allen@dc.com'},
-            {'name': 'Aquaman', 'email': 'arthur.curry@dc.com'},
-            {'name': 'Green Lantern', 'email': 'hal.jordan@dc.com'},
-        ]
+        get_collection(Team).insert_many([dict(team, created_at=today) for team in self.teams])
+        for team in self.teams[:len(TEAMS)]:
+            self.stdout.write(f'Created team: {team["name"]}')
         
-        users = []
-        for hero in marvel_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                team='Team Marvel'
-            )
-            users.append(user)
-            self.stdout.write(f'Created user: {user.name} ({user.team})')
+        get_collection(Workout).insert_many([dict(workout, updated_at=now) for workout in WORKOUTS])
+        for workout in WORKOUTS:
+            self.stdout.write(f'Created workout: {workout["name"]}')
         
-        for hero in dc_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                team='Team DC'
-            )
-            users.append(user)
-            self.stdout.write(f'Created user: {user.name} ({user.team})')
+        users = self.generate_users(options['users'], today, now)
+        user_count = self.insert(User, users, batch_size)
         
-        # Create workouts
-        workouts_data = [
-            {
-                'name': 'Asgardian Hammer Lift',
-                'description': 'Channel your inner Thor with heavy weightlifting exercises.',
-                'category': 'Strength',
-                'difficulty': 'Advanced',
-                'estimated_calories': 450,
-                'duration': 60
-            },
-            {
-                'name': 'Super Speed Sprint',
-                'description': 'Run like The Flash with high-intensity interval sprints.',
-                'category': 'Cardio',
-                'difficulty': 'Intermediate',
-                'estimated_calories': 600,
-                'duration': 45
-            },
-            {
-                'name': 'Web-Slinger Core',
-                'description': 'Build abs of steel like Spider-Man with core exercises.',
-                'category': 'Core',
-                'difficulty': 'Beginner',
-                'estimated_calories': 300,
-                'duration': 30
-            },
-            {
-                'name': 'Amazon Warrior Training',
-                'description': 'Fight like Wonder Woman with combat-inspired movements.',
-                'category': 'Mixed',
-                'difficulty': 'Advanced',
-                'estimated_calories': 550,
-                'duration': 75
-            },
-            {
-                'name': 'Bat-Signal Circuit',
-                'description': 'Train like the Dark Knight with a full-body circuit.',
-                'category': 'Circuit',
-                'difficulty': 'Intermediate',
-                'estimated_calories': 500,
-                'duration': 50
-            },
-            {
-                'name': 'Gamma Ray Smash',
-                'description': 'Unleash your inner Hulk with explosive power training.',
-                'category': 'Strength',
-                'difficulty': 'Advanced',
-                'estimated_calories': 650,
-                'duration': 60
-            }
-        ]
+        activities = self.generate_activities(
+            options['users'], options['activities_per_user'], options['days'], today, now, rng
+        )
+        activity_count = self.insert(Activity, activities, batch_size)
         
-        workouts = []
-        for workout_data in workouts_data:
-            workout = Workout.objects.create(**workout_data)
-            workouts.append(workout)
-            self.stdout.write(f'Created workout: {workout.name}')
+        entry_count = leaderboard.rebuild()
+        for entry in Leaderboard.objects.all().order_by('rank')[:10]:
+            self.stdout.write(f'Rank {entry.rank}: {entry.user_name} - {entry.total_calories} calories')
+        rollup_count = rollups.rebuild()
+        search_count = search.rebuild()
         
-        # Create activities
-        activity_types = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'Martial Arts', 'HIIT']
-        
-        activities = []
-        for user in users:
-            # Create 5-10 random activities per user
-            num_activities = random.randint(5, 10)
-            for i in range(num_activities):
-                activity = Activity.objects.create(
-                    user_email=user.email,
-                    activity_type=random.choice(activity_types),
-                    duration=random.randint(20, 120),
-                    calories=random.randint(200, 800),
-                    date=datetime.now() - timedelta(days=random.randint(1, 30))
-                )
-                activities.append(activity)
-            self.stdout.write(f'Created {num_activities} activities for {user.name}')
-        
-        # Create leaderboard entries
-        leaderboard_data = {}
-        for activity in activities:
-            email = activity.user_email
-            if email not in leaderboard_data:
-                user = User.objects.get(email=email)
-                leaderboard_data[email] = {
+        self.stdout.write(self.style.SUCCESS('Database populated successfully!'))
+        self.stdout.write(self.style.SUCCESS(f'Created {len(self.teams)} teams'))
+        self.stdout.write(self.style.SUCCESS(f'Created {user_count} users'))
+        self.stdout.write(self.style.SUCCESS(f'Created {len(WORKOUTS)} workouts'))
+        self.stdout.write(self.style.SUCCESS(f'Created {activity_count} activities'))
+        self.stdout.write(self.style.SUCCESS(f'Created {entry_count} leaderboard entries'))
+        self.stdout.write(self.style.SUCCESS(f'Created {rollup_count} activity rollups'))
+        self.stdout.write(self.style.SUCCESS(f'Indexed {search_count} search entries'))
+
+    def insert(self, model, documents, batch_size):
+        """Insert documents in unordered batches and report progress."""
+        collection = get_collection(model)
+        total = 0
+        for batch in batched(documents, batch_size):
+            collection.insert_many(batch, ordered=False)
+            total += len(batch)
+            self.stdout.write(f'Inserted {total} {model._meta.db_table}')
+        return total
+
+    @staticmethod
+    def generate_teams(count):
+        teams = TEAMS[:count]
+        for index in range(len(teams), count):
+            teams.append({'name': f'Squad {index}', 'description': f'Generated squad number {index}.'})
+        return teams
+
+    def user_at(self, index):
+        if index < len(HEROES) and HEROES[index]['team'] in self.team_names:
+            return HEROES[index]
+        team = self.teams[index % len(self.teams)]['name']
+        return {'name': f'Recruit {index}', 'email': f'recruit{index}@octofit.test', 'team': team}
+
+    def generate_users(self, count, created_at, updated_at):
+        for index in range(count):
+            yield dict(self.user_at(index), created_at=created_at, updated_at=updated_at)
+
+    def generate_activities(self, user_count, per_user, days, today, updated_at, rng):
+        for index in range(user_count):
+            email = self.user_at(index)['email']
+            count = per_user if per_user is not None else rng.randint(5, 10)
+            for _ in range(count):
+                yield {
                     'user_email': email,
-                    'user_name': user.name,
-                    'team': user.team,
-                    'total_calories': 0,
-                    'total_activities': 0
+                    'activity_type': rng.choice(ACTIVITY_TYPES),
+                    'duration': rng.randint(20, 120),
+                    'calories': rng.randint(200, 800),
+                    'date': today - timedelta(days=rng.randint(1, days), seconds=rng.randint(0, 86399)),
+                    'updated_at': updated_at,
                 }
-            leaderboard_data[email]['total_calories'] += activity.calories
-            leaderboard_data[email]['total_activities'] += 1
-        
-        # Sort by total calories and create leaderboard entries
-        sorted_data = sorted(leaderboard_data.values(), key=lambda x: x['total_calories'], reverse=True)
-        
-        for rank, data in enumerate(sorted_data, start=1):
-            Leaderboard.objects.create(
-                user_email=data['user_email'],
-                user_name=data['user_name'],
-                team=data['team'],
-                total_calories=data['total_calories'],
-                total_activities=data['total_activities'],
-                rank=rank
-            )
-            self.stdout.write(f'Rank {rank}: {data["user_name"]} - {data["total_calories"]} calories')
-        
-        self.stdout.write(self.style.SUCCESS('Database populated successfully!'))
-        self.stdout.write(self.style.SUCCESS(f'Created {len(teams)} teams'))
-        self.stdout.write(self.style.SUCCESS(f'Created {len(users)} users'))
-        self.stdout.write(self.style.SUCCESS(f'Created {len(workouts)} workouts'))
-        self.stdout.write(self.style.SUCCESS(f'Created {len(activities)} activities'))
-        self.stdout.write(self.style.SUCCESS(f'Created {len(sorted_data)} leaderboard entries'))
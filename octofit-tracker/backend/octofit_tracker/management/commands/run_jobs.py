@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (leaderboard rebuilds, denormalization repairs, index builds)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty instead of polling')
+        parser.add_argument('--poll', type=float, default=None, help='Seconds between polls of an empty queue')
+        parser.add_argument('--worker', default=None, help='Worker name stored on claimed jobs (default: host:pid:thread)')
+
+    def handle(self, *args, **options):
+        ran = jobs.work(worker=options['worker'], burst=options['burst'], poll=options['poll'])
+        self.stdout.write(self.style.SUCCESS(f'Ran {ran} jobs'))
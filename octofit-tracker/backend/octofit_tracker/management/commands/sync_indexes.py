@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.indexes import COVERED_QUERIES, managed_models, sync_indexes
+
+
+class Command(BaseCommand):
+    help = 'Create (and optionally drop) the MongoDB indexes declared on the models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop', action='store_true', help='Drop indexes that are not declared on a model')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without touching the database')
+        parser.add_argument('--database', default='default', help='Database alias to sync')
+
+    def handle(self, *args, **options):
+        changed = 0
+        for model in managed_models():
+            collection = model._meta.db_table
+            report = sync_indexes(model, drop=options['drop'], dry_run=options['dry_run'], using=options['database'])
+            for action, name, keys in report:
+                spec = ', '.join(f'{field} {direction}' for field, direction in keys)
+                line = f'{action:>7} {collection}.{name} ({spec})'
+                covers = COVERED_QUERIES.get(name)
+                if covers and action != 'dropped':
+                    line += f' -> {"; ".join(covers)}'
+                if action == 'exists':
+                    self.stdout.write(line)
+                else:
+                    changed += 1
+                    self.stdout.write(self.style.WARNING(line) if action == 'dropped' else self.style.SUCCESS(line))
+
+        prefix = 'Would change' if options['dry_run'] else 'Changed'
+        self.stdout.write(self.style.SUCCESS(f'{prefix} {changed} indexes'))
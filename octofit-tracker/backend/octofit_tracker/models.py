@@ -7,9 +7,15 @@ class User(models.Model):
     email = models.EmailField(unique=True)
     team = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team'], name='user_team'),
+            models.Index(fields=['-created_at', '-_id'], name='user_created'),
+            models.Index(fields=['updated_at', '_id'], name='user_updated'),
+        ]
     
     def __str__(self):
         return self.name
@@ -35,9 +41,16 @@ class Activity(models.Model):
     duration = models.IntegerField()  # in minutes
     calories = models.IntegerField()
     date = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'activities'
+        indexes = [
+            models.Index(fields=['user_email', '-date'], name='activity_user_date'),
+            models.Index(fields=['-date', '-_id'], name='activity_date'),
+            models.Index(fields=['user_email', 'updated_at', '_id'], name='activity_user_updated'),
+            models.Index(fields=['updated_at'], name='activity_updated'),
+        ]
     
     def __str__(self):
         return f"{self.user_email} - {self.activity_type}"
@@ -45,7 +58,7 @@ class Activity(models.Model):
 
 class Leaderboard(models.Model):
     _id = models.ObjectIdField(primary_key=True)
-    user_email = models.EmailField()
+    user_email = models.EmailField(unique=True)
     user_name = models.CharField(max_length=100)
     team = models.CharField(max_length=100)
     total_calories = models.IntegerField()
@@ -54,11 +67,89 @@ class Leaderboard(models.Model):
     
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            models.Index(fields=['rank'], name='leaderboard_rank'),
+            models.Index(fields=['team', 'rank'], name='leaderboard_team_rank'),
+        ]
     
     def __str__(self):
         return f"{self.user_name} - Rank {self.rank}"
 
 
+class PeriodLeaderboard(models.Model):
+    """Ranking within one day, ISO week or month; see leaderboard.py."""
+    _id = models.ObjectIdField(primary_key=True)
+    period = models.CharField(max_length=10)  # day, week or month
+    bucket = models.CharField(max_length=10)  # e.g. 2024-03-05, 2024-W10, 2024-03
+    user_email = models.EmailField()
+    user_name = models.CharField(max_length=100)
+    team = models.CharField(max_length=100)
+    total_calories = models.IntegerField()
+    total_activities = models.IntegerField()
+    rank = models.IntegerField()
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'leaderboard_periods'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'user_email'], name='period_leaderboard_user'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket', 'rank'], name='period_leaderboard_rank'),
+            models.Index(fields=['expires_at'], name='period_leaderboard_expiry'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_name} - {self.period} {self.bucket} Rank {self.rank}"
+
+
+class TeamLeaderboard(models.Model):
+    """Teams ranked by their members' all-time totals; see leaderboard.py."""
+    _id = models.ObjectIdField(primary_key=True)
+    team = models.CharField(max_length=100, unique=True)
+    total_calories = models.IntegerField()
+    total_activities = models.IntegerField()
+    active_members = models.IntegerField()
+    average_calories = models.FloatField()  # per active member
+    rank = models.IntegerField()
+    
+    class Meta:
+        db_table = 'leaderboard_teams'
+        indexes = [
+            models.Index(fields=['rank'], name='team_leaderboard_rank'),
+        ]
+    
+    def __str__(self):
+        return f"{self.team} - Rank {self.rank}"
+
+
+class ActivityRollup(models.Model):
+    """Activity totals of a user, a team or everyone for one day or ISO week; see rollups.py."""
+    _id = models.ObjectIdField(primary_key=True)
+    scope = models.CharField(max_length=10)  # user, team or all
+    key = models.CharField(max_length=100)  # user email, team name or '' for all
+    period = models.CharField(max_length=10)  # day or week
+    bucket = models.CharField(max_length=10)  # e.g. 2024-03-05, 2024-W10
+    start = models.DateTimeField()
+    count = models.IntegerField()
+    total_calories = models.IntegerField()
+    total_duration = models.IntegerField()
+    by_type = models.JSONField(default=dict)  # activity type -> {count, calories, duration}
+    
+    class Meta:
+        db_table = 'activity_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key', 'period', 'bucket'], name='rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['scope', 'key', 'period', 'start'], name='rollup_range'),
+            models.Index(fields=['start'], name='rollup_start'),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope} {self.key} - {self.period} {self.bucket}"
+
+
 class Workout(models.Model):
     _id = models.ObjectIdField(primary_key=True)
     name = models.CharField(max_length=100)
@@ -67,9 +158,92 @@ class Workout(models.Model):
     difficulty = models.CharField(max_length=50)
     estimated_calories = models.IntegerField()
     duration = models.IntegerField()  # in minutes
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['difficulty'], name='workout_difficulty'),
+            models.Index(fields=['category'], name='workout_category'),
+            models.Index(fields=['updated_at', '_id'], name='workout_updated'),
+        ]
     
     def __str__(self):
         return self.name
+
+
+class Job(models.Model):
+    """A queued background job; see jobs.py."""
+    _id = models.ObjectIdField(primary_key=True)
+    kind = models.CharField(max_length=100)
+    params = models.JSONField(default=dict)
+    lane = models.CharField(max_length=100, blank=True)  # jobs of a lane run one at a time, in order
+    status = models.CharField(max_length=20, default='queued')  # queued, running, done or failed
+    state = models.JSONField(default=dict)  # checkpoint the job resumes from
+    progress_done = models.IntegerField(default=0)
+    progress_total = models.IntegerField(null=True)
+    result = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    heartbeat_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created'),
+            models.Index(fields=['lane', 'status', 'created_at'], name='job_lane'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} - {self.status}"
+
+
+class SearchEntry(models.Model):
+    """One searchable user or workout; see search.py."""
+    _id = models.ObjectIdField(primary_key=True)
+    kind = models.CharField(max_length=20)  # user or workout
+    object_id = models.CharField(max_length=24)
+    title = models.CharField(max_length=200)
+    subtitle = models.CharField(max_length=200, blank=True)
+    prefix = models.CharField(max_length=200)  # normalized title, for autocomplete
+    terms = models.JSONField(default=list)  # normalized words of every searchable field
+    title_terms = models.JSONField(default=list)
+    indexed_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'search_index'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_entry_object'),
+        ]
+        indexes = [
+            models.Index(fields=['terms'], name='search_terms'),
+            models.Index(fields=['title_terms'], name='search_title_terms'),
+            models.Index(fields=['kind', 'prefix'], name='search_kind_prefix'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} - {self.title}"
+
+
+class Tombstone(models.Model):
+    """A deleted user, workout or activity, kept for delta sync; see sync.py."""
+    _id = models.ObjectIdField(primary_key=True)
+    kind = models.CharField(max_length=20)  # user or workout
+    object_id = models.CharField(max_length=24)
+    owner = models.CharField(max_length=254, blank=True)  # the activity's user_email
+    deleted_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'tombstones'
+        indexes = [
+            models.Index(fields=['kind', 'owner', 'deleted_at'], name='tombstone_kind_owner'),
+            models.Index(fields=['kind', 'deleted_at'], name='tombstone_kind'),
+            models.Index(fields=['deleted_at'], name='tombstone_expiry'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.object_id} - deleted {self.deleted_at}"
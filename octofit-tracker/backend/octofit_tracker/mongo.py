@@ -0,0 +1,39 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+
+def get_database(using='default'):
+    """Return the pymongo Database behind the djongo connection."""
+    connection = connections[using]
+    connection.ensure_connection()
+    return connection.connection
+
+
+def get_collection(model, using='default'):
+    """Return the pymongo Collection that stores the given model."""
+    return get_database(using)[model._meta.db_table]
+
+
+@lru_cache(maxsize=None)
+def read_preference(name):
+    try:
+        return make_read_preference(read_pref_mode_from_name(name), None)
+    except ValueError:
+        raise ImproperlyConfigured(f'Unknown MONGO_READ_PREFERENCE {name!r}')
+
+
+def get_read_collection(model, using='default'):
+    """
+    Return the model's collection for reads that tolerate replication lag.
+
+    Uses ``MONGO_READ_PREFERENCE``, so these reads can be spread over
+    secondaries while the ORM and all writes stay on the primary.
+    """
+    collection = get_collection(model, using)
+    if settings.MONGO_READ_PREFERENCE == 'primary':
+        return collection
+    return collection.with_options(read_preference=read_preference(settings.MONGO_READ_PREFERENCE))
@@ -0,0 +1,194 @@
+"""
+Keyset (seek) pagination.
+
+Pages are selected with a ``WHERE (ordering) > (last seen values)`` filter
+and a ``LIMIT`` instead of an offset, so djongo translates every page into
+an indexed range query no matter how deep the client has paged.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from bson import ObjectId
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from octofit_tracker.repositories import MongoQuery
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate on a unique, totally ordered tuple of fields.
+
+    ``ordering`` must end with a unique field so every row has a distinct
+    position. Cursors are opaque base64 tokens holding the boundary values
+    and the paging direction.
+    """
+    ordering = ('-_id',)
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_query(queryset, request)
+        return self.page_rows(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async ``paginate_queryset`` for queries with an awaitable ``fetch()``."""
+        queryset = self.page_query(queryset, request)
+        return self.page_rows(await queryset.fetch(self.page_size + 1))
+
+    def page_query(self, queryset, request):
+        """Order and filter ``queryset`` to start after the request's cursor."""
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+        return self.seek(queryset)
+
+    def seek(self, queryset):
+        """Order ``queryset`` on ``ordering`` and filter it past ``position``."""
+        ordering = [self._split(field) for field in self.ordering]
+        if self.reverse:
+            ordering = [(name, not descending) for name, descending in ordering]
+
+        queryset = queryset.order_by(*[('-' if descending else '') + name for name, descending in ordering])
+        if self.position is not None:
+            after = self._mongo_after if isinstance(queryset, MongoQuery) else self._after
+            queryset = queryset.filter(after(ordering, self.position))
+        return queryset
+
+    def page_rows(self, rows):
+        """Trim the fetched ``page_size + 1`` rows and record the page links."""
+        position = self.position
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        # An empty page keeps its own boundary so the client can page back.
+        self.first_position = self._position(rows[0]) if rows else position
+        self.last_position = self._position(rows[-1]) if rows else position
+        return rows
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        token = self.cursor_token(position, reverse)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        return self.parse_cursor(request.query_params.get(self.cursor_query_param))
+
+    def cursor_token(self, position, reverse):
+        payload = json.dumps({'p': [self._dump(value) for value in position], 'r': int(reverse)})
+        return urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def parse_cursor(self, token):
+        """Return ``(position, reverse)`` from a cursor token; raises NotFound when malformed."""
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError(token)
+            position = [
+                self.model._meta.get_field(self._split(field)[0]).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return position, bool(payload.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _position(self, row):
+        names = [self._split(field)[0] for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    @staticmethod
+    def _split(field):
+        return (field[1:], True) if field.startswith('-') else (field, False)
+
+    @staticmethod
+    def _after(ordering, position):
+        """Build the lexicographic "comes after position" filter."""
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(ordering, position):
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+    @staticmethod
+    def _mongo_after(ordering, position):
+        """The same filter as ``_after``, as a Mongo filter document."""
+        branches = []
+        equal = {}
+        for (name, descending), value in zip(ordering, position):
+            branches.append({**equal, name: {'$lt' if descending else '$gt': value}})
+            equal[name] = value
+        return {'$or': branches}
+
+    @staticmethod
+    def _dump(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, ObjectId):
+            return str(value)
+        return value
+
+
+class ActivityPagination(KeysetPagination):
+    ordering = ('-date', '-_id')
+
+
+class LeaderboardPagination(KeysetPagination):
+    ordering = ('rank', '_id')
@@ -0,0 +1,223 @@
+"""
+A compiled translation cache for djongo SELECT queries.
+
+djongo parses every SQL statement Django generates with ``sqlparse`` and
+converts it to a Mongo ``find`` or ``aggregate`` call, although the ORM
+only produces a handful of query shapes. ``install()`` swaps djongo's
+``Query`` for ``CachingQuery``, which keeps an LRU cache keyed on the
+parameterized SQL. On a miss the shape is compiled once with placeholder
+parameters into the ``find`` arguments (filter, projection, sort, limit,
+skip) or the aggregation pipeline; every call then only substitutes its
+own parameters.
+
+A shape is cached only if each placeholder comes through the translation
+untouched. Shapes where djongo transforms a parameter (``LIKE`` patterns,
+nested ``IN`` subqueries) fall back to djongo's translation, as do calls
+with dict parameters, which djongo unpacks into field paths. Writes are
+never cached. Hits, misses and bypasses are counted for the metrics
+endpoint.
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from djongo import cursor as djongo_cursor
+from djongo.sql2mongo.query import Query, SelectQuery
+from sqlparse import parse as sqlparse
+
+
+class Param:
+    """Placeholder for the parameter at ``index`` while a shape is compiled."""
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return f'Param({self.index})'
+
+
+def _bind(value, params):
+    if isinstance(value, Param):
+        return params[value.index]
+    if isinstance(value, dict):
+        return {key: _bind(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_bind(item, params) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_bind(item, params) for item in value)
+    return value
+
+
+def _placeholders(value, found):
+    if isinstance(value, Param):
+        found.add(value.index)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _placeholders(item, found)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _placeholders(item, found)
+    return found
+
+
+class Plan:
+    """A compiled SELECT: the collection and the find/aggregate arguments."""
+
+    def __init__(self, table, aggregate, arguments, template):
+        self.table = table
+        self.aggregate = aggregate
+        self.arguments = arguments
+        # The parsed query; only its parameter-free column list is used.
+        self.template = template
+
+    @classmethod
+    def compile(cls, db, connection_properties, sql, param_count):
+        """Compile ``sql`` with placeholders, or return None if it cannot be cached."""
+        params = tuple(Param(index) for index in range(param_count))
+        try:
+            query = SelectQuery(db, connection_properties, sqlparse(sql)[0], params)
+            if query.nested_query:
+                return None
+            if query._needs_aggregation():
+                aggregate, arguments = True, query._make_pipeline()
+            else:
+                aggregate, arguments = False, {}
+                for converter in (query.where, query.selected_columns, query.limit, query.order, query.offset):
+                    if converter:
+                        arguments.update(converter.to_mongo())
+        except Exception:
+            return None
+        if _placeholders(arguments, set()) != set(range(param_count)):
+            return None
+        return cls(query.left_table, aggregate, arguments, query)
+
+
+class BoundQuery:
+    """A ``Plan`` bound to one call's parameters; iterates like djongo's SelectQuery."""
+
+    def __init__(self, plan, db, params):
+        self.plan = plan
+        self.db = db
+        self.params = params
+        self._cursor = None
+
+    def _get_cursor(self):
+        collection = self.db[self.plan.table]
+        arguments = _bind(self.plan.arguments, self.params)
+        if self.plan.aggregate:
+            return collection.aggregate(arguments)
+        return collection.find(**arguments)
+
+    def __iter__(self):
+        if self._cursor is None:
+            self._cursor = self._get_cursor()
+        if not self._cursor.alive:
+            return
+        for document in self._cursor:
+            yield self.plan.template._align_results(document)
+
+    def count(self):
+        if self._cursor is None:
+            self._cursor = self._get_cursor()
+        return len(list(self._cursor))
+
+
+class TranslationCache:
+    """A bounded LRU of compiled plans, with hit/miss/bypass counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.enabled = True
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def get(self, key, compile):
+        """Return the plan for ``key``, compiling it on a miss; None if uncacheable."""
+        with self._lock:
+            if key in self._plans:
+                self._plans.move_to_end(key)
+                plan = self._plans[key]
+                if plan is None:
+                    self.bypassed += 1
+                else:
+                    self.hits += 1
+                return plan
+        plan = compile()
+        with self._lock:
+            if plan is None:
+                self.bypassed += 1
+            else:
+                self.misses += 1
+            # Uncacheable shapes are remembered too, so they are not recompiled.
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = self.misses = self.bypassed = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._plans),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+    def prometheus(self):
+        stats = self.stats()
+        lines = []
+        for name in ('hits', 'misses', 'bypassed'):
+            lines.append(f'# TYPE octofit_translation_cache_{name}_total counter')
+            lines.append(f'octofit_translation_cache_{name}_total {stats[name]}')
+        lines.append('# TYPE octofit_translation_cache_size gauge')
+        lines.append(f'octofit_translation_cache_size {stats["size"]}')
+        return '\n'.join(lines) + '\n'
+
+
+cache = TranslationCache(maxsize=512)
+
+
+class CachingQuery(Query):
+    """djongo's ``Query`` with SELECT translation served from ``cache``."""
+
+    def parse(self):
+        params = self._params or ()
+        if (not cache.enabled or not self._sql.startswith('SELECT')
+                or any(isinstance(param, dict) for param in params)):
+            return super().parse()
+        key = (self._sql, self.connection_properties.enforce_schema)
+        plan = cache.get(key, lambda: Plan.compile(self.db, self.connection_properties, self._sql, len(params)))
+        if plan is None:
+            return super().parse()
+        return BoundQuery(plan, self.db, params)
+
+
+@contextmanager
+def disabled():
+    """Translate every query with djongo inside the block, e.g. for benchmarks."""
+    enabled, cache.enabled = cache.enabled, False
+    try:
+        yield
+    finally:
+        cache.enabled = enabled
+
+
+def install():
+    """Route djongo's SELECT translation through the cache, sized by ``DJONGO_TRANSLATION_CACHE_SIZE``."""
+    cache.maxsize = settings.DJONGO_TRANSLATION_CACHE_SIZE
+    if cache.maxsize > 0:
+        djongo_cursor.Query = CachingQuery
@@ -0,0 +1,137 @@
+"""
+Read repositories for the hot lookup endpoints.
+
+``OrmRepository`` answers equality lookups with Django querysets, which
+djongo turns into SQL and then parses back into a Mongo query on every
+call. ``MongoRepository`` answers the same lookups with a ``MongoQuery``
+that goes straight to pymongo ``find``. Viewsets choose one with
+``repository_class``; both return rows that ``RowMapper`` and
+``KeysetPagination`` handle identically.
+
+Repositories read through ``get_read_collection`` (and so possibly a
+lagging secondary) unless built with ``primary=True``, for reads that must
+see every committed write, such as delta sync.
+"""
+from bson.codec_options import CodecOptions
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING
+
+from octofit_tracker import aio
+from octofit_tracker.mongo import get_collection, get_read_collection
+
+
+class MongoQuery:
+    """
+    A lazy ``find`` on a model's collection.
+
+    Supports the small slice of the QuerySet API the lean list path uses:
+    ``filter`` (with a Mongo filter document), ``order_by``, ``values``,
+    slicing with a stop and iteration. Rows are plain dicts, like
+    ``QuerySet.values()``.
+    """
+
+    def __init__(self, model, match, sort=(), fields=None, primary=False):
+        self.model = model
+        self.match = match
+        self.sort = list(sort)
+        self.fields = fields
+        self.primary = primary
+
+    def _clone(self, **changes):
+        state = {'match': self.match, 'sort': self.sort, 'fields': self.fields, 'primary': self.primary, **changes}
+        return type(self)(self.model, **state)
+
+    def filter(self, match):
+        return self._clone(match={'$and': [self.match, match]} if self.match else match)
+
+    def order_by(self, *fields):
+        sort = [
+            (self.column(field[1:]), DESCENDING) if field.startswith('-') else (self.column(field), ASCENDING)
+            for field in fields
+        ]
+        return self._clone(sort=sort)
+
+    def values(self, *fields):
+        return self._clone(fields=list(fields))
+
+    def column(self, name):
+        return self.model._meta.get_field(name).column
+
+    def cursor(self, limit=0):
+        projection = {self.column(name): 1 for name in self.fields} if self.fields else None
+        collection = get_collection(self.model) if self.primary else get_read_collection(self.model)
+        if settings.USE_TZ:
+            # Match the ORM, which returns aware UTC datetimes.
+            collection = collection.with_options(codec_options=CodecOptions(tz_aware=True))
+        cursor = collection.find(self.match, projection, limit=limit)
+        return cursor.sort(self.sort) if self.sort else cursor
+
+    def rows(self, cursor):
+        if not self.fields:
+            yield from cursor
+            return
+        names = [(name, self.column(name)) for name in self.fields]
+        for document in cursor:
+            yield {name: document.get(column) for name, column in names}
+
+    def __iter__(self):
+        return self.rows(self.cursor())
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.start or index.step or index.stop is None:
+            raise TypeError('MongoQuery only supports [:n] slicing')
+        return list(self.rows(self.cursor(limit=index.stop))) if index.stop else []
+
+
+class AsyncMongoQuery(MongoQuery):
+    """A ``MongoQuery`` for async views; await ``fetch()`` instead of iterating."""
+
+    async def fetch(self, limit=0):
+        return await aio.run(lambda: list(self.rows(self.cursor(limit))))
+
+    def __iter__(self):
+        raise TypeError('AsyncMongoQuery must be awaited with fetch()')
+
+    def __getitem__(self, index):
+        raise TypeError('AsyncMongoQuery must be awaited with fetch()')
+
+
+class OrmRepository:
+    """
+    Field lookups through the Django ORM (and djongo's SQL translation).
+
+    Repositories accept exact matches and the ``__gt``, ``__gte``, ``__lt``
+    and ``__lte`` lookups. The ORM always reads from the primary, so
+    ``primary`` is accepted only for parity with ``MongoRepository``.
+    """
+
+    def __init__(self, model, primary=False):
+        self.model = model
+        self.primary = primary
+
+    def filter(self, **lookups):
+        return self.model.objects.filter(**lookups)
+
+
+class MongoRepository(OrmRepository):
+    """The same lookups as ``OrmRepository``, run directly with pymongo."""
+    query_class = MongoQuery
+
+    operators = {'gt': '$gt', 'gte': '$gte', 'lt': '$lt', 'lte': '$lte'}
+
+    def filter(self, **lookups):
+        query = self.query_class(self.model, {}, primary=self.primary)
+        match = {}
+        for lookup, value in lookups.items():
+            name, _, operator = lookup.partition('__')
+            condition = {self.operators[operator]: value} if operator else value
+            if operator and isinstance(match.get(query.column(name)), dict):
+                match[query.column(name)].update(condition)
+            else:
+                match[query.column(name)] = condition
+        return query.filter(match)
+
+
+class AsyncMongoRepository(MongoRepository):
+    """The ``MongoRepository`` lookups for async views."""
+    query_class = AsyncMongoQuery
@@ -0,0 +1,292 @@
+"""
+Pre-aggregated activity time series.
+
+``ActivityRollup`` holds one document per scope (a user, a team or
+everyone), period (day or ISO week) and bucket, with the bucket's count,
+calories and duration in total and per activity type. A month chart reads
+about thirty daily documents and a year chart about fifty weekly ones,
+whatever the number of activities behind them.
+
+Rollups are kept up to date from the same writes as the leaderboard:
+``apply`` adds (or with ``sign=-1`` removes) a batch of activities with one
+upsert per touched bucket. A team's series is the sum of its members'
+series; ``refresh_team`` recomputes it that way after the team moves and
+renames propagated by ``denormalize.py``, and ``refresh_user`` recomputes
+a user's series after an email change, so they can safely run twice.
+
+``rebuild`` recomputes everything from the activities (see the
+``backfill_rollups`` command) one week at a time: ``rebuild_week``
+replaces the day and week buckets of a week with totals computed from its
+activities. Readers never see an emptied collection, and a week rebuilt
+twice, e.g. by a job resumed after a crash, comes out the same.
+"""
+from datetime import datetime, timedelta
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from octofit_tracker import stats
+from octofit_tracker.leaderboard import bucket_key, bucket_start
+from octofit_tracker.models import User, Activity, ActivityRollup
+from octofit_tracker.mongo import get_collection, get_read_collection
+
+PERIODS = ('day', 'week')
+
+# Activity types become field names under ``by_type``, where '.' and a
+# leading '$' are not allowed.
+_ESCAPES = (('.', '．'), ('$', '＄'))
+
+
+def _type_field(activity_type):
+    for char, escape in _ESCAPES:
+        activity_type = activity_type.replace(char, escape)
+    return activity_type
+
+
+def _type_name(field):
+    for char, escape in _ESCAPES:
+        field = field.replace(escape, char)
+    return field
+
+
+def _user_teams(emails):
+    users = get_collection(User).find({'email': {'$in': list(emails)}}, {'email': 1, 'team': 1})
+    return {user['email']: user.get('team', '') for user in users}
+
+
+def _increments(activities, teams, sign):
+    """
+    Return ``{(scope, key, period, bucket): (start, {field: delta})}`` for
+    ``activities``; an activity dict with a ``count`` stands for that many.
+    """
+    increments = {}
+    for activity in activities:
+        figures = {
+            'count': sign * activity.get('count', 1),
+            'calories': sign * activity['calories'],
+            'duration': sign * activity['duration'],
+        }
+        scopes = [('user', activity['user_email']), ('all', '')]
+        if teams.get(activity['user_email']):
+            scopes.append(('team', teams[activity['user_email']]))
+        for period in PERIODS:
+            bucket = bucket_key(period, activity['date'])
+            for scope, key in scopes:
+                start, fields = increments.setdefault(
+                    (scope, key, period, bucket), (bucket_start(period, activity['date']), {})
+                )
+                _add(fields, activity['activity_type'], figures)
+    return increments
+
+
+def _add(fields, activity_type, figures):
+    type_field = _type_field(activity_type)
+    for name, value in figures.items():
+        total = 'count' if name == 'count' else f'total_{name}'
+        fields[total] = fields.get(total, 0) + value
+        path = f'by_type.{type_field}.{name}'
+        fields[path] = fields.get(path, 0) + value
+
+
+def _write(increments):
+    if not increments:
+        return
+    writes = []
+    cleanups = []
+    for (scope, key, period, bucket), (start, fields) in increments.items():
+        selector = {'scope': scope, 'key': key, 'period': period, 'bucket': bucket}
+        writes.append(UpdateOne(selector, {'$inc': fields, '$setOnInsert': {'start': start}}, upsert=True))
+        # Drop the types, then the buckets, that a removal emptied.
+        for path, value in fields.items():
+            if path.startswith('by_type.') and path.endswith('.count') and value < 0:
+                type_path = path[:-len('.count')]
+                cleanups.append(UpdateOne({**selector, path: {'$lte': 0}}, {'$unset': {type_path: ''}}))
+        if fields['count'] < 0:
+            cleanups.append(DeleteOne({**selector, 'count': {'$lte': 0}}))
+    get_collection(ActivityRollup).bulk_write(writes + cleanups, ordered=True)
+
+
+def apply(activities, sign=1):
+    """
+    Add ``activities`` (dicts with ``user_email``, ``activity_type``,
+    ``duration``, ``calories`` and ``date``) to their buckets, or remove
+    them with ``sign=-1``. Buckets left without activities are deleted.
+    """
+    activities = list(activities)
+    if activities:
+        teams = _user_teams({activity['user_email'] for activity in activities})
+        _write(_increments(activities, teams, sign))
+
+
+def _rollup_increments(scope, key, documents, sign):
+    """Increments that add (or subtract) whole rollup ``documents`` to ``key``'s buckets."""
+    increments = {}
+    for document in documents:
+        start, fields = increments.setdefault(
+            (scope, key, document['period'], document['bucket']), (document['start'], {})
+        )
+        for type_field, figures in document['by_type'].items():
+            _add(fields, _type_name(type_field), {name: sign * value for name, value in figures.items()})
+    return increments
+
+
+def _document(scope, key, period, bucket, start, fields):
+    """The rollup document of one bucket's ``_add`` fields."""
+    by_type = {}
+    for path, value in fields.items():
+        if path.startswith('by_type.'):
+            _, type_field, name = path.split('.')
+            by_type.setdefault(type_field, {})[name] = value
+    return {
+        'scope': scope, 'key': key, 'period': period, 'bucket': bucket, 'start': start,
+        'count': fields['count'], 'total_calories': fields['total_calories'],
+        'total_duration': fields['total_duration'],
+        'by_type': {type_field: figures for type_field, figures in by_type.items() if figures['count'] > 0},
+    }
+
+
+def _replace(increments, stale):
+    """Store the buckets of ``increments`` as computed and delete the buckets matching ``stale`` it lacks."""
+    writes = []
+    written = set()
+    for (scope, key, period, bucket), (start, fields) in increments.items():
+        if fields['count'] > 0:
+            selector = {'scope': scope, 'key': key, 'period': period, 'bucket': bucket}
+            writes.append(ReplaceOne(selector, _document(scope, key, period, bucket, start, fields), upsert=True))
+            written.add((scope, key, period, bucket))
+    rollups = get_collection(ActivityRollup)
+    for document in rollups.find(stale, {'scope': 1, 'key': 1, 'period': 1, 'bucket': 1}):
+        if (document['scope'], document['key'], document['period'], document['bucket']) not in written:
+            writes.append(DeleteOne({'_id': document['_id']}))
+    if writes:
+        rollups.bulk_write(writes, ordered=False)
+
+
+def buckets(scope, key):
+    """The ``(period, bucket)`` pairs ``key``'s series has."""
+    documents = get_collection(ActivityRollup).find({'scope': scope, 'key': key}, {'period': 1, 'bucket': 1})
+    return {(document['period'], document['bucket']) for document in documents}
+
+
+def refresh_team(team, team_buckets):
+    """Recompute ``team``'s ``(period, bucket)`` buckets from its current members' series."""
+    if not team:
+        return
+    members = [user['email'] for user in get_collection(User).find({'team': team}, {'email': 1})]
+    for period in PERIODS:
+        keys = sorted(bucket for bucket_period, bucket in team_buckets if bucket_period == period)
+        if keys:
+            documents = get_collection(ActivityRollup).find(
+                {'scope': 'user', 'key': {'$in': members}, 'period': period, 'bucket': {'$in': keys}}
+            )
+            _replace(_rollup_increments('team', team, documents, 1),
+                     {'scope': 'team', 'key': team, 'period': period, 'bucket': {'$in': keys}})
+
+
+def rename_team(old_name, new_name):
+    """Move a renamed team's series, merging into buckets the new name already has."""
+    rollups = get_collection(ActivityRollup)
+    if rollups.count_documents({'scope': 'team', 'key': new_name}, limit=1) == 0:
+        rollups.update_many({'scope': 'team', 'key': old_name}, {'$set': {'key': new_name}})
+        return
+    refresh_team(new_name, buckets('team', old_name) | buckets('team', new_name))
+    rollups.delete_many({'scope': 'team', 'key': old_name})
+
+
+def refresh_user(user_email):
+    """Recompute ``user_email``'s series from its activities, merging into buckets it already has."""
+    activities = get_collection(Activity).find(
+        {'user_email': user_email}, {'user_email': 1, 'activity_type': 1, 'duration': 1, 'calories': 1, 'date': 1}
+    )
+    increments = _increments(activities, {}, 1)
+    _replace({selector: value for selector, value in increments.items() if selector[0] == 'user'},
+             {'scope': 'user', 'key': user_email})
+
+
+def _week(sort):
+    activity = get_collection(Activity).find_one({}, {'date': 1}, sort=[('date', sort)])
+    return bucket_start('week', activity['date']) if activity else None
+
+
+def first_week():
+    """The start of the week of the oldest activity, or None without activities."""
+    return _week(1)
+
+
+def last_week():
+    """The start of the week of the newest activity, or None without activities."""
+    return _week(-1)
+
+
+def rebuild_week(start):
+    """Replace the day and week buckets of the week starting ``start`` with totals from its activities."""
+    groups = get_collection(Activity).aggregate([
+        {'$match': {'date': {'$gte': start, '$lt': start + timedelta(weeks=1)}}},
+        {'$group': {
+            '_id': {
+                'user_email': '$user_email',
+                'activity_type': '$activity_type',
+                'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+            },
+            'count': {'$sum': 1},
+            'calories': {'$sum': '$calories'},
+            'duration': {'$sum': '$duration'},
+        }},
+    ], allowDiskUse=True)
+    activities = [
+        {
+            'user_email': group['_id']['user_email'],
+            'activity_type': group['_id']['activity_type'],
+            'date': datetime.strptime(group['_id']['day'], '%Y-%m-%d'),
+            'count': group['count'],
+            'calories': group['calories'],
+            'duration': group['duration'],
+        }
+        for group in groups
+    ]
+    teams = _user_teams({activity['user_email'] for activity in activities})
+    _replace(_increments(activities, teams, 1), {'start': {'$gte': start, '$lt': start + timedelta(weeks=1)}})
+
+
+def remove_outside(first, end):
+    """Delete the buckets before the week ``first`` or from ``end`` on (every bucket when ``first`` is None)."""
+    if first is None:
+        get_collection(ActivityRollup).delete_many({})
+    else:
+        get_collection(ActivityRollup).delete_many({'$or': [{'start': {'$lt': first}}, {'start': {'$gte': end}}]})
+
+
+def rebuild():
+    """Recompute every rollup from the activities, a week at a time; returns the number of rollups."""
+    first = week = first_week()
+    while week is not None and week <= last_week():
+        rebuild_week(week)
+        week += timedelta(weeks=1)
+    remove_outside(first, week)
+    return get_collection(ActivityRollup).count_documents({})
+
+
+def series(scope, key, period='day', since=None, until=None):
+    """
+    Return the stats response (see ``stats.summarize``) of one scope's
+    buckets, read from the rollups alone. ``since`` and ``until`` select
+    the buckets that hold them.
+    """
+    match = {'scope': scope, 'key': key, 'period': period}
+    if since is not None or until is not None:
+        match['start'] = {}
+        if since is not None:
+            match['start']['$gte'] = bucket_start(period, since)
+        if until is not None:
+            match['start']['$lte'] = until
+    documents = get_read_collection(ActivityRollup).find(match, {'bucket': 1, 'by_type': 1}).sort('start', 1)
+    return stats.summarize(
+        (
+            (document['bucket'], activity_type, figures['count'], figures['calories'], figures['duration'])
+            for document in documents
+            for activity_type, figures in sorted(
+                (_type_name(field), figures) for field, figures in document['by_type'].items()
+            )
+            if figures['count'] > 0
+        ),
+        period,
+    )
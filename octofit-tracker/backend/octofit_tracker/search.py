@@ -0,0 +1,231 @@
+"""
+Full-text and prefix search over users and workouts.
+
+The ``search_index`` collection is an inverted index with one entry per
+searchable object: its normalized title and the tokens of its searchable
+fields, both stored as multikey arrays. Signals (see ``signals.py``) and
+the denormalization propagators keep entries in step with every write, so
+reads never scan the source collections. Activities are not indexed: they
+are written far more often than they are searched, and the admin filters
+them by ``user_email`` and ``activity_type`` instead.
+
+``search`` fetches at most ``SEARCH_MAX_CANDIDATES`` entries through the
+``terms`` index, entries holding every query token first, and orders them
+by relevance: tokens found in the title weigh more than tokens found in
+other fields. ``autocomplete`` matches the start of a title, or of any word
+in it, through the ``prefix`` and ``title_terms`` indexes. The admin
+changelist search uses ``object_ids``.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReplaceOne
+
+from octofit_tracker.models import User, Workout, SearchEntry
+from octofit_tracker.mongo import get_collection
+
+# Kind -> the source model, the fields shown as title and subtitle, and the
+# fields whose words are searchable.
+SOURCES = {
+    'user': {'model': User, 'title': 'name', 'subtitle': 'email', 'fields': ('name', 'email', 'team')},
+    'workout': {'model': Workout, 'title': 'name', 'subtitle': 'category',
+                'fields': ('name', 'description', 'category', 'difficulty')},
+}
+
+KINDS = {source['model']: kind for kind, source in SOURCES.items()}
+
+AUTOCOMPLETE_KINDS = ('user', 'workout')
+
+TITLE_WEIGHT = 3
+TERM_WEIGHT = 1
+
+
+def normalize(text):
+    """Lowercase ``text`` and strip accents, so 'Énergie' matches 'energie'."""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower().strip()
+
+
+def tokenize(text):
+    """Return the distinct words of ``text`` (two characters or longer), in order."""
+    return list(dict.fromkeys(word for word in re.findall(r'\w+', normalize(text)) if len(word) > 1))
+
+
+def build_entry(kind, document):
+    """Return the index entry for a source ``document`` (column -> value)."""
+    source = SOURCES[kind]
+    title = str(document.get(source['title']) or '')
+    terms = []
+    for field in source['fields']:
+        terms.extend(tokenize(document.get(field) or ''))
+    return {
+        'kind': kind,
+        'object_id': str(document['_id']),
+        'title': title,
+        'subtitle': str(document.get(source['subtitle']) or ''),
+        'prefix': normalize(title),
+        'terms': list(dict.fromkeys(terms)),
+        'title_terms': tokenize(title),
+        'indexed_at': timezone.now(),
+    }
+
+
+def instance_document(instance):
+    source = SOURCES[KINDS[type(instance)]]
+    document = {field: getattr(instance, field) for field in source['fields']}
+    document['_id'] = instance.pk
+    return document
+
+
+def index_many(kind, documents):
+    """Upsert the entries of ``documents`` of one kind; returns how many were written."""
+    writes = []
+    for document in documents:
+        entry = build_entry(kind, document)
+        writes.append(ReplaceOne({'kind': kind, 'object_id': entry['object_id']}, entry, upsert=True))
+    if writes:
+        get_collection(SearchEntry).bulk_write(writes, ordered=False)
+    return len(writes)
+
+
+def index_instance(instance):
+    index_many(KINDS[type(instance)], [instance_document(instance)])
+
+
+def remove(kind, object_id):
+    get_collection(SearchEntry).delete_one({'kind': kind, 'object_id': str(object_id)})
+
+
+def reindex(kind, match=None, batch_size=1000, after=None):
+    """
+    Index the ``kind`` objects matching ``match`` in ``_id`` order, a batch
+    at a time starting past ``after``. Yields the last ``_id`` of each batch.
+    """
+    source = SOURCES[kind]
+    projection = {field: 1 for field in source['fields'] + (source['title'], source['subtitle'])}
+    collection = get_collection(source['model'])
+    last = after
+    while True:
+        query = dict(match or {})
+        if last is not None:
+            query['_id'] = {'$gt': last}
+        batch = list(collection.find(query, projection).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return
+        index_many(kind, batch)
+        last = batch[-1]['_id']
+        yield last
+
+
+def remove_stale(started):
+    """Delete entries not rewritten since ``started``, i.e. of deleted objects or dropped kinds."""
+    return get_collection(SearchEntry).delete_many({'indexed_at': {'$lt': started}}).deleted_count
+
+
+def rebuild(batch_size=1000):
+    """Reindex every kind from its source collection; returns the number of entries."""
+    started = timezone.now()
+    for kind in SOURCES:
+        for _ in reindex(kind, batch_size=batch_size):
+            pass
+    remove_stale(started)
+    return get_collection(SearchEntry).count_documents({})
+
+
+def _word_prefix_match(field, tokens, partial):
+    """Entries whose ``field`` holds every word of ``tokens`` and a word starting with ``partial``."""
+    conditions = []
+    if tokens:
+        conditions.append({field: {'$all': tokens}})
+    if partial:
+        conditions.append({field: {'$regex': '^' + re.escape(partial)}})
+    return {'$and': conditions} if len(conditions) > 1 else conditions[0]
+
+
+def _split_partial(query):
+    """Split ``query`` into its complete words and the word being typed."""
+    words = re.findall(r'\w+', normalize(query))
+    if not words:
+        return [], ''
+    return [word for word in words[:-1] if len(word) > 1], words[-1]
+
+
+def score(entry, tokens, prefix):
+    title_terms = set(entry['title_terms'])
+    terms = set(entry['terms'])
+    value = sum(TITLE_WEIGHT if token in title_terms else TERM_WEIGHT if token in terms else 0 for token in tokens)
+    if entry['prefix'].startswith(prefix):
+        value += TITLE_WEIGHT
+    return value
+
+
+def result(entry, **extra):
+    return {'kind': entry['kind'], 'id': entry['object_id'], 'title': entry['title'],
+            'subtitle': entry['subtitle'], **extra}
+
+
+def search(query, kinds=None, limit=20):
+    """
+    Return up to ``limit`` results for ``query``, most relevant first.
+
+    Entries containing every query word are fetched before entries that
+    contain only some, and at most ``SEARCH_MAX_CANDIDATES`` are scored.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    kinds = list(kinds or SOURCES)
+    budget = settings.SEARCH_MAX_CANDIDATES
+    projection = {'kind': 1, 'object_id': 1, 'title': 1, 'subtitle': 1, 'prefix': 1, 'terms': 1, 'title_terms': 1}
+    collection = get_collection(SearchEntry)
+    candidates = {}
+    for operator in ('$all', '$in') if len(tokens) > 1 else ('$in',):
+        remaining = budget - len(candidates)
+        if remaining <= 0:
+            break
+        for entry in collection.find({'kind': {'$in': kinds}, 'terms': {operator: tokens}}, projection,
+                                     limit=remaining):
+            candidates.setdefault(entry['_id'], entry)
+    prefix = normalize(query)
+    ranked = sorted(
+        ((score(entry, tokens, prefix), entry) for entry in candidates.values()),
+        key=lambda pair: (-pair[0], pair[1]['prefix'], pair[1]['object_id']),
+    )
+    return [result(entry, score=value) for value, entry in ranked[:limit]]
+
+
+def autocomplete(query, kinds=AUTOCOMPLETE_KINDS, limit=10):
+    """
+    Return up to ``limit`` entries whose title starts with ``query``, then
+    entries with a title word starting with its last word, by title.
+    """
+    prefix = normalize(query)
+    tokens, partial = _split_partial(query)
+    if not partial:
+        return []
+    collection = get_collection(SearchEntry)
+    projection = {'kind': 1, 'object_id': 1, 'title': 1, 'subtitle': 1}
+    kinds = {'$in': list(kinds)}
+    entries = list(collection.find({'kind': kinds, 'prefix': {'$regex': '^' + re.escape(prefix)}}, projection)
+                   .sort([('prefix', 1), ('object_id', 1)]).limit(limit))
+    if len(entries) < limit:
+        seen = {entry['_id'] for entry in entries}
+        match = {'kind': kinds, **_word_prefix_match('title_terms', tokens, partial)}
+        more = collection.find(match, projection).sort([('prefix', 1), ('object_id', 1)]).limit(limit + len(seen))
+        entries.extend(entry for entry in more if entry['_id'] not in seen)
+    return [result(entry) for entry in entries[:limit]]
+
+
+def object_ids(kind, query, limit):
+    """
+    Return the ids of up to ``limit`` ``kind`` objects holding every word of
+    ``query``, the last one as a prefix; None when ``query`` has no words.
+    """
+    tokens, partial = _split_partial(query)
+    if not partial:
+        return None
+    match = {'kind': kind, **_word_prefix_match('terms', tokens, partial)}
+    entries = get_collection(SearchEntry).find(match, {'object_id': 1}, limit=limit)
+    return [entry['object_id'] for entry in entries]
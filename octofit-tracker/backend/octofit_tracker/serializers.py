@@ -1,12 +1,22 @@
+from django.db.models import Count
 from rest_framework import serializers
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, Job
+from octofit_tracker import jobs
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['_id', 'name', 'email', 'team', 'created_at']
-        read_only_fields = ['_id', 'created_at']
+        fields = ['_id', 'name', 'email', 'team', 'created_at', 'updated_at']
+        read_only_fields = ['_id', 'created_at', 'updated_at']
+
+
+class TeamListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """Prefetch member counts for every team on the page."""
+        teams = list(data.all() if hasattr(data, 'all') else data)
+        self.child.member_counts = member_counts([team.name for team in teams])
+        return super().to_representation(teams)
 
 
 class TeamSerializer(serializers.ModelSerializer):
@@ -16,17 +26,21 @@ class TeamSerializer(serializers.ModelSerializer):
         model = Team
         fields = ['_id', 'name', 'description', 'created_at', 'member_count']
         read_only_fields = ['_id', 'created_at']
+        list_serializer_class = TeamListSerializer
     
     def get_member_count(self, obj):
         """Calculate the number of members in this team."""
+        counts = getattr(self, 'member_counts', None)
+        if counts is not None:
+            return counts.get(obj.name, 0)
         return User.objects.filter(team=obj.name).count()
 
 
 class ActivitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Activity
-        fields = ['_id', 'user_email', 'activity_type', 'duration', 'calories', 'date']
-        read_only_fields = ['_id']
+        fields = ['_id', 'user_email', 'activity_type', 'duration', 'calories', 'date', 'updated_at']
+        read_only_fields = ['_id', 'updated_at']
 
 
 class LeaderboardSerializer(serializers.ModelSerializer):
@@ -36,8 +50,110 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         read_only_fields = ['_id']
 
 
+class TeamLeaderboardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TeamLeaderboard
+        fields = ['_id', 'team', 'total_calories', 'total_activities', 'active_members', 'average_calories', 'rank']
+        read_only_fields = fields
+
+
 class WorkoutSerializer(serializers.ModelSerializer):
     class Meta:
         model = Workout
-        fields = ['_id', 'name', 'description', 'category', 'difficulty', 'estimated_calories', 'duration']
-        read_only_fields = ['_id']
+        fields = ['_id', 'name', 'description', 'category', 'difficulty', 'estimated_calories', 'duration', 'updated_at']
+        read_only_fields = ['_id', 'updated_at']
+
+
+class BatchJobParams(serializers.Serializer):
+    batch_size = serializers.IntegerField(min_value=1, required=False)
+
+
+class RepairJobParams(BatchJobParams):
+    repair = serializers.BooleanField(required=False)
+
+
+# Job kinds API clients may queue -> the serializer of their params. The
+# propagate_* jobs are internal, and dropping indexes is left to the
+# sync_indexes command.
+API_JOB_PARAMS = {
+    'rebuild_leaderboard': serializers.Serializer,
+    'repair_denormalized': RepairJobParams,
+    'sync_indexes': serializers.Serializer,
+    'rebuild_search': BatchJobParams,
+    'rebuild_rollups': serializers.Serializer,
+}
+
+
+class JobSerializer(serializers.ModelSerializer):
+    params = serializers.DictField(required=False, default=dict)
+    result = serializers.DictField(read_only=True)
+    
+    class Meta:
+        model = Job
+        fields = ['_id', 'kind', 'params', 'status', 'progress_done', 'progress_total', 'result', 'error',
+                  'attempts', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = ['_id', 'status', 'progress_done', 'progress_total', 'error',
+                            'attempts', 'created_at', 'started_at', 'finished_at']
+    
+    def validate_kind(self, value):
+        if value not in API_JOB_PARAMS:
+            raise serializers.ValidationError(f'Kind must be one of: {", ".join(sorted(API_JOB_PARAMS))}')
+        return value
+    
+    def validate(self, data):
+        params = API_JOB_PARAMS[data['kind']](data=data['params'])
+        unknown = sorted(set(data['params']) - set(params.fields))
+        if unknown:
+            raise serializers.ValidationError({'params': f'Unknown params for {data["kind"]}: {", ".join(unknown)}'})
+        if not params.is_valid():
+            raise serializers.ValidationError({'params': params.errors})
+        return {**data, 'params': dict(params.validated_data)}
+    
+    def create(self, validated_data):
+        job = jobs.enqueue(validated_data['kind'], validated_data['params'])
+        return Job.objects.get(pk=job['_id'])
+
+
+class RowMapper:
+    """
+    Render ``.values()`` rows exactly like a ModelSerializer would.
+
+    Field conversions are resolved once from the serializer's fields, so a
+    row costs a single dict build instead of a model instance plus a
+    field-by-field serializer pass.
+    """
+
+    def __init__(self, serializer_class):
+        self.converters = []
+        for name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.SerializerMethodField):
+                raise TypeError(f'{serializer_class.__name__}.{name} cannot be read from .values() rows')
+            # ModelField (the ObjectId primary key) renders value_to_string(), i.e. str().
+            convert = str if isinstance(field, serializers.ModelField) else field.to_representation
+            self.converters.append((name, field.source, convert))
+        self.fields = [source for _, source, _ in self.converters]
+
+    def __call__(self, rows):
+        converters = self.converters
+        return [
+            {name: None if row[source] is None else convert(row[source]) for name, source, convert in converters}
+            for row in rows
+        ]
+
+
+user_rows = RowMapper(UserSerializer)
+activity_rows = RowMapper(ActivitySerializer)
+leaderboard_rows = RowMapper(LeaderboardSerializer)
+team_leaderboard_rows = RowMapper(TeamLeaderboardSerializer)
+workout_rows = RowMapper(WorkoutSerializer)
+
+
+def member_counts(team_names):
+    """Count members of several teams with one grouped query."""
+    rows = (
+        User.objects.filter(team__in=team_names)
+        .values('team')
+        .annotate(member_count=Count('team'))
+        .order_by()
+    )
+    return {row['team']: row['member_count'] for row in rows}
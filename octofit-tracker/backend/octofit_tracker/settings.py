@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -83,19 +84,133 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# MongoDB connection pool. djongo shares one MongoClient per database between
+# threads and closes it whenever a Django connection closes, so connections
+# are persistent by default (MONGO_CONN_MAX_AGE, in seconds; empty means
+# forever) to keep the pool warm. Pool sizes are per worker process.
+# MONGO_READ_PREFERENCE (e.g. secondaryPreferred) applies to the read-only
+# paths that tolerate replication lag: repository/async reads, stats and
+# exports. ORM reads and all writes stay on the primary.
+MONGO_CONN_MAX_AGE = os.getenv('MONGO_CONN_MAX_AGE', '')
+MONGO_READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
+        'CONN_MAX_AGE': int(MONGO_CONN_MAX_AGE) if MONGO_CONN_MAX_AGE else None,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.getenv('MONGO_HOST', 'localhost'),
+            'port': int(os.getenv('MONGO_PORT', '27017')),
+            'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+            'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+            'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000')),
+            'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+            'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+            'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000')),
         }
     }
 }
 
 
+# Cache for read-heavy API responses (see octofit_tracker/caching.py).
+# Invalidation replaces a version token in the cache itself, so every process
+# must share it: set API_CACHE_URL=redis://host:6379/0 in production (requires
+# the redis package). Without it responses are not cached, unless
+# API_CACHE_LOCAL=1 opts a single-process setup (runserver, tests) into a
+# local memory cache. Both backends expire entries after API_CACHE_TTL
+# seconds and evict least recently used entries when full.
+API_CACHE_URL = os.getenv('API_CACHE_URL')
+API_CACHE_LOCAL = os.getenv('API_CACHE_LOCAL') == '1'
+
+if API_CACHE_URL:
+    API_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': API_CACHE_URL,
+    }
+elif API_CACHE_LOCAL:
+    API_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-api',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('API_CACHE_MAX_ENTRIES', '1000'))},
+    }
+else:
+    API_CACHE = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {**API_CACHE, 'TIMEOUT': int(os.getenv('API_CACHE_TTL', '60'))},
+}
+
+# Threads the async read path (octofit_tracker/aio.py) runs pymongo calls on:
+# the most Mongo operations one ASGI worker keeps in flight at a time.
+ASYNC_MONGO_THREADS = int(os.getenv('ASYNC_MONGO_THREADS', '32'))
+
+# How user and team changes reach their denormalized copies (see
+# octofit_tracker/denormalize.py): 'sync' rewrites them during the save,
+# 'queue' enqueues them as background jobs that workers apply one at a time,
+# in the order the changes were saved.
+DENORMALIZATION_MODE = os.getenv('DENORMALIZATION_MODE', 'sync')
+
+# Background jobs (see octofit_tracker/jobs.py). With JOBS_WORKER=thread each
+# web process runs a worker thread once it queues a job; with 'external' jobs
+# wait for `manage.py run_jobs`. A running job whose heartbeat is older than
+# JOBS_STALE_SECONDS is resumed by another worker.
+JOBS_WORKER = os.getenv('JOBS_WORKER', 'thread')
+JOBS_POLL_SECONDS = float(os.getenv('JOBS_POLL_SECONDS', '1'))
+JOBS_STALE_SECONDS = int(os.getenv('JOBS_STALE_SECONDS', '600'))
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', '3'))
+
+# Compiled SELECT shapes kept by the djongo translation cache (see
+# octofit_tracker/querycache.py); 0 turns the cache off.
+DJONGO_TRANSLATION_CACHE_SIZE = int(os.getenv('DJONGO_TRANSLATION_CACHE_SIZE', '512'))
+
+# Search (see octofit_tracker/search.py): a query scores at most
+# SEARCH_MAX_CANDIDATES index entries, and the admin changelist search
+# shows at most SEARCH_ADMIN_MAX_RESULTS matches.
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', '2000'))
+SEARCH_ADMIN_MAX_RESULTS = int(os.getenv('SEARCH_ADMIN_MAX_RESULTS', '1000'))
+
+# Admin changelists of the large collections (see octofit_tracker/changelist.py):
+# estimated counts (filtered counts stop at ADMIN_COUNT_LIMIT), filter values
+# cached for ADMIN_FACET_CACHE_SECONDS and cursor paging. ADMIN_LARGE_CHANGELISTS=0
+# restores Django's exact counts and numbered pages.
+ADMIN_LARGE_CHANGELISTS = os.getenv('ADMIN_LARGE_CHANGELISTS', '1') == '1'
+ADMIN_COUNT_LIMIT = int(os.getenv('ADMIN_COUNT_LIMIT', '10000'))
+ADMIN_FACET_CACHE_SECONDS = int(os.getenv('ADMIN_FACET_CACHE_SECONDS', '300'))
+
+# Delta sync (see octofit_tracker/sync.py). Deletions are remembered for
+# SYNC_TOMBSTONE_RETENTION_DAYS; an older ?updated_since=, or one with more
+# than SYNC_MAX_CHANGES changes, gets 410 Gone and the client downloads the
+# list again. Watermarks lag the clock by SYNC_OVERLAP_SECONDS so that writes
+# still committing when a response is built are picked up by the next delta.
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv('SYNC_TOMBSTONE_RETENTION_DAYS', '30'))
+SYNC_MAX_CHANGES = int(os.getenv('SYNC_MAX_CHANGES', '1000'))
+SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', '5'))
+
+# Per-request timing (see octofit_tracker/instrumentation.py). Every response
+# carries a Server-Timing header; REQUEST_TIMING_LOG=1 also logs one JSON line
+# per request and REQUEST_METRICS_ENDPOINT=1 serves per-view totals at /metrics.
+REQUEST_TIMING_LOG = os.getenv('REQUEST_TIMING_LOG') == '1'
+REQUEST_METRICS_ENDPOINT = os.getenv('REQUEST_METRICS_ENDPOINT') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'octofit_tracker.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO' if REQUEST_TIMING_LOG else 'WARNING',
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -0,0 +1,118 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from octofit_tracker.models import User, Team, Activity, Workout
+from octofit_tracker import caching, denormalize, leaderboard, rollups, search, sync
+
+
+ROLLUP_FIELDS = ('user_email', 'activity_type', 'duration', 'calories', 'date')
+
+
+@receiver(pre_save, sender=Activity)
+def remember_previous_activity(sender, instance, **kwargs):
+    """Keep the stored fields so post_save can compute leaderboard and rollup deltas."""
+    instance._leaderboard_previous = None
+    if instance.pk is not None:
+        instance._leaderboard_previous = (
+            Activity.objects.filter(pk=instance.pk).values(*ROLLUP_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=Activity)
+def update_leaderboard_on_save(sender, instance, created, **kwargs):
+    """Apply an activity create or update to the leaderboard."""
+    previous = getattr(instance, '_leaderboard_previous', None)
+    if created or previous is None:
+        leaderboard.apply_activity_delta(instance.user_email, instance.calories, 1, instance.date)
+    elif previous['user_email'] != instance.user_email or previous['date'] != instance.date:
+        leaderboard.apply_activity_delta(previous['user_email'], -previous['calories'], -1, previous['date'])
+        leaderboard.apply_activity_delta(instance.user_email, instance.calories, 1, instance.date)
+    elif previous['calories'] != instance.calories:
+        leaderboard.apply_activity_delta(
+            instance.user_email, instance.calories - previous['calories'], 0, instance.date
+        )
+
+
+@receiver(post_delete, sender=Activity)
+def update_leaderboard_on_delete(sender, instance, **kwargs):
+    """Remove a deleted activity from the leaderboard."""
+    leaderboard.apply_activity_delta(instance.user_email, -instance.calories, -1, instance.date)
+
+
+@receiver(post_save, sender=Activity)
+def update_rollups_on_save(sender, instance, created, **kwargs):
+    """Move a created or changed activity into its rollup buckets."""
+    previous = getattr(instance, '_leaderboard_previous', None)
+    current = {field: getattr(instance, field) for field in ROLLUP_FIELDS}
+    if previous is not None and not created:
+        if previous == current:
+            return
+        rollups.apply([previous], sign=-1)
+    rollups.apply([current])
+
+
+@receiver(post_delete, sender=Activity)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    """Remove a deleted activity from its rollup buckets."""
+    rollups.apply([{field: getattr(instance, field) for field in ROLLUP_FIELDS}], sign=-1)
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_user(sender, instance, **kwargs):
+    """Keep the stored email, name and team so post_save can propagate changes."""
+    instance._denormalize_previous = None
+    if instance.pk is not None:
+        instance._denormalize_previous = User.objects.filter(pk=instance.pk).values('email', 'name', 'team').first()
+
+
+@receiver(post_save, sender=User)
+def propagate_user_changes(sender, instance, created, **kwargs):
+    """Rewrite the copies of a user's changed email, name or team."""
+    previous = getattr(instance, '_denormalize_previous', None)
+    current = {'email': instance.email, 'name': instance.name, 'team': instance.team}
+    if not created and previous is not None and previous != current:
+        denormalize.dispatch('user', previous, current)
+
+
+@receiver(pre_save, sender=Team)
+def remember_previous_team(sender, instance, **kwargs):
+    """Keep the stored name so post_save can propagate a rename."""
+    instance._denormalize_previous = None
+    if instance.pk is not None:
+        instance._denormalize_previous = Team.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Team)
+def propagate_team_rename(sender, instance, created, **kwargs):
+    """Rewrite every copy of a renamed team's name."""
+    previous = getattr(instance, '_denormalize_previous', None)
+    if not created and previous is not None and previous != instance.name:
+        denormalize.dispatch('team', previous, instance.name)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Workout)
+def update_search_index(sender, instance, **kwargs):
+    """Index a saved user or workout for search."""
+    search.index_instance(instance)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Workout)
+def remove_from_search_index(sender, instance, **kwargs):
+    """Drop a deleted user or workout from search."""
+    search.remove(search.KINDS[sender], instance.pk)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Workout)
+@receiver(post_delete, sender=Activity)
+def record_tombstone(sender, instance, **kwargs):
+    """Tombstone a deleted user, workout or activity for delta sync."""
+    sync.record_deletion(instance)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_cached_responses(sender, **kwargs):
+    """Expire cached API responses that depend on the written model."""
+    caching.invalidate_for(sender)
@@ -0,0 +1,115 @@
+"""
+Activity statistics computed with MongoDB aggregation pipelines.
+
+A single ``$group`` on (period, activity_type) runs next to the data; the
+handful of resulting groups is folded into totals and per-type figures in
+Python, so no ``Activity`` instances are ever materialized.
+"""
+from datetime import datetime, time, timezone
+
+from django.utils.dateparse import parse_date, parse_datetime
+
+from octofit_tracker.models import User, Activity
+from octofit_tracker.mongo import get_read_collection
+
+BUCKET_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+}
+
+
+def parse_bound(value, end_of_day=False):
+    """
+    Parse a ``since``/``until`` query value into a naive UTC datetime.
+
+    Accepts ISO dates or datetimes; raises ``ValueError`` on anything else.
+    """
+    day = parse_date(value)
+    if day is not None:
+        return datetime.combine(day, time.max if end_of_day else time.min)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def activity_match(user_emails=None, since=None, until=None):
+    """Build the ``$match`` filter shared by the stats and export queries."""
+    match = {}
+    if user_emails is not None:
+        match['user_email'] = {'$in': list(user_emails)}
+    if since is not None or until is not None:
+        match['date'] = {}
+        if since is not None:
+            match['date']['$gte'] = since
+        if until is not None:
+            match['date']['$lte'] = until
+    return match
+
+
+def _figures(count, calories, duration):
+    return {
+        'count': count,
+        'total_calories': calories,
+        'total_duration': duration,
+        'average_calories': round(calories / count, 2) if count else 0,
+        'average_duration': round(duration / count, 2) if count else 0,
+    }
+
+
+def activity_stats(match, bucket='day'):
+    """Return totals, per-type figures and per-period buckets for ``match``."""
+    groups = get_read_collection(Activity).aggregate([
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'period': {'$dateToString': {'format': BUCKET_FORMATS[bucket], 'date': '$date'}},
+                'activity_type': '$activity_type',
+            },
+            'count': {'$sum': 1},
+            'calories': {'$sum': '$calories'},
+            'duration': {'$sum': '$duration'},
+        }},
+        {'$sort': {'_id.period': 1, '_id.activity_type': 1}},
+    ])
+    return summarize(
+        ((group['_id']['period'], group['_id']['activity_type'], group['count'], group['calories'], group['duration'])
+         for group in groups),
+        bucket,
+    )
+
+
+def summarize(groups, bucket):
+    """
+    Fold ``(period, activity_type, count, calories, duration)`` groups,
+    ordered by period and type, into the stats response.
+    """
+    totals = [0, 0, 0]
+    by_type = {}
+    buckets = []
+    for period, activity_type, *figures in groups:
+        totals = [a + b for a, b in zip(totals, figures)]
+        type_totals = by_type.get(activity_type, [0, 0, 0])
+        by_type[activity_type] = [a + b for a, b in zip(type_totals, figures)]
+        buckets.append(dict(
+            period=period,
+            activity_type=activity_type,
+            **_figures(*figures)
+        ))
+
+    return dict(
+        _figures(*totals),
+        bucket=bucket,
+        by_type=[
+            dict(activity_type=activity_type, **_figures(*figures))
+            for activity_type, figures in sorted(by_type.items())
+        ],
+        buckets=buckets,
+    )
+
+
+def team_member_emails(team_name):
+    """Emails of every user on a team, read from the ``user_team`` index."""
+    return get_read_collection(User).distinct('email', {'team': team_name})
@@ -0,0 +1,120 @@
+"""
+Delta sync for mobile clients.
+
+Users, workouts and activities carry ``updated_at``, which every write
+path sets, and deletions leave a ``Tombstone``. A client keeps the
+watermark of its last sync and asks a list action for
+``?updated_since=<watermark>``; it receives the rows changed at or after
+the watermark, the ids deleted since and a new watermark. Deltas read
+from the primary, so a lagging secondary cannot hide a change.
+
+``updated_at`` is stamped before a write commits, so a watermark is set
+``SYNC_OVERLAP_SECONDS`` in the past: a write committed after the response
+was built but stamped just before it is sent again by the next delta.
+Rows in the overlap come back twice, so clients apply changes
+idempotently.
+
+``version`` summarises a list by its newest change and newest deletion,
+which two indexed lookups answer; list actions derive their ETag from it
+and answer a matching ``If-None-Match`` without running the list query.
+
+Tombstones expire after ``SYNC_TOMBSTONE_RETENTION_DAYS`` (TTL index).
+``Gone`` is raised for a watermark older than that, or when more than
+``SYNC_MAX_CHANGES`` rows changed: the client downloads the list again.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from bson.codec_options import CodecOptions
+from django.conf import settings
+from django.utils import timezone
+from pymongo import InsertOne
+
+from octofit_tracker import stats
+from octofit_tracker.models import User, Activity, Workout, Tombstone
+from octofit_tracker.mongo import get_collection
+from octofit_tracker.repositories import MongoRepository
+
+KINDS = {User: 'user', Workout: 'workout', Activity: 'activity'}
+
+# Model -> the field whose value scopes its tombstones (activities sync per user).
+OWNERS = {Activity: 'user_email'}
+
+
+class Gone(Exception):
+    """The delta cannot be computed; the client must download the list again."""
+
+
+def watermark():
+    """
+    The watermark for a response built now: the current time less
+    ``SYNC_OVERLAP_SECONDS``, truncated to the millisecond precision
+    MongoDB stores.
+    """
+    mark = timezone.now() - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS)
+    return mark.replace(microsecond=mark.microsecond // 1000 * 1000)
+
+
+def format_watermark(value):
+    return value.astimezone(dt_timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def parse_watermark(value):
+    """
+    Parse an ``updated_since`` value into an aware UTC datetime. Raises
+    ValueError when it is malformed and Gone when tombstones have expired.
+    """
+    since = timezone.make_aware(stats.parse_bound(value), dt_timezone.utc)
+    if since < timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS):
+        raise Gone(f'updated_since is older than {settings.SYNC_TOMBSTONE_RETENTION_DAYS} days')
+    return since
+
+
+def record_deletion(instance):
+    owner = OWNERS.get(type(instance))
+    get_collection(Tombstone).insert_one({
+        'kind': KINDS[type(instance)],
+        'object_id': str(instance.pk),
+        'owner': getattr(instance, owner) if owner else '',
+        'deleted_at': timezone.now(),
+    })
+
+
+def record_moves(kind, object_ids, owner):
+    """Tombstone objects that left ``owner``'s scope, e.g. activities of a changed email."""
+    deleted_at = timezone.now()
+    writes = [
+        InsertOne({'kind': kind, 'object_id': str(object_id), 'owner': owner, 'deleted_at': deleted_at})
+        for object_id in object_ids
+    ]
+    if writes:
+        get_collection(Tombstone).bulk_write(writes, ordered=False)
+
+
+def deleted_since(kind, since, owner=''):
+    """Ids of ``kind`` objects deleted (from ``owner``'s scope) at or after ``since``."""
+    tombstones = get_collection(Tombstone).find(
+        {'kind': kind, 'owner': owner, 'deleted_at': {'$gte': since}}, {'object_id': 1},
+        limit=settings.SYNC_MAX_CHANGES + 1,
+    )
+    ids = list(dict.fromkeys(tombstone['object_id'] for tombstone in tombstones))
+    if len(ids) > settings.SYNC_MAX_CHANGES:
+        raise Gone(f'More than {settings.SYNC_MAX_CHANGES} deletions since updated_since')
+    return ids
+
+
+def version(model, owner=None, **lookups):
+    """
+    Summarise the ``model`` rows matching ``lookups`` by their newest
+    ``updated_at`` and the newest tombstone of ``owner`` (of any owner when
+    None), read from the primary. Returns None while the newest of the two
+    is within ``SYNC_OVERLAP_SECONDS``: an earlier-stamped write may still
+    be committing, so the summary could miss it.
+    """
+    rows = MongoRepository(model, primary=True).filter(**lookups).order_by('-updated_at').values('updated_at')[:1]
+    match = {'kind': KINDS[model]} if owner is None else {'kind': KINDS[model], 'owner': owner}
+    tombstones = get_collection(Tombstone).with_options(codec_options=CodecOptions(tz_aware=True))
+    deletions = list(tombstones.find(match, {'deleted_at': 1}).sort('deleted_at', -1).limit(1))
+    newest = [row['updated_at'] for row in rows if row['updated_at']] + [row['deleted_at'] for row in deletions]
+    if newest and max(newest) > watermark():
+        return None
+    return [format_watermark(value) for value in newest]
@@ -0,0 +1,92 @@
+"""
+Job handlers for leaderboard rebuilds, denormalization repairs, index
+builds, search reindexing and rollup backfills (see ``jobs.py``). Each
+chunked handler yields a checkpoint the job resumes from after a crash.
+"""
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from octofit_tracker import caching, denormalize, indexes, jobs, leaderboard, rollups, search
+from octofit_tracker.models import User, ActivityRollup, Leaderboard, SearchEntry
+from octofit_tracker.mongo import get_collection
+
+
+@jobs.handler('rebuild_leaderboard')
+def rebuild_leaderboard(params, state):
+    """Rebuild the user, team and period leaderboards, one stage per chunk."""
+    stages = leaderboard.REBUILD_STAGES
+    for stage in range(state.get('stage', 0), len(stages)):
+        stages[stage]()
+        yield {'stage': stage + 1}, stage + 1, len(stages)
+    caching.invalidate_for(Leaderboard)
+    return {'users': get_collection(Leaderboard).count_documents({})}
+
+
+@jobs.handler('repair_denormalized')
+def repair_denormalized(params, state):
+    """Check (and unless ``repair`` is false, repair) denormalized fields a batch of users at a time."""
+    batch_size = params.get('batch_size', 500)
+    repair = params.get('repair', True)
+    report = state.get('report') or denormalize.new_report()
+    total = get_collection(User).estimated_document_count()
+    for batch in denormalize.user_batches(batch_size, after=state.get('after')):
+        denormalize.check_users(batch, report, repair)
+        yield {'after': batch[-1]['_id'], 'report': report}, report['users_checked'], total
+    denormalize.check_teams(report, batch_size, repair)
+    return report
+
+
+@jobs.handler('sync_indexes')
+def sync_indexes(params, state):
+    """Create the declared indexes, one collection per chunk."""
+    models = indexes.managed_models()
+    changes = state.get('changes', [])
+    for position in range(state.get('models', 0), len(models)):
+        model = models[position]
+        for action, name, keys in indexes.sync_indexes(model, drop=params.get('drop', False)):
+            if action != 'exists':
+                changes.append(f'{action} {model._meta.db_table}.{name}')
+        yield {'models': position + 1, 'changes': changes}, position + 1, len(models)
+    return {'changes': changes}
+
+
+@jobs.handler('rebuild_search')
+def rebuild_search(params, state):
+    """Reindex users, workouts and activities for search, one batch per chunk."""
+    batch_size = params.get('batch_size', 1000)
+    started = state.get('started') or timezone.now().isoformat()
+    kinds = list(search.SOURCES)
+    for position in range(state.get('kinds', 0), len(kinds)):
+        after = state.get('after') if position == state.get('kinds', 0) else None
+        for last in search.reindex(kinds[position], batch_size=batch_size, after=after):
+            yield {'started': started, 'kinds': position, 'after': last}, position, len(kinds)
+        yield {'started': started, 'kinds': position + 1}, position + 1, len(kinds)
+    removed = search.remove_stale(datetime.fromisoformat(started))
+    return {'entries': get_collection(SearchEntry).count_documents({}), 'removed': removed}
+
+
+@jobs.handler('rebuild_rollups')
+def rebuild_rollups(params, state):
+    """Recompute the activity rollups, one week of activities per chunk."""
+    first = state.get('first') or rollups.first_week()
+    week = state.get('week', first)
+    while week is not None and week <= rollups.last_week():
+        # Rebuilding a week replaces its buckets, so resuming at a week that
+        # was already rebuilt before a crash counts nothing twice.
+        rollups.rebuild_week(week)
+        week += timedelta(weeks=1)
+        total = (rollups.last_week() - first).days // 7 + 1
+        yield {'first': first, 'week': week}, (week - first).days // 7, total
+    rollups.remove_outside(first, week)
+    return {'rollups': get_collection(ActivityRollup).count_documents({})}
+
+
+@jobs.handler('propagate_user')
+def propagate_user(params, state):
+    denormalize.propagate_user(*params['args'])
+
+
+@jobs.handler('propagate_team')
+def propagate_team(params, state):
+    denormalize.propagate_team(*params['args'])
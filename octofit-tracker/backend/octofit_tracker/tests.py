@@ -2,8 +2,36 @@ from django.test import TestCase
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, override_settings
+from octofit_tracker.models import (
+    User, Team, Activity, ActivityRollup, Leaderboard, PeriodLeaderboard, TeamLeaderboard, Workout, Job, SearchEntry,
+    Tombstone,
+)
+from octofit_tracker.mongo import get_collection, get_database, get_read_collection
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer, activity_rows, leaderboard_rows
+from octofit_tracker import changelist as changelist_module
+from octofit_tracker import benchmarks, caching, denormalize, export, health, instrumentation, jobs, leaderboard, querycache, rollups, search, sync, tasks
+from octofit_tracker.urls import router
+from octofit_tracker.repositories import OrmRepository, MongoRepository
+from octofit_tracker.views import ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+from octofit_tracker.admin import ActivityAdmin, UserAdmin
+from django.contrib.auth import get_user_model
+from django.contrib import admin as django_admin
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from pymongo import monitoring
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from datetime import datetime, timedelta
+from django.utils import timezone
+from io import StringIO
+import json
+import time
+import tracemalloc
 
 
 class UserModelTestCase(TestCase):
@@ -122,6 +150,14 @@ class TeamAPITestCase(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Team.objects.count(), 2)
+    
+    def test_team_detail_lookup(self):
+        """Test that detail routes resolve the ObjectId primary key"""
+        response = self.client.get(reverse('team-detail', args=[str(self.team.pk)]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'API Test Team')
+        response = self.client.get(reverse('team-detail', args=['not-an-id']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class ActivityAPITestCase(APITestCase):
@@ -146,7 +182,7 @@ class ActivityAPITestCase(APITestCase):
         url = reverse('activity-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
     
     def test_create_activity(self):
         """Test creating a new activity via API"""
@@ -217,5 +253,1762 @@ class LeaderboardAPITestCase(APITestCase):
         url = reverse('leaderboard-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['rank'], 1)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['rank'], 1)
+
+
+class LeaderboardEngineTestCase(APITestCase):
+    """Test cases for incremental leaderboard maintenance"""
+    
+    def setUp(self):
+        User.objects.create(name='Fast Hero', email='fast@hero.com', team='Team Speed')
+        User.objects.create(name='Slow Hero', email='slow@hero.com', team='Team Speed')
+        Activity.objects.create(
+            user_email='fast@hero.com',
+            activity_type='Running',
+            duration=60,
+            calories=600,
+            date=datetime.now()
+        )
+        self.slow_activity = Activity.objects.create(
+            user_email='slow@hero.com',
+            activity_type='Yoga',
+            duration=30,
+            calories=200,
+            date=datetime.now()
+        )
+    
+    def ranking(self):
+        return list(Leaderboard.objects.order_by('rank').values_list('user_email', 'rank', 'total_calories'))
+    
+    def test_activity_create_adds_entries(self):
+        """Test that new activities create ranked leaderboard entries"""
+        self.assertEqual(self.ranking(), [
+            ('fast@hero.com', 1, 600),
+            ('slow@hero.com', 2, 200),
+        ])
+        entry = Leaderboard.objects.get(user_email='slow@hero.com')
+        self.assertEqual(entry.user_name, 'Slow Hero')
+        self.assertEqual(entry.team, 'Team Speed')
+    
+    def test_activity_post_reranks(self):
+        """Test that an activity posted via API moves the user up"""
+        url = reverse('activity-list')
+        data = {
+            'user_email': 'slow@hero.com',
+            'activity_type': 'Swimming',
+            'duration': 60,
+            'calories': 500,
+            'date': datetime.now().isoformat()
+        }
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.ranking(), [
+            ('slow@hero.com', 1, 700),
+            ('fast@hero.com', 2, 600),
+        ])
+    
+    def test_activity_update_and_delete(self):
+        """Test that updates and deletes adjust totals and ranks"""
+        self.slow_activity.calories = 900
+        self.slow_activity.save()
+        self.assertEqual(self.ranking()[0], ('slow@hero.com', 1, 900))
+        
+        self.slow_activity.delete()
+        self.assertEqual(self.ranking(), [('fast@hero.com', 1, 600)])
+    
+    def test_held_lock_leaves_reranking_to_holder(self):
+        """Test that a writer finding the ranking locked queues its entry instead of waiting"""
+        locks = get_database()[leaderboard.LOCK_COLLECTION]
+        holder = ObjectId()
+        locks.update_one({'_id': 'leaderboard'},
+                         {'$set': {'holder': holder, 'expires_at': timezone.now() + timedelta(minutes=1)}})
+        with mock.patch('octofit_tracker.leaderboard.time.sleep', side_effect=AssertionError('writer waited')):
+            leaderboard.apply_activity_delta('slow@hero.com', 500, 1)
+        self.assertEqual(self.ranking()[1], ('slow@hero.com', 2, 200))
+        
+        leaderboard._drain(Leaderboard, holder)
+        self.assertEqual(self.ranking(), [
+            ('slow@hero.com', 1, 700),
+            ('fast@hero.com', 2, 600),
+        ])
+        self.assertEqual(locks.find_one({'_id': 'leaderboard'})['holder'], None)
+        self.assertNotIn('pending_total_calories', get_collection(Leaderboard).find_one({'user_email': 'slow@hero.com'}))
+    
+    def test_expired_lock_taken_over(self):
+        """Test that a lock left by a crashed writer is taken over once expired"""
+        locks = get_database()[leaderboard.LOCK_COLLECTION]
+        locks.update_one({'_id': 'leaderboard'},
+                         {'$set': {'holder': ObjectId(), 'expires_at': timezone.now() - timedelta(seconds=1)}})
+        leaderboard.apply_activity_delta('slow@hero.com', 500, 1)
+        self.assertEqual(self.ranking()[0], ('slow@hero.com', 1, 700))
+        self.assertEqual(locks.find_one({'_id': 'leaderboard'})['holder'], None)
+    
+    def test_ties_match_rebuild(self):
+        """Test that tied totals are ranked by email both incrementally and by a rebuild"""
+        Activity.objects.create(user_email='another@hero.com', activity_type='Yoga', duration=30, calories=200,
+                                date=datetime.now())
+        incremental = self.ranking()
+        self.assertEqual(incremental, [
+            ('fast@hero.com', 1, 600),
+            ('another@hero.com', 2, 200),
+            ('slow@hero.com', 3, 200),
+        ])
+        leaderboard.rebuild()
+        self.assertEqual(self.ranking(), incremental)
+    
+    def test_rebuild_replays_concurrent_writes(self):
+        """Test that activities written while a rebuild swaps collections still count"""
+        replace_collection = leaderboard.indexes.replace_collection
+        
+        def concurrent_write(model, documents):
+            if model is Leaderboard:
+                Activity.objects.create(user_email='slow@hero.com', activity_type='Swimming', duration=30,
+                                        calories=500, date=datetime.now())
+            replace_collection(model, documents)
+        
+        with mock.patch('octofit_tracker.indexes.replace_collection', side_effect=concurrent_write):
+            leaderboard.rebuild()
+        self.assertEqual(self.ranking(), [
+            ('slow@hero.com', 1, 700),
+            ('fast@hero.com', 2, 600),
+        ])
+        self.assertEqual(TeamLeaderboard.objects.get(team='Team Speed').total_calories, 1300)
+    
+    def test_rebuild_swaps_collections(self):
+        """Test that a rebuild replaces entries whole and keeps the declared indexes"""
+        Leaderboard.objects.filter(user_email='slow@hero.com').update(total_calories=1, rank=9)
+        live = get_collection(Leaderboard)
+        with mock.patch.object(type(live), 'delete_many', side_effect=AssertionError('live collection emptied')):
+            self.assertEqual(leaderboard.rebuild(), 2)
+        self.assertEqual(self.ranking(), [
+            ('fast@hero.com', 1, 600),
+            ('slow@hero.com', 2, 200),
+        ])
+        self.assertTrue(get_collection(Leaderboard).index_information()['leaderboard_user_email_uniq']['unique'])
+        self.assertIn('team_leaderboard_rank', get_collection(TeamLeaderboard).index_information())
+        collections = get_collection(Leaderboard).database.list_collection_names()
+        self.assertFalse([name for name in collections if '__rebuild_' in name])
+
+
+class KeysetPaginationTestCase(APITestCase):
+    """Test cases for cursor pagination of activities and leaderboard"""
+    
+    def setUp(self):
+        for day in range(5):
+            Activity.objects.create(
+                user_email=f'hero{day}@hero.com',
+                activity_type='Running',
+                duration=30,
+                calories=100 * (day + 1),
+                date=datetime(2024, 1, day + 1)
+            )
+    
+    def walk(self, url):
+        """Follow next links and return every result in order"""
+        results = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            results.extend(response.data['results'])
+            url = response.data['next']
+        return results
+    
+    def test_activities_pages_by_date(self):
+        """Test that activity pages cover every row newest first"""
+        results = self.walk(reverse('activity-list') + '?page_size=2')
+        self.assertEqual(
+            [item['user_email'] for item in results],
+            [f'hero{day}@hero.com' for day in reversed(range(5))]
+        )
+    
+    def test_previous_link_returns_prior_page(self):
+        """Test that the previous cursor returns the page before"""
+        first = self.client.get(reverse('activity-list') + '?page_size=2')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+    
+    def test_leaderboard_pages_by_rank(self):
+        """Test that leaderboard pages follow rank order"""
+        results = self.walk(reverse('leaderboard-list') + '?page_size=2')
+        self.assertEqual([item['rank'] for item in results], [1, 2, 3, 4, 5])
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get(reverse('activity-list') + '?cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TeamMemberCountTestCase(APITestCase):
+    """Test cases for team member counts in the team list"""
+    
+    def create_teams(self, count, start=0):
+        for index in range(start, start + count):
+            name = f'Team {index}'
+            Team.objects.create(name=name, description='A counted team')
+            for member in range(index + 1):
+                User.objects.create(name=f'Hero {index}-{member}', email=f'hero{index}.{member}@hero.com', team=name)
+    
+    def test_member_counts(self):
+        """Test that each team reports its own member count"""
+        self.create_teams(3)
+        response = self.client.get(reverse('team-list'))
+        counts = {team['name']: team['member_count'] for team in response.data}
+        self.assertEqual(counts, {'Team 0': 1, 'Team 1': 2, 'Team 2': 3})
+    
+    def test_constant_query_count(self):
+        """Test that listing teams does not issue a query per team"""
+        self.create_teams(2)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('team-list'))
+        self.create_teams(6, start=2)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('team-list'))
+
+
+class SyncIndexesTestCase(TestCase):
+    """Test cases for the sync_indexes management command"""
+    
+    def index_names(self, model):
+        return set(get_collection(model).index_information())
+    
+    def test_creates_declared_indexes(self):
+        """Test that declared indexes are created and reported"""
+        out = StringIO()
+        call_command('sync_indexes', stdout=out)
+        self.assertTrue({'activity_user_date', 'activity_date'} <= self.index_names(Activity))
+        self.assertIn('leaderboard_team_rank', self.index_names(Leaderboard))
+        self.assertIn('ActivityViewSet.by_user', out.getvalue())
+    
+    def test_sync_is_idempotent(self):
+        """Test that a second run changes nothing"""
+        call_command('sync_indexes', stdout=StringIO())
+        before = self.index_names(Workout)
+        out = StringIO()
+        call_command('sync_indexes', stdout=out)
+        self.assertEqual(self.index_names(Workout), before)
+        self.assertIn('Changed 0 indexes', out.getvalue())
+    
+    def test_drop_removes_undeclared_indexes(self):
+        """Test that --drop removes indexes no model declares"""
+        get_collection(Workout).create_index('duration', name='stale_duration')
+        call_command('sync_indexes', '--drop', stdout=StringIO())
+        self.assertNotIn('stale_duration', self.index_names(Workout))
+        self.assertIn('workout_category', self.index_names(Workout))
+    
+    def test_constraints_and_ttl_indexes(self):
+        """Test that unique constraints and TTL indexes get their options"""
+        call_command('sync_indexes', stdout=StringIO())
+        indexes = get_collection(PeriodLeaderboard).index_information()
+        self.assertTrue(indexes['period_leaderboard_user']['unique'])
+        self.assertEqual(indexes['period_leaderboard_expiry']['expireAfterSeconds'], 0)
+
+
+class PopulateDbTestCase(TestCase):
+    """Test cases for the populate_db management command"""
+    
+    def populate(self, *args):
+        call_command('populate_db', *args, stdout=StringIO())
+    
+    def test_default_seed(self):
+        """Test that the default run seeds the heroes"""
+        self.populate()
+        self.assertEqual(User.objects.count(), 12)
+        self.assertEqual(Team.objects.count(), 2)
+        self.assertEqual(Leaderboard.objects.count(), 12)
+    
+    def test_scaled_batched_run(self):
+        """Test that --users and --activities-per-user control the volume"""
+        self.populate('--users', '30', '--activities-per-user', '4', '--batch-size', '7', '--seed', '1')
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Activity.objects.count(), 120)
+        self.assertEqual(Leaderboard.objects.count(), 30)
+        self.assertEqual(Leaderboard.objects.get(rank=1).total_activities, 4)
+    
+    def test_seed_is_deterministic(self):
+        """Test that the same seed produces the same ranking"""
+        self.populate('--users', '15', '--seed', '42')
+        first = list(Leaderboard.objects.order_by('rank').values_list('user_email', 'total_calories'))
+        self.populate('--users', '15', '--seed', '42')
+        second = list(Leaderboard.objects.order_by('rank').values_list('user_email', 'total_calories'))
+        self.assertEqual(first, second)
+    
+    def test_invalid_options(self):
+        """Test that out-of-range numeric options are refused before any data is cleared"""
+        self.populate('--users', '3')
+        for args in (('--days', '0'), ('--days', '-5'), ('--teams', '0'), ('--batch-size', '0'),
+                     ('--users', '-1'), ('--activities-per-user', '-1')):
+            with self.assertRaisesMessage(CommandError, f'{args[0]} must be at least'):
+                self.populate(*args)
+        self.assertEqual(User.objects.count(), 3)
+
+
+class ActivityStatsAPITestCase(APITestCase):
+    """Test cases for the activity and team stats endpoints"""
+    
+    def setUp(self):
+        self.team = Team.objects.create(name='Team Stats', description='A team with stats')
+        User.objects.create(name='Stats Hero', email='stats@hero.com', team='Team Stats')
+        User.objects.create(name='Other Hero', email='other@hero.com', team='Team Other')
+        for day, activity_type, calories in [(1, 'Running', 300), (2, 'Running', 500), (9, 'Yoga', 100)]:
+            Activity.objects.create(
+                user_email='stats@hero.com',
+                activity_type=activity_type,
+                duration=30,
+                calories=calories,
+                date=datetime(2024, 1, day, 12)
+            )
+        Activity.objects.create(
+            user_email='other@hero.com',
+            activity_type='Boxing',
+            duration=60,
+            calories=1000,
+            date=datetime(2024, 1, 3, 12)
+        )
+    
+    def test_user_stats_by_week(self):
+        """Test totals, per-type figures and weekly buckets for one user"""
+        url = reverse('activity-stats')
+        response = self.client.get(url, {'email': 'stats@hero.com', 'bucket': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['total_calories'], 900)
+        self.assertEqual(response.data['average_calories'], 300)
+        running = response.data['by_type'][0]
+        self.assertEqual((running['activity_type'], running['count'], running['total_calories']), ('Running', 2, 800))
+        self.assertEqual(
+            [(b['period'], b['activity_type'], b['count']) for b in response.data['buckets']],
+            [('2024-W01', 'Running', 2), ('2024-W02', 'Yoga', 1)]
+        )
+    
+    def test_stats_date_range(self):
+        """Test that since/until restrict the aggregated activities"""
+        url = reverse('activity-stats')
+        response = self.client.get(url, {'since': '2024-01-02', 'until': '2024-01-03'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['total_calories'], 1500)
+    
+    def test_stats_invalid_params(self):
+        """Test that bad bucket or date values are rejected"""
+        url = reverse('activity-stats')
+        self.assertEqual(self.client.get(url, {'bucket': 'year'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'since': 'soon'}).status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_team_stats(self):
+        """Test that team stats only include the team's members"""
+        url = reverse('team-stats', args=[str(self.team.pk)])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['total_calories'], 900)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'octofit-api-tests'},
+})
+class ResponseCacheTestCase(APITestCase):
+    """Test cases for cached list endpoints"""
+    
+    def setUp(self):
+        caches['api'].clear()
+        Workout.objects.create(
+            name='Cached Workout',
+            description='A cached workout',
+            category='Cardio',
+            difficulty='Beginner',
+            estimated_calories=200,
+            duration=20
+        )
+    
+    def test_repeat_get_is_served_from_cache(self):
+        """Test that a repeated GET issues no queries"""
+        url = reverse('workout-by-difficulty')
+        first = self.client.get(url, {'difficulty': 'Beginner'})
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {'difficulty': 'Beginner'})
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+    
+    def test_write_invalidates(self):
+        """Test that a write through the API expires cached lists"""
+        url = reverse('workout-by-difficulty')
+        self.assertEqual(len(self.client.get(url, {'difficulty': 'Beginner'}).data), 1)
+        self.client.post(reverse('workout-list'), {
+            'name': 'Fresh Workout',
+            'description': 'A new workout',
+            'category': 'Core',
+            'difficulty': 'Beginner',
+            'estimated_calories': 100,
+            'duration': 10
+        }, format='json')
+        self.assertEqual(len(self.client.get(url, {'difficulty': 'Beginner'}).data), 2)
+    
+    def test_activity_write_invalidates_leaderboard(self):
+        """Test that leaderboard responses expire when activities change"""
+        url = reverse('leaderboard-list')
+        self.assertEqual(self.client.get(url).data['results'], [])
+        Activity.objects.create(
+            user_email='cache@hero.com',
+            activity_type='Running',
+            duration=30,
+            calories=300,
+            date=datetime.now()
+        )
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+    
+    def test_cache_keyed_by_origin(self):
+        """Test that cached pages keep the absolute links of the host and scheme they were requested on"""
+        for email in ('first@hero.com', 'second@hero.com'):
+            Activity.objects.create(user_email=email, activity_type='Running', duration=30, calories=300,
+                                    date=datetime.now())
+        url = reverse('leaderboard-list')
+        local = self.client.get(url, {'page_size': 1}, HTTP_HOST='localhost')
+        self.assertTrue(local.data['next'].startswith('http://localhost/'))
+        loopback = self.client.get(url, {'page_size': 1}, HTTP_HOST='127.0.0.1')
+        self.assertTrue(loopback.data['next'].startswith('http://127.0.0.1/'))
+        secure = self.client.get(url, {'page_size': 1}, HTTP_HOST='localhost', secure=True)
+        self.assertTrue(secure.data['next'].startswith('https://localhost/'))
+    
+    def test_conditional_get(self):
+        """Test that matching validators return 304 Not Modified"""
+        url = reverse('workout-by-difficulty')
+        response = self.client.get(url, {'difficulty': 'Beginner'})
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(url, {'difficulty': 'Beginner'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, {'difficulty': 'Beginner'}, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ActivityExportTestCase(APITestCase):
+    """Test cases for the streaming activity export"""
+    
+    def setUp(self):
+        for day in range(1, 4):
+            Activity.objects.create(
+                user_email='export@hero.com' if day < 3 else 'other@hero.com',
+                activity_type='Running',
+                duration=30,
+                calories=100 * day,
+                date=datetime(2024, 1, day, 12)
+            )
+    
+    def export(self, **params):
+        response = self.client.get(reverse('activity-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+    
+    def test_ndjson_export(self):
+        """Test that NDJSON rows match the activity serializer"""
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([row['calories'] for row in rows], [100, 200, 300])
+        listed = self.client.get(reverse('activity-list')).data['results']
+        self.assertEqual(rows[-1], json.loads(json.dumps(listed[0], cls=JSONEncoder)))
+    
+    def test_csv_export_with_filters(self):
+        """Test CSV output restricted by user_email and since"""
+        lines = self.export(**{'as': 'csv', 'user_email': 'export@hero.com', 'since': '2024-01-02'}).splitlines()
+        self.assertEqual(lines[0], '_id,user_email,activity_type,duration,calories,date,updated_at')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('export@hero.com,Running,30,200,2024-01-02T12:00:00Z', lines[1])
+    
+    def test_stream_memory_is_constant(self):
+        """Test that peak memory does not grow with the number of rows"""
+        def documents(count):
+            for index in range(count):
+                yield {
+                    '_id': ObjectId(),
+                    'user_email': f'hero{index}@hero.com',
+                    'activity_type': 'Running',
+                    'duration': 30,
+                    'calories': index,
+                    'date': datetime(2024, 1, 1),
+                }
+        
+        def peak(stream, count):
+            tracemalloc.start()
+            for _ in stream(documents(count)):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak
+        
+        for stream in (export.ndjson_stream, export.csv_stream):
+            small = peak(stream, 2000)
+            large = peak(stream, 40000)
+            self.assertLess(large, small * 1.5)
+
+
+class BulkActivityAPITestCase(APITestCase):
+    """Test cases for bulk activity ingestion"""
+    
+    def activity(self, calories, email='bulk@hero.com'):
+        return {
+            'user_email': email,
+            'activity_type': 'Cycling',
+            'duration': 30,
+            'calories': calories,
+            'date': '2024-01-01T12:00:00Z'
+        }
+    
+    def test_bulk_json_array(self):
+        """Test that a JSON array is inserted and ranked in one batch"""
+        items = [self.activity(100), self.activity(200), self.activity(50, 'second@hero.com')]
+        response = self.client.post(reverse('activity-bulk'), items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(Activity.objects.count(), 3)
+        entry = Leaderboard.objects.get(user_email='bulk@hero.com')
+        self.assertEqual((entry.rank, entry.total_calories, entry.total_activities), (1, 300, 2))
+    
+    def test_bulk_ndjson_with_errors(self):
+        """Test that invalid items are reported while valid ones are inserted"""
+        body = '\n'.join(json.dumps(item) for item in [self.activity(100), {'user_email': 'bad'}])
+        response = self.client.post(reverse('activity-bulk'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertIn('calories', response.data['errors'][0]['errors'])
+        self.assertEqual(Activity.objects.count(), 1)
+    
+    def test_bulk_rejects_non_list(self):
+        """Test that a single object body is rejected"""
+        response = self.client.post(reverse('activity-bulk'), self.activity(100), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LeanSerializationTestCase(APITestCase):
+    """Test cases for the .values() read path"""
+    
+    def setUp(self):
+        User.objects.create(name='Lean Hero', email='lean@hero.com', team='Team Lean')
+        for day in range(1, 4):
+            Activity.objects.create(
+                user_email='lean@hero.com',
+                activity_type='Swimming',
+                duration=40,
+                calories=250 * day,
+                date=datetime(2024, 2, day, 7, 30, 15, 123000)
+            )
+    
+    def assertSameJSON(self, serializer_class, row_mapper, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        actual = JSONRenderer().render(row_mapper(queryset.values(*row_mapper.fields)))
+        self.assertEqual(actual, expected)
+    
+    def test_activity_rows_match_serializer(self):
+        """Test that activity rows render byte-identical JSON"""
+        self.assertSameJSON(ActivitySerializer, activity_rows, Activity.objects.order_by('-date'))
+    
+    def test_leaderboard_rows_match_serializer(self):
+        """Test that leaderboard rows render byte-identical JSON"""
+        self.assertSameJSON(LeaderboardSerializer, leaderboard_rows, Leaderboard.objects.order_by('rank'))
+    
+    def test_by_user_uses_lean_rows(self):
+        """Test that by_user returns the serializer's representation"""
+        response = self.client.get(reverse('activity-by-user'), {'email': 'lean@hero.com'})
+        expected = ActivitySerializer(Activity.objects.order_by('-date'), many=True).data
+        self.assertEqual(response.json()['results'], json.loads(JSONRenderer().render(expected)))
+
+
+class BenchmarkHarnessTestCase(TestCase):
+    """Test cases for the API benchmark harness"""
+    
+    def test_every_router_endpoint_is_measured(self):
+        """Test that each GET route is benchmarked and answers 200"""
+        call_command('populate_db', '--users', '20', '--activities-per-user', '3', '--seed', '1', stdout=StringIO())
+        results = benchmarks.run(router, requests=1)
+        endpoints = {result['endpoint']: result for result in results}
+        for name in ['user-list', 'team-stats', 'activity-by-user', 'leaderboard-by-team', 'workout-by-category']:
+            self.assertIn(name, endpoints)
+        for result in results:
+            self.assertEqual(result['status'], 200, result['endpoint'])
+            self.assertGreater(result['response_bytes'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+
+
+class RequestInstrumentationTestCase(APITestCase):
+    """Test cases for the request timing middleware"""
+    
+    def setUp(self):
+        Activity.objects.create(user_email='timed@hero.com', activity_type='Running',
+                                duration=30, calories=300, date=datetime(2024, 1, 1))
+    
+    def test_server_timing_header(self):
+        """Test that responses break their time down in Server-Timing"""
+        response = self.client.get(reverse('activity-list'))
+        metrics = [entry.strip().split(';')[0] for entry in response['Server-Timing'].split(',')]
+        self.assertEqual(metrics, ['translate', 'mongo', 'render', 'total'])
+    
+    @override_settings(REQUEST_TIMING_LOG=True)
+    def test_structured_log(self):
+        """Test that each request is logged as one JSON record"""
+        with self.assertLogs('octofit_tracker.instrumentation', level='INFO') as logs:
+            response = self.client.get(reverse('activity-list'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'ActivityViewSet.list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['db_calls'], 0)
+        self.assertEqual(record['response_bytes'], len(response.content))
+        self.assertLessEqual(record['render_ms'], record['total_ms'])
+    
+    @override_settings(REQUEST_METRICS_ENDPOINT=True)
+    def test_prometheus_aggregates(self):
+        """Test that per-view totals are exposed in Prometheus text format"""
+        instrumentation.aggregates = instrumentation.ViewAggregates()
+        self.client.get(reverse('activity-list'))
+        self.client.get(reverse('activity-list'))
+        response = instrumentation.metrics_view(RequestFactory().get('/metrics'))
+        self.assertIn('octofit_requests_total{view="ActivityViewSet.list"} 2', response.content.decode())
+
+
+class RepositoryParityTestCase(APITestCase):
+    """Test that the pymongo read path answers exactly like the ORM path"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', '--users', '30', '--teams', '3', '--activities-per-user', '12', '--seed', '7', stdout=StringIO())
+    
+    def fetch_all(self, viewset, url, params):
+        """Follow every page of an endpoint using the given repository"""
+        pages = []
+        with mock.patch.object(viewset, 'repository_class', self.repository):
+            caches['api'].clear()
+            response = self.client.get(url, params)
+            pages.append(response.json())
+            while isinstance(pages[-1], dict) and pages[-1].get('next'):
+                caches['api'].clear()
+                pages.append(self.client.get(pages[-1]['next']).json())
+        return pages
+    
+    def assertParity(self, viewset, url, params):
+        self.repository = OrmRepository
+        expected = self.fetch_all(viewset, url, params)
+        self.repository = MongoRepository
+        self.assertEqual(self.fetch_all(viewset, url, params), expected)
+        return expected
+    
+    def test_activities_by_user(self):
+        """Test that activities by user match page by page"""
+        for user in User.objects.all()[:5]:
+            pages = self.assertParity(ActivityViewSet, reverse('activity-by-user'), {'email': user.email, 'page_size': 5})
+            self.assertGreater(len(pages), 1)
+    
+    def test_activities_by_unknown_user(self):
+        """Test that an unknown user gives the same empty page"""
+        self.assertParity(ActivityViewSet, reverse('activity-by-user'), {'email': 'nobody@hero.com'})
+    
+    def test_leaderboard_by_team(self):
+        """Test that team leaderboards match page by page"""
+        for team in Team.objects.all():
+            self.assertParity(LeaderboardViewSet, reverse('leaderboard-by-team'), {'team': team.name, 'page_size': 4})
+    
+    def test_workouts_by_difficulty_and_category(self):
+        """Test that filtered workouts match"""
+        for workout in Workout.objects.all():
+            self.assertParity(WorkoutViewSet, reverse('workout-by-difficulty'), {'difficulty': workout.difficulty})
+            self.assertParity(WorkoutViewSet, reverse('workout-by-category'), {'category': workout.category})
+
+
+class AsyncReadPathTestCase(APITestCase):
+    """Test that the async read endpoints answer like their DRF twins"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', '--users', '20', '--teams', '2', '--activities-per-user', '9', '--seed', '3', stdout=StringIO())
+    
+    def setUp(self):
+        caches['api'].clear()
+    
+    @sync_to_async
+    def drf_json(self, url, params=None):
+        return self.client.get(url, params).json()
+    
+    async def fetch_pages(self, url, params):
+        response = await self.async_client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        pages = [response.json()]
+        while pages[-1]['next']:
+            pages.append((await self.async_client.get(pages[-1]['next'])).json())
+        return [page['results'] for page in pages]
+    
+    async def test_leaderboard(self):
+        """Test that the async leaderboard pages match the DRF list"""
+        pages = await self.fetch_pages(reverse('async-leaderboard'), {'page_size': 6})
+        expected = (await self.drf_json(reverse('leaderboard-list'), {'page_size': 1000}))['results']
+        self.assertEqual(sum(pages, []), expected)
+        self.assertGreater(len(pages), 1)
+    
+    async def test_activities_by_user(self):
+        """Test that the async activities by user match the DRF action"""
+        email = await User.objects.values_list('email', flat=True).afirst()
+        pages = await self.fetch_pages(reverse('async-activities-by-user'), {'email': email, 'page_size': 4})
+        expected = (await self.drf_json(reverse('activity-by-user'), {'email': email, 'page_size': 1000}))['results']
+        self.assertEqual(sum(pages, []), expected)
+    
+    async def test_workouts(self):
+        """Test that async workouts match the DRF list and filters"""
+        response = await self.async_client.get(reverse('async-workouts'))
+        self.assertEqual(response.json(), await self.drf_json(reverse('workout-list')))
+        response = await self.async_client.get(reverse('async-workouts'), {'difficulty': 'Beginner'})
+        expected = await self.drf_json(reverse('workout-by-difficulty'), {'difficulty': 'Beginner'})
+        self.assertEqual(response.json(), expected)
+    
+    async def test_bad_requests(self):
+        """Test missing params, bad cursors and other methods"""
+        response = await self.async_client.get(reverse('async-activities-by-user'))
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(reverse('async-leaderboard'), {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.post(reverse('async-workouts'))
+        self.assertEqual(response.status_code, 405)
+
+
+class ConnectionPoolTestCase(APITestCase):
+    """Test cases for Mongo pool monitoring and the health endpoint"""
+    
+    address = ('mongo', 27017)
+    
+    def test_pool_monitor_tracks_usage(self):
+        """Test that checkouts, check-ins and failures update the pool figures"""
+        monitor = health.PoolMonitor()
+        monitor.pool_created(monitoring.PoolCreatedEvent(self.address, {'maxPoolSize': 4}))
+        monitor.connection_created(monitoring.ConnectionCreatedEvent(self.address, 1))
+        monitor.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(self.address))
+        monitor.connection_checked_out(monitoring.ConnectionCheckedOutEvent(self.address, 1))
+        pool = monitor.snapshot()['mongo:27017']
+        self.assertEqual((pool['open'], pool['in_use'], pool['checkouts']), (1, 1, 1))
+        self.assertEqual(pool['utilization'], 0.25)
+        
+        monitor.connection_checked_in(monitoring.ConnectionCheckedInEvent(self.address, 1))
+        monitor.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(self.address))
+        monitor.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(self.address, 'timeout'))
+        pool = monitor.snapshot()['mongo:27017']
+        self.assertEqual((pool['in_use'], pool['checkout_failures']), (0, 1))
+        self.assertIn('octofit_mongo_pool_in_use{address="mongo:27017"} 0', monitor.prometheus())
+    
+    def test_health_endpoint(self):
+        """Test that the health endpoint pings Mongo and reports pool settings"""
+        response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ok')
+        self.assertIn('ping_ms', response.json()['database'])
+        self.assertIn('maxPoolSize', response.json()['pool_settings'])
+    
+    def test_health_endpoint_reports_outage(self):
+        """Test that an unreachable database answers 503"""
+        with mock.patch.object(health, 'get_database', side_effect=Exception('no servers')):
+            response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['database']['error'], 'no servers')
+    
+    def test_read_preference(self):
+        """Test that lag-tolerant reads use MONGO_READ_PREFERENCE"""
+        with override_settings(MONGO_READ_PREFERENCE='secondaryPreferred'):
+            self.assertEqual(get_read_collection(Activity).read_preference.mongos_mode, 'secondaryPreferred')
+        with override_settings(MONGO_READ_PREFERENCE='sideways'):
+            with self.assertRaises(ImproperlyConfigured):
+                get_read_collection(Activity)
+
+
+class PeriodLeaderboardTestCase(APITestCase):
+    """Test cases for the day, week and month leaderboards"""
+    
+    def setUp(self):
+        caches['api'].clear()
+        self.now = timezone.now()
+        for index, name in enumerate(['Ana', 'Bia', 'Caio']):
+            User.objects.create(name=name, email=f'{name.lower()}@hero.com', team='Blue' if index else 'Red')
+    
+    def log(self, email, calories, days_ago=0):
+        return Activity.objects.create(user_email=email, activity_type='Running', duration=30,
+                                       calories=calories, date=self.now - timedelta(days=days_ago))
+    
+    def snapshot(self):
+        return sorted(
+            (entry['period'], entry['bucket'], entry['rank'], entry['user_email'],
+             entry['total_calories'], entry['total_activities'], entry['expires_at'])
+            for entry in get_collection(PeriodLeaderboard).find()
+        )
+    
+    def test_incremental_matches_rebuild(self):
+        """Test that creates, moves and deletes keep every bucket as a rebuild would"""
+        self.log('ana@hero.com', 300)
+        self.log('bia@hero.com', 450, days_ago=2)
+        moved = self.log('caio@hero.com', 520, days_ago=12)
+        deleted = self.log('ana@hero.com', 90, days_ago=40)
+        self.log('bia@hero.com', 610)
+        moved.date = self.now
+        moved.save()
+        deleted.delete()
+        incremental = self.snapshot()
+        leaderboard.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+    
+    def test_current_period(self):
+        """Test that ?period= ranks the current bucket only"""
+        self.log('ana@hero.com', 300)
+        self.log('bia@hero.com', 500)
+        self.log('caio@hero.com', 900, days_ago=60)
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'day'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([(row['user_email'], row['rank']) for row in results],
+                         [('bia@hero.com', 1), ('ana@hero.com', 2)])
+        all_time = self.client.get(reverse('leaderboard-list'), {'period': 'all'}).data['results']
+        self.assertEqual(all_time[0]['user_email'], 'caio@hero.com')
+    
+    def test_past_bucket(self):
+        """Test that ?bucket= selects an earlier bucket"""
+        self.log('caio@hero.com', 900, days_ago=3)
+        bucket = leaderboard.bucket_key('day', self.now - timedelta(days=3))
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'day', 'bucket': bucket})
+        self.assertEqual([row['user_email'] for row in response.data['results']], ['caio@hero.com'])
+    
+    def test_expired_buckets_are_not_created(self):
+        """Test that activities older than the retention only count all-time"""
+        self.log('ana@hero.com', 300, days_ago=400)
+        self.assertEqual(PeriodLeaderboard.objects.count(), 0)
+        self.assertEqual(Leaderboard.objects.count(), 1)
+    
+    def test_bulk_updates_periods(self):
+        """Test that bulk ingestion feeds the period buckets"""
+        items = [
+            {'user_email': 'ana@hero.com', 'activity_type': 'Running', 'duration': 30,
+             'calories': 200 + index, 'date': self.now.isoformat()}
+            for index in range(3)
+        ]
+        self.client.post(reverse('activity-bulk'), items, format='json')
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'week'})
+        self.assertEqual(response.data['results'][0]['total_calories'], 603)
+    
+    def test_invalid_period_and_bucket(self):
+        """Test that unknown periods and malformed buckets are rejected"""
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'week', 'bucket': '2024-13'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TeamLeaderboardTestCase(APITestCase):
+    """Test cases for the team leaderboard"""
+    
+    def setUp(self):
+        caches['api'].clear()
+        for name, team in [('Ana', 'Red'), ('Bia', 'Blue'), ('Caio', 'Blue'), ('Duda', 'Green')]:
+            User.objects.create(name=name, email=f'{name.lower()}@hero.com', team=team)
+    
+    def log(self, email, calories):
+        return Activity.objects.create(user_email=email, activity_type='Running', duration=30,
+                                       calories=calories, date=datetime(2024, 1, 1))
+    
+    def snapshot(self):
+        return sorted(
+            (entry['rank'], entry['team'], entry['total_calories'], entry['total_activities'],
+             entry['active_members'], entry['average_calories'])
+            for entry in get_collection(TeamLeaderboard).find()
+        )
+    
+    def test_incremental_matches_rebuild(self):
+        """Test that team totals, members and ranks follow every write"""
+        self.log('ana@hero.com', 500)
+        self.log('bia@hero.com', 200)
+        caio = self.log('caio@hero.com', 250)
+        duda = self.log('duda@hero.com', 100)
+        self.log('nobody@hero.com', 999)
+        caio.calories = 400
+        caio.save()
+        duda.user_email = 'ana@hero.com'
+        duda.save()
+        incremental = self.snapshot()
+        self.assertEqual(incremental, [(1, 'Blue', 600, 2, 2, 300.0), (2, 'Red', 600, 2, 1, 600.0)])
+        leaderboard.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+    
+    def test_last_activity_removes_member(self):
+        """Test that a member with no activities left stops counting"""
+        self.log('bia@hero.com', 200)
+        caio = self.log('caio@hero.com', 300)
+        caio.delete()
+        self.assertEqual(self.snapshot(), [(1, 'Blue', 200, 1, 1, 200.0)])
+    
+    def test_endpoint(self):
+        """Test that the team leaderboard endpoint lists ranked teams"""
+        self.log('ana@hero.com', 500)
+        self.log('bia@hero.com', 200)
+        self.client.post(reverse('activity-bulk'), [
+            {'user_email': 'caio@hero.com', 'activity_type': 'Running', 'duration': 30,
+             'calories': 450, 'date': '2024-01-02T00:00:00Z'},
+        ], format='json')
+        response = self.client.get(reverse('teamleaderboard-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['rank'], row['team'], row['active_members'], row['average_calories']) for row in response.data['results']],
+            [(1, 'Blue', 2, 325.0), (2, 'Red', 1, 500.0)]
+        )
+
+
+class LeaderboardWindowTestCase(APITestCase):
+    """Test cases for the top-K and around-me leaderboard queries"""
+    
+    def setUp(self):
+        caches['api'].clear()
+        for index in range(1, 11):
+            User.objects.create(name=f'User {index}', email=f'user{index}@hero.com', team='Blue')
+            Activity.objects.create(user_email=f'user{index}@hero.com', activity_type='Running',
+                                    duration=30, calories=1000 - index * 10, date=timezone.now())
+    
+    def test_top(self):
+        """Test that ?top=K returns the first K ranks"""
+        response = self.client.get(reverse('leaderboard-list'), {'top': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['rank'] for row in response.data['results']], [1, 2, 3])
+        self.assertEqual(response.data['results'][0]['user_email'], 'user1@hero.com')
+    
+    def test_top_for_period(self):
+        """Test that ?top= works on a period ranking"""
+        response = self.client.get(reverse('leaderboard-list'), {'top': 2, 'period': 'week'})
+        self.assertEqual([row['user_email'] for row in response.data['results']],
+                         ['user1@hero.com', 'user2@hero.com'])
+    
+    def test_invalid_top(self):
+        """Test that a non-positive or non-numeric ?top= is rejected"""
+        for value in ('0', 'ten'):
+            response = self.client.get(reverse('leaderboard-list'), {'top': value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_around(self):
+        """Test that around/<email> returns the user's rank and neighbours"""
+        url = reverse('leaderboard-around', kwargs={'email': 'user5@hero.com'})
+        response = self.client.get(url, {'n': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 5)
+        self.assertEqual([row['rank'] for row in response.data['results']], [3, 4, 5, 6, 7])
+    
+    def test_around_edges(self):
+        """Test that the window is clipped at the top and bottom of the ranking"""
+        url = reverse('leaderboard-around', kwargs={'email': 'user1@hero.com'})
+        self.assertEqual([row['rank'] for row in self.client.get(url).data['results']], [1, 2, 3, 4, 5, 6])
+        url = reverse('leaderboard-around', kwargs={'email': 'user10@hero.com'})
+        self.assertEqual([row['rank'] for row in self.client.get(url, {'n': 1}).data['results']], [9, 10])
+    
+    def test_around_unknown_user(self):
+        """Test that around/<email> returns 404 for users without an entry"""
+        url = reverse('leaderboard-around', kwargs={'email': 'nobody@hero.com'})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_around_follows_writes(self):
+        """Test that around/<email> reflects rank changes after a new activity"""
+        url = reverse('leaderboard-around', kwargs={'email': 'user10@hero.com'})
+        self.assertEqual(self.client.get(url).data['rank'], 10)
+        Activity.objects.create(user_email='user10@hero.com', activity_type='Running',
+                                duration=30, calories=500, date=timezone.now())
+        self.assertEqual(self.client.get(url).data['rank'], 1)
+
+
+class DenormalizationTestCase(APITestCase):
+    """Test cases for propagating user and team changes to their copies"""
+    
+    def setUp(self):
+        caches['api'].clear()
+        Team.objects.create(name='Blue', description='Blue team')
+        Team.objects.create(name='Red', description='Red team')
+        self.ana = User.objects.create(name='Ana', email='ana@hero.com', team='Blue')
+        User.objects.create(name='Bia', email='bia@hero.com', team='Blue')
+        User.objects.create(name='Caio', email='caio@hero.com', team='Red')
+        for email, calories in [('ana@hero.com', 300), ('bia@hero.com', 200), ('caio@hero.com', 400), ('ana@hero.com', 150)]:
+            Activity.objects.create(user_email=email, activity_type='Running', duration=30,
+                                    calories=calories, date=timezone.now())
+    
+    def snapshot(self):
+        return {
+            model.__name__: sorted(
+                tuple(sorted((key, value) for key, value in document.items() if key != '_id'))
+                for document in get_collection(model).find()
+            )
+            for model in (Leaderboard, PeriodLeaderboard, TeamLeaderboard)
+        }
+    
+    def test_user_changes_match_rebuild(self):
+        """Test that renaming a user and moving them to another team matches a rebuild"""
+        url = reverse('user-detail', args=[str(self.ana.pk)])
+        response = self.client.patch(url, {'name': 'Ana Maria', 'team': 'Red'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.get(user_email='ana@hero.com').user_name, 'Ana Maria')
+        self.assertEqual(set(PeriodLeaderboard.objects.filter(user_email='ana@hero.com').values_list('team', flat=True)), {'Red'})
+        incremental = self.snapshot()
+        leaderboard.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+    
+    def test_email_change(self):
+        """Test that a new email carries the user's activities and entries along"""
+        self.ana.email = 'ana.maria@hero.com'
+        self.ana.save()
+        self.assertEqual(Activity.objects.filter(user_email='ana.maria@hero.com').count(), 2)
+        self.assertFalse(Leaderboard.objects.filter(user_email='ana@hero.com').exists())
+        self.assertEqual(Leaderboard.objects.get(user_email='ana.maria@hero.com').rank, 1)
+    
+    def test_email_change_merges(self):
+        """Test that changing to an email that already has activities merges the entries"""
+        Activity.objects.create(user_email='ana.maria@hero.com', activity_type='Yoga', duration=30,
+                                calories=500, date=timezone.now())
+        self.assertEqual(Leaderboard.objects.get(user_email='ana.maria@hero.com').team, '')
+        self.ana.email = 'ana.maria@hero.com'
+        self.ana.save()
+        entry = Leaderboard.objects.get(user_email='ana.maria@hero.com')
+        self.assertEqual((entry.total_calories, entry.total_activities, entry.team), (950, 3, 'Blue'))
+        self.assertFalse(PeriodLeaderboard.objects.filter(user_email='ana@hero.com').exists())
+        
+        incremental = self.snapshot()
+        series = sorted(get_collection(ActivityRollup).find({}, {'_id': 0}),
+                        key=lambda document: (document['scope'], document['key'], document['bucket']))
+        denormalize.propagate_user({'email': 'ana@hero.com', 'name': 'Ana', 'team': 'Blue'},
+                                   {'email': 'ana.maria@hero.com', 'name': 'Ana', 'team': 'Blue'})
+        self.assertEqual(incremental, self.snapshot())
+        leaderboard.rebuild()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(series, sorted(get_collection(ActivityRollup).find({}, {'_id': 0}),
+                                        key=lambda document: (document['scope'], document['key'], document['bucket'])))
+    
+    def test_team_rename(self):
+        """Test that renaming a team rewrites users and leaderboards"""
+        team = Team.objects.get(name='Blue')
+        team.name = 'Navy'
+        team.save()
+        self.assertEqual(User.objects.filter(team='Navy').count(), 2)
+        self.assertFalse(Leaderboard.objects.filter(team='Blue').exists())
+        self.assertEqual(TeamLeaderboard.objects.get(team='Navy').total_calories, 650)
+        incremental = self.snapshot()
+        leaderboard.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+    
+    def test_retried_propagation(self):
+        """Test that running team moves and renames again, as a retried job does, changes nothing"""
+        previous = {'email': 'ana@hero.com', 'name': 'Ana', 'team': 'Blue'}
+        current = dict(previous, team='Red')
+        self.ana.team = 'Red'
+        self.ana.save()
+        denormalize.propagate_user(previous, current)
+        team = Team.objects.get(name='Red')
+        team.name = 'Crimson'
+        team.save()
+        denormalize.propagate_team('Red', 'Crimson')
+        self.assertEqual(TeamLeaderboard.objects.get(team='Crimson').active_members, 2)
+        
+        incremental = self.snapshot()
+        series = sorted(get_collection(ActivityRollup).find({'scope': 'team'}, {'_id': 0}),
+                        key=lambda document: (document['key'], document['bucket']))
+        leaderboard.rebuild()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(series, sorted(get_collection(ActivityRollup).find({'scope': 'team'}, {'_id': 0}),
+                                        key=lambda document: (document['key'], document['bucket'])))
+    
+    @override_settings(DENORMALIZATION_MODE='queue', JOBS_WORKER='external')
+    def test_queue_mode(self):
+        """Test that queued changes are applied by a job worker"""
+        self.ana.name = 'Ana Maria'
+        self.ana.save()
+        self.assertEqual(Leaderboard.objects.get(user_email='ana@hero.com').user_name, 'Ana')
+        self.assertEqual(jobs.work(burst=True), 1)
+        self.assertEqual(Leaderboard.objects.get(user_email='ana@hero.com').user_name, 'Ana Maria')
+    
+    def test_checker_repairs_drift(self):
+        """Test that check_denormalized finds and repairs updates that bypassed save()"""
+        User.objects.filter(email='bia@hero.com').update(team='Red')
+        get_collection(User).update_one({'email': 'caio@hero.com'}, {'$set': {'name': 'Caio Lima'}})
+        out = StringIO()
+        call_command('check_denormalized', '--batch-size', '2', stdout=out)
+        # One all-time entry and three period entries for each of the two users.
+        self.assertIn('8 leaderboard entries with a stale name or team', out.getvalue())
+        
+        out = StringIO()
+        call_command('check_denormalized', '--repair', '--batch-size', '2', stdout=out)
+        self.assertIn('Team totals rebuilt: Blue, Red', out.getvalue())
+        report = denormalize.check()
+        self.assertEqual((report['stale_entries'], report['drifted_teams']), (0, []))
+        self.assertEqual(TeamLeaderboard.objects.get(team='Red').active_members, 2)
+    
+    def test_checker_reports_orphans(self):
+        """Test that activities of unknown users and users of unknown teams are reported"""
+        get_collection(Activity).insert_one({'user_email': 'ghost@hero.com', 'activity_type': 'Running',
+                                             'duration': 10, 'calories': 50, 'date': datetime(2024, 1, 1)})
+        User.objects.filter(email='caio@hero.com').update(team='Green')
+        report = denormalize.check()
+        self.assertEqual(report['orphan_activity_emails'], ['ghost@hero.com'])
+        self.assertEqual(report['unknown_teams'], ['Green'])
+
+
+@override_settings(JOBS_WORKER='external')
+class JobQueueTestCase(APITestCase):
+    """Test cases for the background job queue"""
+    
+    def setUp(self):
+        for index, name in enumerate(['Ana', 'Bia', 'Caio']):
+            User.objects.create(name=name, email=f'{name.lower()}@hero.com', team='Blue')
+            Activity.objects.create(user_email=f'{name.lower()}@hero.com', activity_type='Running',
+                                    duration=30, calories=100 * (index + 1), date=timezone.now())
+    
+    def test_rebuild_via_api(self):
+        """Test that a queued rebuild runs on a worker and reports its progress"""
+        get_collection(Leaderboard).delete_many({})
+        response = self.client.post(reverse('job-list'), {'kind': 'rebuild_leaderboard'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'queued')
+        
+        self.assertEqual(jobs.work(burst=True), 1)
+        job = self.client.get(reverse('job-detail', args=[response.data['_id']])).data
+        self.assertEqual((job['status'], job['progress_done'], job['progress_total']), ('done', 3, 3))
+        self.assertEqual(job['result'], {'users': 3})
+        self.assertEqual(Leaderboard.objects.get(rank=1).user_email, 'caio@hero.com')
+    
+    def test_unknown_kind(self):
+        """Test that only registered job kinds can be queued"""
+        response = self.client.post(reverse('job-list'), {'kind': 'drop_everything'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_api_kinds_and_params(self):
+        """Test that the API refuses internal kinds and validates each kind's params"""
+        url = reverse('job-list')
+        refused = [
+            {'kind': 'propagate_team', 'params': {'args': ['Blue', 'Red']}},
+            {'kind': 'sync_indexes', 'params': {'drop': True}},
+            {'kind': 'rebuild_search', 'params': {'batch_size': 0}},
+            {'kind': 'rebuild_search', 'params': {'kind': 'user'}},
+            {'kind': 'repair_denormalized', 'params': {'repair': 'maybe'}},
+        ]
+        for body in refused:
+            self.assertEqual(self.client.post(url, body, format='json').status_code,
+                             status.HTTP_400_BAD_REQUEST, body)
+        self.assertFalse(Job.objects.exists())
+        
+        response = self.client.post(url, {'kind': 'repair_denormalized', 'params': {'batch_size': '2', 'repair': False}},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Job.objects.get().params, {'batch_size': 2, 'repair': False})
+    
+    def test_resume_after_crash(self):
+        """Test that an abandoned job is claimed again and resumes from its checkpoint"""
+        job = jobs.enqueue('repair_denormalized', {'batch_size': 1})
+        claimed = jobs.claim('crashed')
+        state, done, total = next(tasks.repair_denormalized(claimed['params'], claimed['state']))
+        get_collection(Job).update_one({'_id': job['_id']}, {'$set': {
+            'state': state, 'progress_done': done, 'progress_total': total,
+            'heartbeat_at': timezone.now() - timedelta(hours=1),
+        }})
+        
+        self.assertEqual(jobs.work(worker='replacement', burst=True), 1)
+        job = get_collection(Job).find_one({'_id': job['_id']})
+        self.assertEqual((job['status'], job['attempts'], job['worker']), ('done', 2, 'replacement'))
+        # The first user was checked before the crash and is not checked again.
+        self.assertEqual(job['result']['users_checked'], 3)
+    
+    def test_lane_runs_in_order(self):
+        """Test that a job waits until the older jobs of its lane have finished"""
+        first = jobs.enqueue('sync_indexes', lane='denormalize')
+        second = jobs.enqueue('sync_indexes', lane='denormalize')
+        other = jobs.enqueue('sync_indexes')
+        self.assertEqual(jobs.claim('one')['_id'], first['_id'])
+        self.assertEqual(jobs.claim('two')['_id'], other['_id'])
+        self.assertIsNone(jobs.claim('three'))
+        
+        get_collection(Job).update_one({'_id': first['_id']}, {'$set': {'status': 'done'}})
+        self.assertEqual(jobs.claim('three')['_id'], second['_id'])
+    
+    def test_claim_scans_lane_heads(self):
+        """Test that a lane's backlog does not add queries to every claim"""
+        collection = type(get_collection(Job))
+        
+        jobs.enqueue('sync_indexes', lane='denormalize')
+        jobs.claim('busy')
+        
+        def claim_queries(backlog):
+            # The lane's jobs wait behind its running head; only the unlaned job can run.
+            for _ in range(backlog):
+                jobs.enqueue('sync_indexes', lane='denormalize')
+            unlaned = jobs.enqueue('sync_indexes')
+            with mock.patch.object(collection, 'find', autospec=True, side_effect=collection.find) as find, \
+                    mock.patch.object(collection, 'find_one', autospec=True, side_effect=collection.find_one) as find_one:
+                self.assertEqual(jobs.claim('worker')['_id'], unlaned['_id'])
+            get_collection(Job).update_one({'_id': unlaned['_id']}, {'$set': {'status': 'done'}})
+            return find.call_count + find_one.call_count
+        
+        self.assertEqual(claim_queries(2), claim_queries(40))
+    
+    @override_settings(JOBS_STALE_SECONDS=1)
+    def test_heartbeat_during_long_handler(self):
+        """Test that a handler running past JOBS_STALE_SECONDS keeps its job from being claimed again"""
+        claimed = []
+        
+        def slow(params, state):
+            time.sleep(1.5)
+            claimed.append(jobs.claim('other'))
+        
+        with mock.patch.dict(jobs.HANDLERS, {'slow': slow}):
+            job = jobs.enqueue('slow')
+            jobs.work(worker='first', burst=True)
+        self.assertEqual(claimed, [None])
+        job = get_collection(Job).find_one({'_id': job['_id']})
+        self.assertEqual((job['status'], job['attempts'], job['worker']), ('done', 1, 'first'))
+    
+    def test_gives_up_after_max_attempts(self):
+        """Test that a job abandoned too often is marked failed"""
+        job = jobs.enqueue('sync_indexes')
+        get_collection(Job).update_one({'_id': job['_id']}, {'$set': {
+            'status': 'running', 'attempts': 3, 'heartbeat_at': timezone.now() - timedelta(hours=1),
+        }})
+        jobs.work(burst=True)
+        job = get_collection(Job).find_one({'_id': job['_id']})
+        self.assertEqual((job['status'], job['error']), ('failed', 'Gave up after 3 attempts'))
+    
+    def test_handler_error(self):
+        """Test that a handler exception fails the job with the error recorded"""
+        def broken(params, state):
+            raise RuntimeError('boom')
+        with mock.patch.dict(jobs.HANDLERS, {'broken': broken}), self.assertLogs('octofit_tracker.jobs', 'ERROR'):
+            job = jobs.enqueue('broken')
+            jobs.work(burst=True)
+        job = get_collection(Job).find_one({'_id': job['_id']})
+        self.assertEqual((job['status'], job['error']), ('failed', 'RuntimeError: boom'))
+    
+    def test_enqueue_command(self):
+        """Test that enqueue_job and run_jobs queue and run a job"""
+        out = StringIO()
+        call_command('enqueue_job', 'repair_denormalized', '--param', 'batch_size=2', stdout=out)
+        self.assertIn('Queued repair_denormalized job', out.getvalue())
+        self.assertEqual(Job.objects.get().params, {'batch_size': 2})
+        out = StringIO()
+        call_command('run_jobs', '--burst', stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        self.assertEqual(Job.objects.get().status, 'done')
+    
+    @override_settings(JOBS_WORKER='thread')
+    def test_enqueue_command_starts_no_worker(self):
+        """Test that enqueue_job leaves the job queued instead of starting a worker thread"""
+        with mock.patch('octofit_tracker.jobs.start_worker_thread') as start:
+            call_command('enqueue_job', 'sync_indexes', stdout=StringIO())
+        start.assert_not_called()
+        self.assertEqual(Job.objects.get().status, 'queued')
+
+
+class TranslationCacheTestCase(TestCase):
+    """Test cases for the compiled djongo translation cache"""
+    
+    def setUp(self):
+        for index, name in enumerate(['Ana', 'Bia', 'Caio', 'Duda']):
+            User.objects.create(name=name, email=f'{name.lower()}@hero.com', team='Blue' if index % 2 else 'Red')
+            for day in range(3):
+                Activity.objects.create(user_email=f'{name.lower()}@hero.com', activity_type='Running', duration=20 + day,
+                                        calories=100 * index + day, date=timezone.now() - timedelta(days=day))
+        querycache.cache.clear()
+    
+    def queries(self, team, email):
+        return [
+            list(User.objects.filter(team=team).order_by('name').values('name', 'email')),
+            list(Activity.objects.filter(user_email=email).order_by('-date').values('calories', 'date')),
+            list(Leaderboard.objects.order_by('rank').values_list('user_email', flat=True)[:3]),
+            Activity.objects.filter(calories__gte=100, duration__lt=22).count(),
+            sorted(User.objects.filter(email__in=[email, 'nobody@hero.com']).values_list('name', flat=True)),
+        ]
+    
+    def test_cached_results_match_djongo(self):
+        """Test that queries served from compiled plans return what djongo returns"""
+        for team, email in [('Blue', 'bia@hero.com'), ('Red', 'caio@hero.com')]:
+            with querycache.disabled():
+                expected = self.queries(team, email)
+            self.assertEqual(self.queries(team, email), expected)
+        stats = querycache.cache.stats()
+        # The second pair of parameters reuses every shape compiled for the first.
+        self.assertEqual((stats['misses'], stats['hits']), (5, 5))
+    
+    def test_transformed_parameters_bypass(self):
+        """Test that shapes whose parameters djongo rewrites are left to djongo"""
+        for _ in range(2):
+            self.assertEqual(list(User.objects.filter(name__icontains='ai').values_list('name', flat=True)), ['Caio'])
+        stats = querycache.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['bypassed']), (0, 0, 2))
+    
+    def test_lru_bound(self):
+        """Test that the least recently used plan is evicted when the cache is full"""
+        cache = querycache.TranslationCache(maxsize=2)
+        cache.get('a', lambda: 'plan a')
+        cache.get('b', lambda: 'plan b')
+        cache.get('a', lambda: 'recompiled a')
+        cache.get('c', lambda: 'plan c')
+        self.assertEqual(list(cache._plans), ['a', 'c'])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+    
+    def test_writes_are_not_cached(self):
+        """Test that inserts and updates bypass the cache entirely"""
+        User.objects.filter(email='ana@hero.com').update(name='Ana Maria')
+        self.assertEqual(querycache.cache.stats()['size'], 0)
+        self.assertEqual(User.objects.get(email='ana@hero.com').name, 'Ana Maria')
+
+
+class SearchTestCase(APITestCase):
+    """Test cases for full-text search and autocomplete"""
+    
+    def setUp(self):
+        self.spider = User.objects.create(name='Spider-Man', email='peter.parker@marvel.com', team='Team Marvel')
+        User.objects.create(name='Iron Man', email='tony.stark@marvel.com', team='Team Marvel')
+        User.objects.create(name='Superman', email='clark.kent@dc.com', team='Team DC')
+        Workout.objects.create(name='Spider Climb', description='Wall climbing for Spider-Man fans',
+                               category='Strength', difficulty='Advanced', estimated_calories=400, duration=40)
+        Workout.objects.create(name='Super Speed Sprint', description='Run like The Flash',
+                               category='Cardio', difficulty='Intermediate', estimated_calories=600, duration=45)
+        self.climb = Activity.objects.create(user_email='peter.parker@marvel.com', activity_type='Climbing',
+                                             duration=30, calories=250, date=timezone.now())
+    
+    def titles(self, response):
+        return [(result['kind'], result['title']) for result in response.data['results']]
+    
+    def test_relevance_order(self):
+        """Test that title matches outrank matches in other fields"""
+        response = self.client.get(reverse('search-list'), {'q': 'spider'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.titles(response), [('workout', 'Spider Climb'), ('user', 'Spider-Man')])
+    
+    def test_every_word_first(self):
+        """Test that entries holding every query word come before partial matches"""
+        response = self.client.get(reverse('search-list'), {'q': 'marvel man'})
+        self.assertEqual(self.titles(response), [
+            ('user', 'Iron Man'), ('user', 'Spider-Man'), ('workout', 'Spider Climb'),
+        ])
+        self.assertEqual([result['score'] for result in response.data['results']], [4, 4, 1])
+    
+    def test_autocomplete(self):
+        """Test that autocomplete matches title prefixes, then word prefixes"""
+        response = self.client.get(reverse('search-autocomplete'), {'q': 'Sup'})
+        self.assertEqual(self.titles(response), [('workout', 'Super Speed Sprint'), ('user', 'Superman')])
+        response = self.client.get(reverse('search-autocomplete'), {'q': 'spider m'})
+        self.assertEqual(self.titles(response), [('user', 'Spider-Man')])
+        response = self.client.get(reverse('search-autocomplete'), {'q': 'ma'})
+        self.assertEqual(self.titles(response), [('user', 'Iron Man'), ('user', 'Spider-Man')])
+    
+    def test_invalid_params(self):
+        """Test that a missing query, an unknown kind or a bad limit is rejected"""
+        self.assertEqual(self.client.get(reverse('search-list')).status_code, status.HTTP_400_BAD_REQUEST)
+        for kind in ('team', 'activity'):
+            response = self.client.get(reverse('search-list'), {'q': 'spider', 'kind': kind})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('search-autocomplete'), {'q': 'spi', 'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_index_follows_writes(self):
+        """Test that saves, deletes and propagated changes reach the index, and activities are not indexed"""
+        self.spider.name = 'Miles Morales'
+        self.spider.email = 'miles@marvel.com'
+        self.spider.save()
+        self.assertEqual(search.object_ids('user', 'spider', 10), [])
+        self.assertEqual(search.object_ids('user', 'miles', 10), [str(self.spider.pk)])
+        
+        Workout.objects.get(name='Spider Climb').delete()
+        self.assertEqual(search.search('climb', kinds=['workout']), [])
+        
+        response = self.client.post(reverse('activity-bulk'), [
+            {'user_email': 'clark.kent@dc.com', 'activity_type': 'Flying', 'duration': 60,
+             'calories': 500, 'date': '2024-03-05T10:00:00Z'},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.climb.save()
+        self.assertFalse(SearchEntry.objects.filter(kind='activity').exists())
+    
+    def test_rebuild(self):
+        """Test that a rebuild indexes writes that bypassed signals and drops deleted objects"""
+        stale = search.build_entry('user', {'_id': self.climb.pk, 'name': 'Climbing'})
+        get_collection(SearchEntry).insert_one({**stale, 'kind': 'activity',
+                                                'indexed_at': timezone.now() - timedelta(days=1)})
+        get_collection(User).insert_one({'name': 'Batman', 'email': 'bruce.wayne@dc.com', 'team': 'Team DC'})
+        get_collection(Workout).delete_many({'name': 'Spider Climb'})
+        self.assertEqual(search.rebuild(), 5)
+        self.assertEqual(self.titles(self.client.get(reverse('search-list'), {'q': 'bat'})), [])
+        self.assertEqual(self.titles(self.client.get(reverse('search-list'), {'q': 'batman'})), [('user', 'Batman')])
+        self.assertEqual(search.object_ids('workout', 'spider', 10), [])
+        self.assertFalse(SearchEntry.objects.filter(kind='activity').exists())
+    
+    @override_settings(JOBS_WORKER='external')
+    def test_rebuild_job(self):
+        """Test that the rebuild_search job reindexes every kind"""
+        SearchEntry.objects.all().delete()
+        job = jobs.enqueue('rebuild_search', {'batch_size': 2})
+        jobs.work(burst=True)
+        self.assertEqual(Job.objects.get(pk=job['_id']).result, {'entries': 5, 'removed': 0})
+    
+    def test_admin_search_uses_index(self):
+        """Test that the admin changelist search is answered from the index"""
+        model_admin = UserAdmin(User, django_admin.site)
+        request = RequestFactory().get('/admin/octofit_tracker/user/', {'q': 'marvel sp'})
+        queryset, duplicates = model_admin.get_search_results(request, User.objects.all(), 'marvel sp')
+        self.assertEqual([user.name for user in queryset], ['Spider-Man'])
+        self.assertFalse(duplicates)
+
+
+class AdminChangeListTestCase(TestCase):
+    """Test cases for the large-collection admin changelists"""
+    
+    def setUp(self):
+        caches['default'].clear()
+        admin_user = get_user_model().objects.create_superuser('ops', 'ops@octofit.com', 'secret')
+        self.client.force_login(admin_user)
+        start = timezone.now() - timedelta(days=10)
+        for index in range(7):
+            Activity.objects.create(user_email='ana@hero.com', activity_type='Running' if index % 2 else 'Cycling',
+                                    duration=30, calories=100 + index, date=start + timedelta(days=index))
+        self.url = reverse('admin:octofit_tracker_activity_changelist')
+    
+    def pages(self, params=None):
+        """Follow the next links from the first page; return each page's calories."""
+        pages = []
+        response = self.client.get(self.url, params or {})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            changelist = response.context['cl']
+            pages.append([activity.calories for activity in changelist.result_list])
+            if not changelist.next_url:
+                return pages, changelist
+            response = self.client.get(self.url + changelist.next_url)
+    
+    @mock.patch.object(ActivityAdmin, 'list_per_page', 3)
+    def test_cursor_paging(self):
+        """Test that changelist pages follow a cursor in -date order, forward and back"""
+        pages, changelist = self.pages()
+        self.assertEqual(pages, [[106, 105, 104], [103, 102, 101], [100]])
+        response = self.client.get(self.url + changelist.previous_url)
+        self.assertEqual([activity.calories for activity in response.context['cl'].result_list], [103, 102, 101])
+        self.assertContains(response, 'Next')
+    
+    @mock.patch.object(ActivityAdmin, 'list_per_page', 3)
+    def test_filters_and_sorting(self):
+        """Test that filters apply to cursor pages and column sorting falls back to page numbers"""
+        pages, changelist = self.pages({'activity_type': 'Running'})
+        self.assertEqual(pages, [[105, 103, 101]])
+        pages, _ = self.pages({'user_email': 'ana@hero.com', 'activity_type': 'Cycling'})
+        self.assertEqual(pages, [[106, 104, 102], [100]])
+        self.assertNotIn('cursor', changelist.get_query_string({'activity_type': 'Cycling'}))
+        
+        response = self.client.get(self.url, {'o': '4'})
+        self.assertIsNone(response.context['cl'].keyset)
+        self.assertEqual([activity.calories for activity in response.context['cl'].result_list], [100, 101, 102])
+        
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 302)
+    
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_counts_are_estimated(self):
+        """Test that unfiltered counts come from collection metadata and filtered counts are capped"""
+        with mock.patch.object(changelist_module, 'get_collection') as get_collection_mock:
+            get_collection_mock.return_value.estimated_document_count.return_value = 7000000
+            changelist = self.client.get(self.url).context['cl']
+        self.assertEqual((changelist.result_count, changelist.full_result_count), (7000000, None))
+        self.assertEqual(changelist.paginator.count_display, '~7000000')
+        response = self.client.get(self.url, {'activity_type': 'Cycling'})
+        self.assertEqual(response.context['cl'].paginator.count_display, '3+')
+    
+    def test_filter_values_are_cached(self):
+        """Test that value filters list cached distinct values"""
+        self.assertContains(self.client.get(self.url), '?activity_type=Running')
+        get_collection(Activity).insert_one({'user_email': 'ana@hero.com', 'activity_type': 'Swimming',
+                                             'duration': 10, 'calories': 50, 'date': datetime(2024, 1, 1)})
+        self.assertNotContains(self.client.get(self.url), '?activity_type=Swimming')
+        caches['default'].clear()
+        self.assertContains(self.client.get(self.url), '?activity_type=Swimming')
+    
+    @override_settings(ADMIN_LARGE_CHANGELISTS=False)
+    def test_mode_off(self):
+        """Test that turning the mode off restores exact counts and page numbers"""
+        changelist = self.client.get(self.url).context['cl']
+        self.assertEqual((changelist.result_count, changelist.full_result_count), (7, 7))
+        self.assertNotIsInstance(changelist.paginator, changelist_module.EstimatedCountPaginator)
+
+
+class ActivityRollupTestCase(APITestCase):
+    """Test cases for the daily and weekly activity rollups"""
+    
+    def setUp(self):
+        self.blue = Team.objects.create(name='Blue', description='Blue team')
+        Team.objects.create(name='Red', description='Red team')
+        self.ana = User.objects.create(name='Ana', email='ana@hero.com', team='Blue')
+        User.objects.create(name='Bia', email='bia@hero.com', team='Blue')
+        User.objects.create(name='Caio', email='caio@hero.com', team='Red')
+        self.activities = []
+        for day in range(12):
+            email = ['ana@hero.com', 'bia@hero.com', 'caio@hero.com'][day % 3]
+            self.activities.append(Activity.objects.create(
+                user_email=email, activity_type=['Running', 'Cycling'][day % 2], duration=20 + day,
+                calories=100 + 10 * day, date=timezone.make_aware(datetime(2024, 3, 1 + day, 7 + day)),
+            ))
+    
+    def assertMatchesStats(self, params=None):
+        """Check the rollup endpoints against the stats aggregations over the raw activities"""
+        for bucket in ('day', 'week'):
+            query = dict(params or {}, bucket=bucket)
+            for rollup_url, stats_url, extra in [
+                (reverse('activity-rollups'), reverse('activity-stats'), {}),
+                (reverse('activity-rollups'), reverse('activity-stats'), {'email': 'ana@hero.com'}),
+                (reverse('team-rollups', args=[str(self.blue.pk)]), reverse('team-stats', args=[str(self.blue.pk)]), {}),
+            ]:
+                rollup = self.client.get(rollup_url, dict(query, **extra))
+                self.assertEqual(rollup.status_code, status.HTTP_200_OK)
+                self.assertEqual(rollup.data, self.client.get(stats_url, dict(query, **extra)).data, (rollup_url, extra))
+    
+    def snapshot(self):
+        return sorted(
+            tuple(sorted((key, json.dumps(value, sort_keys=True, default=str)) for key, value in document.items() if key != '_id'))
+            for document in get_collection(ActivityRollup).find()
+        )
+    
+    def test_series_match_stats(self):
+        """Test that rollup series equal the stats computed from the activities"""
+        self.assertMatchesStats()
+        self.assertMatchesStats({'since': '2024-03-04', 'until': '2024-03-10'})
+        response = self.client.get(reverse('activity-rollups'), {'bucket': 'week', 'email': 'ana@hero.com'})
+        self.assertEqual([row['period'] for row in response.data['buckets']], ['2024-W09', '2024-W10', '2024-W10'])
+    
+    def test_updates_and_deletes(self):
+        """Test that edited and deleted activities move between buckets"""
+        activity = self.activities[0]
+        activity.date = timezone.make_aware(datetime(2024, 3, 20, 9))
+        activity.activity_type = 'Swimming'
+        activity.save()
+        self.activities[1].calories = 999
+        self.activities[1].save()
+        self.activities[3].delete()
+        self.assertMatchesStats()
+        self.assertFalse(ActivityRollup.objects.filter(scope='user', key='ana@hero.com', bucket='2024-03-01').exists())
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+    
+    def test_bulk_create(self):
+        """Test that bulk-created activities are rolled up, including types with dots"""
+        response = self.client.post(reverse('activity-bulk'), [
+            {'user_email': 'bia@hero.com', 'activity_type': 'Cross.Fit', 'duration': 45,
+             'calories': 500, 'date': '2024-03-05T10:00:00Z'},
+            {'user_email': 'bia@hero.com', 'activity_type': 'Running', 'duration': 30,
+             'calories': 300, 'date': '2024-03-05T18:00:00Z'},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertMatchesStats()
+    
+    def test_user_and_team_changes(self):
+        """Test that team moves, email changes and team renames carry the rollups along"""
+        self.client.patch(reverse('user-detail', args=[str(self.ana.pk)]),
+                          {'team': 'Red', 'email': 'ana.maria@hero.com'}, format='json')
+        self.assertFalse(ActivityRollup.objects.filter(scope='user', key='ana@hero.com').exists())
+        team = Team.objects.get(name='Red')
+        team.name = 'Crimson'
+        team.save()
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+        red = self.client.get(reverse('team-rollups', args=[str(team.pk)]), {'bucket': 'week'})
+        self.assertEqual(red.data['count'], 8)
+    
+    @override_settings(JOBS_WORKER='external')
+    def test_backfill(self):
+        """Test that the backfill command and job rebuild the rollups from scratch"""
+        expected = self.snapshot()
+        get_collection(ActivityRollup).delete_many({})
+        out = StringIO()
+        call_command('backfill_rollups', stdout=out)
+        self.assertIn(f'Rebuilt {len(expected)} activity rollups', out.getvalue())
+        self.assertEqual(self.snapshot(), expected)
+        
+        get_collection(ActivityRollup).update_many({}, {'$inc': {'count': 5}})
+        get_collection(ActivityRollup).insert_one({'scope': 'all', 'key': '', 'period': 'day', 'bucket': '2020-01-01',
+                                                   'start': datetime(2020, 1, 1), 'count': 1, 'by_type': {}})
+        job = jobs.enqueue('rebuild_rollups')
+        jobs.work(burst=True)
+        self.assertEqual(Job.objects.get(pk=job['_id']).progress_done, 3)
+        self.assertEqual(self.snapshot(), expected)
+    
+    def test_resumed_rebuild(self):
+        """Test that a rebuild resumed at a week it already rebuilt counts nothing twice"""
+        expected = self.snapshot()
+        steps = tasks.rebuild_rollups({}, {})
+        crashed, _, _ = next(steps)
+        next(steps)
+        # The worker died before checkpointing the second week: resume from the first checkpoint.
+        for _ in tasks.rebuild_rollups({}, crashed):
+            pass
+        self.assertEqual(self.snapshot(), expected)
+    
+    def test_invalid_bucket(self):
+        """Test that an unknown bucket is rejected"""
+        response = self.client.get(reverse('activity-rollups'), {'bucket': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DeltaSyncTestCase(APITestCase):
+    """Test cases for updated_since delta sync and strong ETags"""
+    
+    def setUp(self):
+        caches['api'].clear()
+        self.ana = User.objects.create(name='Ana', email='ana@hero.com', team='Blue')
+        self.bia = User.objects.create(name='Bia', email='bia@hero.com', team='Blue')
+        self.activities = [
+            Activity.objects.create(user_email=email, activity_type='Running', duration=30, calories=300,
+                                    date=timezone.make_aware(datetime(2024, 3, day, 8)))
+            for day, email in ((1, 'ana@hero.com'), (2, 'ana@hero.com'), (3, 'ana@hero.com'), (4, 'bia@hero.com'))
+        ]
+        self.workout = Workout.objects.create(name='Sprint', description='Short sprints', category='Cardio',
+                                              difficulty='Beginner', estimated_calories=200, duration=20)
+        # Everything above predates the first sync.
+        for model in (User, Activity, Workout):
+            get_collection(model).update_many({}, {'$set': {'updated_at': timezone.now() - timedelta(hours=1)}})
+    
+    def by_user(self, email, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse('activity-by-user'), {'email': email, **params}, **headers)
+    
+    def ids(self, rows):
+        return sorted(row['_id'] for row in rows)
+    
+    @override_settings(SYNC_OVERLAP_SECONDS=0)
+    def test_activity_delta(self):
+        """Test that a delta lists the user's changed activities and deletions since the watermark"""
+        full = self.by_user('ana@hero.com')
+        self.assertEqual(len(full.data['results']), 3)
+        since = full['X-Sync-Watermark']
+        
+        changed, deleted = self.activities[0], str(self.activities[1].pk)
+        changed.calories = 450
+        changed.save()
+        self.activities[1].delete()
+        self.activities[3].delete()
+        created = Activity.objects.create(user_email='ana@hero.com', activity_type='Yoga', duration=60,
+                                          calories=200, date=timezone.make_aware(datetime(2024, 3, 5, 8)))
+        
+        response = self.by_user('ana@hero.com', updated_since=since)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(response.data['results']), sorted([str(changed.pk), str(created.pk)]))
+        self.assertEqual(response.data['deleted'], [deleted])
+        self.assertNotIn('watermark', response.data)
+        
+        response = self.by_user('ana@hero.com', updated_since=response['X-Sync-Watermark'])
+        self.assertEqual((response.data['results'], response.data['deleted']), ([], []))
+    
+    def test_watermark_overlap(self):
+        """Test that the watermark trails the clock so late commits reach the next delta"""
+        with mock.patch('octofit_tracker.repositories.get_read_collection',
+                        side_effect=AssertionError('delta read from a secondary')):
+            response = self.by_user('ana@hero.com')
+            since = response['X-Sync-Watermark']
+            self.assertLessEqual(sync.parse_watermark(since), timezone.now() - timedelta(seconds=5))
+            
+            # Stamped before the response was built, committed after it.
+            late = self.activities[0]
+            get_collection(Activity).update_one(
+                {'_id': late.pk}, {'$set': {'updated_at': timezone.now() - timedelta(seconds=1)}},
+            )
+            response = self.by_user('ana@hero.com', updated_since=since)
+        self.assertEqual(self.ids(response.data['results']), [str(late.pk)])
+    
+    def test_email_change(self):
+        """Test that activities moved to a new email are tombstoned for the old one"""
+        since = self.by_user('ana@hero.com')['X-Sync-Watermark']
+        self.client.patch(reverse('user-detail', args=[str(self.ana.pk)]), {'email': 'ana.maria@hero.com'},
+                          format='json')
+        moved = sorted(str(activity.pk) for activity in self.activities[:3])
+        self.assertEqual(sorted(self.by_user('ana@hero.com', updated_since=since).data['deleted']), moved)
+        self.assertEqual(self.ids(self.by_user('ana.maria@hero.com', updated_since=since).data['results']), moved)
+        
+        users = self.client.get(reverse('user-list'), {'updated_since': since}).data
+        self.assertEqual([user['email'] for user in users['results']], ['ana.maria@hero.com'])
+    
+    def test_users_and_workouts(self):
+        """Test delta sync of the user and workout lists"""
+        users = self.client.get(reverse('user-list'))
+        self.assertEqual(len(users.data), 2)
+        since = users['X-Sync-Watermark']
+        workouts = self.client.get(reverse('workout-list'))
+        self.assertFalse(workouts.has_header('Last-Modified'))
+        with mock.patch('octofit_tracker.views.LeanListMixin.lean_response',
+                        side_effect=AssertionError('list built for a 304')):
+            repeated = self.client.get(reverse('workout-list'), HTTP_IF_NONE_MATCH=workouts['ETag'])
+        self.assertEqual(repeated.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        bia = str(self.bia.pk)
+        self.bia.delete()
+        self.workout.duration = 25
+        self.workout.save()
+        users = self.client.get(reverse('user-list'), {'updated_since': since}).data
+        self.assertEqual((users['results'], users['deleted']), ([], [bia]))
+        workouts = self.client.get(reverse('workout-list'), {'updated_since': since}).data
+        self.assertEqual([workout['duration'] for workout in workouts['results']], [25])
+        self.assertEqual(workouts['deleted'], [])
+    
+    def test_unavailable_delta(self):
+        """Test that malformed, expired and oversized deltas are refused"""
+        self.assertEqual(self.by_user('ana@hero.com', updated_since='yesterday').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        expired = sync.format_watermark(timezone.now() - timedelta(days=31))
+        self.assertEqual(self.by_user('ana@hero.com', updated_since=expired).status_code, status.HTTP_410_GONE)
+        
+        since = sync.format_watermark(timezone.now() - timedelta(hours=2))
+        with override_settings(SYNC_MAX_CHANGES=2):
+            self.assertEqual(self.by_user('ana@hero.com', updated_since=since).status_code, status.HTTP_410_GONE)
+            self.assertEqual(self.by_user('bia@hero.com', updated_since=since).status_code, status.HTTP_200_OK)
+            sync.record_moves('user', [ObjectId() for _ in range(3)], '')
+            response = self.client.get(reverse('user-list'), {'updated_since': since})
+            self.assertEqual(response.status_code, status.HTTP_410_GONE)
+    
+    def test_strong_etag(self):
+        """Test that list actions carry a strong ETag and answer If-None-Match with 304 without listing"""
+        for url, params in ((reverse('activity-by-user'), {'email': 'ana@hero.com'}),
+                            (reverse('user-list'), {}), (reverse('activity-list'), {}),
+                            (reverse('user-by-team'), {'team': 'Blue'})):
+            response = self.client.get(url, params)
+            self.assertFalse(response['ETag'].startswith('W/'))
+            with mock.patch('octofit_tracker.views.LeanListMixin.lean_response',
+                            side_effect=AssertionError('list built for a 304')):
+                repeated = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(repeated.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(repeated['ETag'], response['ETag'])
+        
+        etag = self.by_user('ana@hero.com')['ETag']
+        self.activities[0].delete()
+        response = self.client.get(reverse('activity-by-user'), {'email': 'ana@hero.com'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The deletion is too recent to version the list by, so the ETag is taken over the data.
+        self.assertEqual(response['ETag'], caching.data_etag(response.data))
+        repeated = self.client.get(reverse('activity-by-user'), {'email': 'ana@hero.com'},
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeated.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        get_collection(Tombstone).update_many({}, {'$set': {'deleted_at': timezone.now() - timedelta(minutes=1)}})
+        response = self.client.get(reverse('activity-by-user'), {'email': 'ana@hero.com'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_etag_per_origin(self):
+        """Test that pages linking to different hosts get different ETags"""
+        url = reverse('activity-list')
+        local = self.client.get(url, {'page_size': 1}, HTTP_HOST='localhost')
+        loopback = self.client.get(url, {'page_size': 1}, HTTP_HOST='127.0.0.1', HTTP_IF_NONE_MATCH=local['ETag'])
+        self.assertEqual(loopback.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(loopback['ETag'], local['ETag'])
+    
+    def test_unchanged_delta(self):
+        """Test that a delta answers 304 when nothing changed since the previous one"""
+        since = sync.format_watermark(timezone.now() - timedelta(hours=2))
+        first = self.by_user('ana@hero.com', updated_since=since)
+        self.assertEqual(len(first.data['results']), 3)
+        
+        response = self.by_user('ana@hero.com', updated_since=first['X-Sync-Watermark'],
+                                etag=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('X-Sync-Watermark', response)
+        
+        # Committed after the first delta, stamped within its overlap.
+        get_collection(Activity).update_one({'_id': self.activities[0].pk},
+                                            {'$set': {'updated_at': sync.parse_watermark(first['X-Sync-Watermark'])}})
+        response = self.by_user('ana@hero.com', updated_since=first['X-Sync-Watermark'],
+                                etag=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(response.data['results']), [str(self.activities[0].pk)])
@@ -13,10 +13,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from octofit_tracker import views
+from octofit_tracker import health, instrumentation, views
 import os
 
 # Configure API base URL for Codespace or localhost
@@ -33,10 +34,20 @@ router.register(r'users', views.UserViewSet)
 router.register(r'teams', views.TeamViewSet)
 router.register(r'activities', views.ActivityViewSet)
 router.register(r'leaderboard', views.LeaderboardViewSet)
+router.register(r'team-leaderboard', views.TeamLeaderboardViewSet)
 router.register(r'workouts', views.WorkoutViewSet)
+router.register(r'jobs', views.JobViewSet)
+router.register(r'search', views.SearchViewSet, basename='search')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('health/', health.health_view, name='health'),
+    path('api/async/leaderboard/', views.async_leaderboard, name='async-leaderboard'),
+    path('api/async/activities/by_user/', views.async_activities_by_user, name='async-activities-by-user'),
+    path('api/async/workouts/', views.async_workouts, name='async-workouts'),
     path('api/', include(router.urls)),
     path('', include(router.urls)),  # Root points to API
 ]
+
+if settings.REQUEST_METRICS_ENDPOINT:
+    urlpatterns.insert(0, path('metrics', instrumentation.metrics_view, name='metrics'))
@@ -1,22 +1,191 @@
-from rest_framework import viewsets
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.models import (
+    User, Team, Activity, Leaderboard, PeriodLeaderboard, TeamLeaderboard, Workout, Job, SearchEntry,
+)
 from octofit_tracker.serializers import (
     UserSerializer, 
     TeamSerializer, 
     ActivitySerializer, 
     LeaderboardSerializer, 
-    WorkoutSerializer
+    TeamLeaderboardSerializer,
+    WorkoutSerializer,
+    JobSerializer,
+    activity_rows,
+    leaderboard_rows,
+    team_leaderboard_rows,
+    workout_rows,
+    user_rows,
 )
+from octofit_tracker.pagination import ActivityPagination, LeaderboardPagination
+from octofit_tracker import export, stats
+from octofit_tracker import caching, leaderboard, rollups, search, sync
+from octofit_tracker.caching import cached_response
+from octofit_tracker.mongo import get_collection
+from octofit_tracker.parsers import NDJSONParser
+from octofit_tracker.repositories import OrmRepository, MongoRepository, AsyncMongoRepository
+
+
+class ObjectIdLookupMixin:
+    """Convert the URL pk to an ObjectId so djongo can match ``_id``."""
+    
+    def get_object(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            self.kwargs[lookup_url_kwarg] = ObjectId(self.kwargs[lookup_url_kwarg])
+        except (InvalidId, TypeError):
+            raise Http404
+        return super().get_object()
+
+
+class LeanListMixin:
+    """
+    Serve read-only list actions from ``.values()`` rows.
+    
+    ``row_mapper`` renders rows exactly like ``serializer_class`` without
+    building model instances or running the serializer per field.
+    Filtered actions look rows up through ``repository_class``, so a
+    viewset can swap djongo for direct pymongo reads.
+    """
+    row_mapper = None
+    repository_class = OrmRepository
+    
+    def get_repository(self, primary=False):
+        return self.repository_class(self.queryset.model, primary=primary)
+    
+    def lean_response(self, queryset):
+        rows = queryset.values(*self.row_mapper.fields)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(self.row_mapper(rows))
+        return self.get_paginated_response(self.row_mapper(page))
+    
+    def list(self, request, *args, **kwargs):
+        return self.lean_response(self.filter_queryset(self.get_queryset()))
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class DeltaSyncMixin:
+    """
+    Delta sync for lean list actions (see sync.py).
+    
+    ``synced_response`` answers ``?updated_since=`` with the rows changed
+    since and the ids deleted since; without it the full list is returned.
+    Both carry the new watermark in ``X-Sync-Watermark``, so both must read
+    from the primary, and an ETag derived from ``sync.version``.
+    """
+    
+    def synced_response(self, request, full_list, owner='', **lookups):
+        mark = sync.watermark()
+        since = None
+        try:
+            if 'updated_since' in request.query_params:
+                since = sync.parse_watermark(request.query_params['updated_since'])
+        except ValueError:
+            return Response({'error': 'updated_since must be an ISO date or datetime'}, status=400)
+        except sync.Gone as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_410_GONE)
+        version = sync.version(self.queryset.model, owner, **lookups)
+        # A delta is "nothing new" whatever updated_since is, once the version is unchanged.
+        response = self.versioned_response(
+            request, version and [since is not None, version],
+            full_list if since is None else lambda: self.delta_response(since, owner, lookups),
+            ignore=('updated_since',),
+        )
+        return self.watermarked(response, mark)
+    
+    def delta_response(self, since, owner, lookups):
+        try:
+            changed = self.get_repository(primary=True).filter(**lookups, updated_at__gte=since).order_by('updated_at', '_id')
+            rows = list(changed.values(*self.row_mapper.fields)[:settings.SYNC_MAX_CHANGES + 1])
+            if len(rows) > settings.SYNC_MAX_CHANGES:
+                raise sync.Gone(f'More than {settings.SYNC_MAX_CHANGES} changes since updated_since')
+            deleted = sync.deleted_since(sync.KINDS[self.queryset.model], since, owner)
+        except sync.Gone as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_410_GONE)
+        return Response({'results': self.row_mapper(rows), 'deleted': deleted})
+    
+    def versioned_response(self, request, version, build, ignore=()):
+        """
+        Tag ``build()`` with an ETag over ``version``, or answer a matching
+        ``If-None-Match`` with 304 without calling it. Without a version
+        (see ``sync.version``) the ETag is taken over the built data instead.
+        """
+        if version is None:
+            response = build()
+            if response.status_code != 200:
+                return response
+            etag = caching.data_etag(response.data)
+            if caching.etag_matches(request, etag):
+                response = HttpResponseNotModified()
+        else:
+            etag = caching.version_etag(request, version, ignore)
+            response = HttpResponseNotModified() if caching.etag_matches(request, etag) else build()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+        return response
+    
+    def watermarked(self, response, mark):
+        if response.status_code in (200, 304):
+            response['X-Sync-Watermark'] = sync.format_watermark(mark)
+        return response
+
+
+def date_range(request):
+    """Parse the since/until query params; raises ValueError when malformed."""
+    since = request.query_params.get('since')
+    until = request.query_params.get('until')
+    since = stats.parse_bound(since) if since else None
+    until = stats.parse_bound(until, end_of_day=True) if until else None
+    return since, until
+
+
+def activity_stats_response(request, user_emails=None):
+    """Run the stats aggregation for the request's since/until/bucket params."""
+    bucket = request.query_params.get('bucket', 'day')
+    if bucket not in stats.BUCKET_FORMATS:
+        return Response({'error': 'Bucket must be one of: day, week'}, status=400)
+    try:
+        since, until = date_range(request)
+    except ValueError:
+        return Response({'error': 'since/until must be ISO dates or datetimes'}, status=400)
+    match = stats.activity_match(user_emails, since, until)
+    return Response(stats.activity_stats(match, bucket))
+
+
+def rollup_response(request, scope, key):
+    """Answer the stats params from the ``scope``/``key`` rollups alone."""
+    bucket = request.query_params.get('bucket', 'day')
+    if bucket not in rollups.PERIODS:
+        return Response({'error': 'Bucket must be one of: day, week'}, status=400)
+    try:
+        since, until = date_range(request)
+    except ValueError:
+        return Response({'error': 'since/until must be ISO dates or datetimes'}, status=400)
+    return Response(rollups.series(scope, key, bucket, since, until))
+
+
+class UserViewSet(ObjectIdLookupMixin, DeltaSyncMixin, LeanListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing users.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    row_mapper = user_rows
+    repository_class = MongoRepository
+    
+    def list(self, request, *args, **kwargs):
+        """All users, or with ?updated_since= only the changes since."""
+        return self.synced_response(request, lambda: LeanListMixin.list(self, request, *args, **kwargs))
     
     @action(detail=False, methods=['get'])
     def by_team(self, request):
@@ -24,78 +193,369 @@ class UserViewSet(viewsets.ModelViewSet):
         team = request.query_params.get('team', None)
         if team:
             users = User.objects.filter(team=team)
-            serializer = self.get_serializer(users, many=True)
-            return Response(serializer.data)
+            # Users leaving the team are not tombstoned, so any user change counts.
+            return self.versioned_response(request, sync.version(User),
+                                           lambda: Response(self.get_serializer(users, many=True).data))
         return Response({'error': 'Team parameter required'}, status=400)
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ObjectIdLookupMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing teams.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    
+    @cached_response('teams')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get activity totals, averages and buckets for a team's members."""
+        team = self.get_object()
+        return activity_stats_response(request, stats.team_member_emails(team.name))
+    
+    @action(detail=True, methods=['get'])
+    def rollups(self, request, pk=None):
+        """Get the team's daily or weekly activity series from the rollups."""
+        team = self.get_object()
+        return rollup_response(request, 'team', team.name)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ObjectIdLookupMixin, DeltaSyncMixin, LeanListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing activities.
     """
     queryset = Activity.objects.all().order_by('-date')
     serializer_class = ActivitySerializer
+    pagination_class = ActivityPagination
+    row_mapper = activity_rows
+    repository_class = MongoRepository
+    bulk_max_items = 5000
+    
+    def list(self, request, *args, **kwargs):
+        version = sync.version(Activity)
+        return self.versioned_response(request, version, lambda: LeanListMixin.list(self, request, *args, **kwargs))
     
     @action(detail=False, methods=['get'])
     def by_user(self, request):
-        """Get activities for a specific user."""
+        """Get activities for a specific user, or with ?updated_since= only the changes since."""
         email = request.query_params.get('email', None)
         if email:
-            activities = Activity.objects.filter(user_email=email).order_by('-date')
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            activities = self.get_repository(primary=True).filter(user_email=email).order_by('-date')
+            return self.synced_response(request, lambda: self.lean_response(activities), owner=email, user_email=email)
         return Response({'error': 'Email parameter required'}, status=400)
+    
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Get activity totals, averages and buckets, optionally for one user."""
+        email = request.query_params.get('email', None)
+        return activity_stats_response(request, [email] if email else None)
+    
+    @action(detail=False, methods=['get'])
+    def rollups(self, request):
+        """Get the daily or weekly activity series, optionally for one user, from the rollups."""
+        email = request.query_params.get('email', None)
+        return rollup_response(request, 'user', email) if email else rollup_response(request, 'all', '')
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """Create many activities from a JSON array or NDJSON body."""
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a JSON array or NDJSON body'}, status=400)
+        if len(items) > self.bulk_max_items:
+            return Response({'error': f'At most {self.bulk_max_items} activities per request'}, status=400)
+        
+        serializer = self.get_serializer(many=True)
+        documents, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                documents.append(dict(serializer.child.run_validation(item)))
+            except serializers.ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+        
+        if documents:
+            updated_at = timezone.now()
+            for document in documents:
+                document['updated_at'] = updated_at
+            get_collection(Activity).insert_many(documents, ordered=False)
+            leaderboard.apply_activities(documents)
+            rollups.apply(documents)
+            caching.invalidate_for(Activity)
+        
+        if not documents:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({
+            'created': len(documents),
+            'ids': [str(document['_id']) for document in documents],
+            'errors': errors,
+        }, status=response_status)
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream activities as NDJSON (default) or CSV with ?as=csv."""
+        output = request.query_params.get('as', 'ndjson')
+        if output not in export.STREAMS:
+            return Response({'error': 'as must be one of: ndjson, csv'}, status=400)
+        try:
+            since, until = date_range(request)
+        except ValueError:
+            return Response({'error': 'since/until must be ISO dates or datetimes'}, status=400)
+        email = request.query_params.get('user_email', None)
+        match = stats.activity_match([email] if email else None, since, until)
+        documents = export.activity_documents(match)
+        response = StreamingHttpResponse(export.STREAMS[output](documents), content_type=export.CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="activities.{output}"'
+        return response
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(ObjectIdLookupMixin, LeanListMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing leaderboard.
     """
     queryset = Leaderboard.objects.all().order_by('rank')
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardPagination
+    row_mapper = leaderboard_rows
+    repository_class = MongoRepository
+    
+    max_window = 100
+    
+    def ranking(self, request):
+        """
+        Return ``(model, scope)`` for the ranking selected by ?period= (and
+        ?bucket=), or ``(None, error_response)``.
+        """
+        period = request.query_params.get('period', 'all')
+        if period == 'all':
+            return Leaderboard, {}
+        if period not in leaderboard.PERIODS:
+            return None, Response({'error': 'Period must be one of: day, week, month, all'}, status=400)
+        bucket = request.query_params.get('bucket') or leaderboard.bucket_key(period, timezone.now())
+        try:
+            leaderboard.parse_bucket(period, bucket)
+        except ValueError:
+            return None, Response({'error': f'Invalid {period} bucket: {bucket}'}, status=400)
+        return PeriodLeaderboard, {'period': period, 'bucket': bucket}
+    
+    def window_param(self, request, name, default):
+        """Parse a positive count capped at ``max_window``; raises ValueError."""
+        value = int(request.query_params.get(name, default))
+        if value < 1:
+            raise ValueError(name)
+        return min(value, self.max_window)
+    
+    def rank_window(self, model, scope, first, last):
+        """Rows ranked ``first`` to ``last``, read off the rank index."""
+        entries = self.repository_class(model).filter(**scope, rank__gte=first, rank__lte=last)
+        return self.row_mapper(entries.order_by('rank', '_id').values(*self.row_mapper.fields))
+    
+    @cached_response('leaderboard')
+    def list(self, request, *args, **kwargs):
+        """
+        All-time ranking, or one day/week/month with ?period= (and ?bucket=).
+        ?top=K returns only the first K entries.
+        """
+        model, scope = self.ranking(request)
+        if model is None:
+            return scope
+        if 'top' in request.query_params:
+            try:
+                top = self.window_param(request, 'top', None)
+            except (TypeError, ValueError):
+                return Response({'error': f'top must be an integer between 1 and {self.max_window}'}, status=400)
+            return Response({'results': self.rank_window(model, scope, 1, top)})
+        if model is Leaderboard:
+            return super().list(request, *args, **kwargs)
+        return self.lean_response(self.repository_class(model).filter(**scope))
+    
+    @action(detail=False, methods=['get'], url_path=r'around/(?P<email>[^/]+)')
+    @cached_response('leaderboard')
+    def around(self, request, email=None):
+        """A user's rank and the ?n= (default 5) entries above and below it."""
+        model, scope = self.ranking(request)
+        if model is None:
+            return scope
+        try:
+            n = self.window_param(request, 'n', 5)
+        except ValueError:
+            return Response({'error': f'n must be an integer between 1 and {self.max_window}'}, status=400)
+        entry = self.repository_class(model).filter(**scope, user_email=email).values('rank')[:1]
+        if not entry:
+            return Response({'error': f'{email} is not on the leaderboard'}, status=404)
+        rank = entry[0]['rank']
+        return Response({
+            'user_email': email,
+            'rank': rank,
+            'results': self.rank_window(model, scope, max(1, rank - n), rank + n),
+        })
     
     @action(detail=False, methods=['get'])
+    @cached_response('leaderboard')
     def by_team(self, request):
         """Get leaderboard filtered by team."""
         team = request.query_params.get('team', None)
         if team:
-            leaderboard = Leaderboard.objects.filter(team=team).order_by('rank')
-            serializer = self.get_serializer(leaderboard, many=True)
-            return Response(serializer.data)
+            leaderboard = self.get_repository().filter(team=team).order_by('rank')
+            return self.lean_response(leaderboard)
         return Response({'error': 'Team parameter required'}, status=400)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class TeamLeaderboardViewSet(ObjectIdLookupMixin, LeanListMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for viewing the team leaderboard.
+    """
+    queryset = TeamLeaderboard.objects.all().order_by('rank')
+    serializer_class = TeamLeaderboardSerializer
+    pagination_class = LeaderboardPagination
+    row_mapper = team_leaderboard_rows
+    
+    @cached_response('leaderboard')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class WorkoutViewSet(ObjectIdLookupMixin, DeltaSyncMixin, LeanListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing workouts.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    row_mapper = workout_rows
+    repository_class = MongoRepository
+    
+    def list(self, request, *args, **kwargs):
+        """All workouts, or with ?updated_since= only the changes since."""
+        return self.synced_response(request, lambda: LeanListMixin.list(self, request, *args, **kwargs))
     
     @action(detail=False, methods=['get'])
+    @cached_response('workouts')
     def by_difficulty(self, request):
         """Get workouts filtered by difficulty."""
         difficulty = request.query_params.get('difficulty', None)
         if difficulty:
-            workouts = Workout.objects.filter(difficulty=difficulty)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            return self.lean_response(self.get_repository().filter(difficulty=difficulty))
         return Response({'error': 'Difficulty parameter required'}, status=400)
     
     @action(detail=False, methods=['get'])
+    @cached_response('workouts')
     def by_category(self, request):
         """Get workouts filtered by category."""
         category = request.query_params.get('category', None)
         if category:
-            workouts = Workout.objects.filter(category=category)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            return self.lean_response(self.get_repository().filter(category=category))
         return Response({'error': 'Category parameter required'}, status=400)
+
+
+class JobViewSet(ObjectIdLookupMixin, mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for queuing background jobs and following their progress.
+    """
+    queryset = Job.objects.all().order_by('-created_at')
+    serializer_class = JobSerializer
+    
+    def create(self, request, *args, **kwargs):
+        """Queue a job; it runs off the request thread (202 Accepted)."""
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+
+class SearchViewSet(viewsets.GenericViewSet):
+    """
+    API endpoint for searching users and workouts.
+    """
+    queryset = SearchEntry.objects.all()
+    max_limit = 50
+    
+    def search_params(self, request, default_limit):
+        """
+        Return ``(params, None)`` for ?q=, ?kind= (repeatable) and ?limit=,
+        or ``(None, error_response)``.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return None, Response({'error': 'q parameter required'}, status=400)
+        kinds = request.query_params.getlist('kind')
+        if not set(kinds) <= set(search.SOURCES):
+            return None, Response({'error': 'kind must be one of: user, workout'}, status=400)
+        try:
+            limit = int(request.query_params.get('limit', default_limit))
+            if limit < 1:
+                raise ValueError(limit)
+        except ValueError:
+            return None, Response({'error': f'limit must be an integer between 1 and {self.max_limit}'}, status=400)
+        return {'query': query, 'kinds': kinds, 'limit': min(limit, self.max_limit)}, None
+    
+    def list(self, request):
+        """Full-text search, most relevant first; ?kind= narrows the kinds searched."""
+        params, error = self.search_params(request, 20)
+        if error:
+            return error
+        return Response({'query': params['query'], 'results': search.search(**params)})
+    
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """User and workout names starting with ?q= (or with a word starting with it)."""
+        params, error = self.search_params(request, 10)
+        if error:
+            return error
+        params['kinds'] = params['kinds'] or search.AUTOCOMPLETE_KINDS
+        return Response({'query': params['query'], 'results': search.autocomplete(**params)})
+
+
+# Async read path. These plain Django async views serve the hottest reads
+# under ASGI without tying up a thread per request; Mongo calls run on the
+# shared pool in octofit_tracker/aio.py. Rows, pagination and JSON match
+# the DRF endpoints above, but responses are not cached.
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+async def lean_async_response(request, query, row_mapper, pagination_class=None):
+    """Async ``LeanListMixin.lean_response`` for an ``AsyncMongoQuery``."""
+    rows = query.values(*row_mapper.fields)
+    if pagination_class is None:
+        return json_response(row_mapper(await rows.fetch()))
+    paginator = pagination_class()
+    try:
+        page = await paginator.apaginate_queryset(rows, Request(request))
+    except NotFound as exc:
+        return json_response({'detail': exc.detail}, status=404)
+    return json_response(paginator.get_paginated_data(row_mapper(page)))
+
+
+async def async_leaderboard(request):
+    """Get the leaderboard, optionally filtered by ?team=."""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    team = request.GET.get('team', None)
+    query = AsyncMongoRepository(Leaderboard).filter(**({'team': team} if team else {}))
+    return await lean_async_response(request, query, leaderboard_rows, LeaderboardPagination)
+
+
+async def async_activities_by_user(request):
+    """Get activities for a specific user."""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    email = request.GET.get('email', None)
+    if not email:
+        return json_response({'error': 'Email parameter required'}, status=400)
+    query = AsyncMongoRepository(Activity).filter(user_email=email)
+    return await lean_async_response(request, query, activity_rows, ActivityPagination)
+
+
+async def async_workouts(request):
+    """Get workouts, optionally filtered by ?difficulty= and ?category=."""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    lookups = {name: request.GET[name] for name in ('difficulty', 'category') if request.GET.get(name)}
+    query = AsyncMongoRepository(Workout).filter(**lookups)
+    return await lean_async_response(request, query, workout_rows)